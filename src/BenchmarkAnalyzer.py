@@ -17,7 +17,17 @@ import sys
 from QueryStats import MongoQuerier
 import pygooglechart
 import time
+import datetime
 import csv
+import BenchmarkRollups
+
+
+# Benchmark entries are graphed in time order, which the Timestamp suffix of
+# the benchmark collection indexes (see MongoLogger.BENCHMARK_INDEXES) serves
+BY_TIME = [("Timestamp", 1)]
+# Shortest time range read from each rollup granularity; shorter ranges are
+# read from the raw entries
+COARSE_RANGES = [("day", datetime.timedelta(days=14)), ("hour", datetime.timedelta(days=1))]
 
 
 class BenchmarkDataGrabber:
@@ -37,7 +47,7 @@ class BenchmarkDataGrabber:
     servers = self.querier.getDistinct('Hostname')
     graphData = {}
     for server in servers:
-      rawData = self.querier.queryCollection({"Hostname" : server})
+      rawData = self.querier.queryCollection({"Hostname" : server}, BY_TIME)
       singleGraphData = []
       for entry in rawData:
         time = entry['Timestamp']
@@ -50,7 +60,7 @@ class BenchmarkDataGrabber:
     '''Function to get graph data for the insertion speed benchmarks. 
        Returns a list of (x,y) values (timestamp, secondsToInsert)'''
     self.querier.switchCollection(self.db, 'insertion_speed')
-    rawData = self.querier.queryCollection() #gets all the elements in the collection
+    rawData = self.querier.queryCollection({"EntryType" : "Insertion Speed"}, BY_TIME)
     graphData = []
     for entry in rawData:
       time = entry['Timestamp']
@@ -58,6 +68,34 @@ class BenchmarkDataGrabber:
       graphData.append((time, speedSecs))
     return graphData
   
+  def getInsertSpeedSeriesGraphData(self):
+    '''Function to get graph data for tagged insertion speed benchmarks, such
+       as the write concern/ordering runs of InsertBenchmark. Returns a
+       dictionary of series-data_values key-value pairs, where the data_values
+       is a list of (x,y) values (insertAmount, secondsToInsert)'''
+    self.querier.switchCollection(self.db, 'insertion_speed')
+    series_names = self.querier.getDistinct('Series')
+    graphData = {}
+    for series in series_names:
+      rawData = self.querier.queryCollection({"Series" : series, "EntryType" : "Insertion Speed"}, BY_TIME)
+      singleGraphData = []
+      for entry in rawData:
+        singleGraphData.append((entry['InsertAmount'], entry['SecondsToInsert']))
+      graphData[series] = singleGraphData
+    return graphData
+  
+  def getInsertLatencySummaryData(self):
+    '''Function to get the insert latency percentiles of every run that
+       logged an "Insertion Latency Summary". Returns a list of (series,
+       timestamp, summary) values, where summary holds the Count, Mean, p50,
+       p90, p99, p99_9 and Max latency in seconds.'''
+    self.querier.switchCollection(self.db, 'insertion_speed')
+    rawData = self.querier.queryCollection({"EntryType" : "Insertion Latency Summary"}, BY_TIME)
+    data = []
+    for entry in rawData:
+      data.append((entry.get('Series', ''), entry['Timestamp'], entry['Summary']))
+    return data
+  
   def getQuerySpeedGraphData(self):
     '''Function to get graph data for the querying speed benchmarks.
        Returns a dictionary of query-data_values key-value pairs,
@@ -66,7 +104,7 @@ class BenchmarkDataGrabber:
     queries = self.querier.getDistinct('Query')
     graphData = {}
     for qry in queries:
-      rawData = self.querier.queryCollection({"EntryType" : "Query Explain", "Query" : qry})
+      rawData = self.querier.queryCollection({"EntryType" : "Query Explain", "Query" : qry}, BY_TIME)
       singleGraphData = []
       for entry in rawData:
         totalNumScanned = entry['nscanned']
@@ -84,7 +122,7 @@ class BenchmarkDataGrabber:
     queries = self.querier.getDistinct('Mapper')
     graphData = {}
     for qry in queries:
-      rawData = self.querier.queryCollection({"EntryType" : "Map Reduce Info", "Mapper" : qry})
+      rawData = self.querier.queryCollection({"EntryType" : "Map Reduce Info", "Mapper" : qry}, BY_TIME)
       singleGraphData = []
       for entry in rawData:
         totalNumScanned = entry['counts']['input']
@@ -93,6 +131,136 @@ class BenchmarkDataGrabber:
       graphData[qry] = singleGraphData
     return graphData
   
+  def getQueryTimingGraphData(self):
+    '''Function to get graph data for the backend comparison query timings
+       logged by QueryWorkload. Returns a dictionary of query-data_values
+       key-value pairs, where the data_values is a list of (x,y) values
+       (backend, medianSeconds)'''
+    self.querier.switchCollection(self.db, 'query_speed')
+    rawData = self.querier.queryCollection({"EntryType" : "Query Timing"}, BY_TIME)
+    graphData = {}
+    for entry in rawData:
+      graphData.setdefault(entry['Query'], []).append((entry['Backend'], entry['MedianSeconds']))
+    return graphData
+  
+  def getQueryStreamData(self):
+    '''Function to get the streamed query timings logged by
+       MongoQuerier.getQueryStreamLogEntry. Returns a dictionary of
+       query-data_values key-value pairs, where the data_values is a list of
+       timing entries (Timestamp, BatchSize, Documents, Bytes, RoundTrips,
+       FirstBatchSeconds, FetchSeconds, ClientSeconds, TotalSeconds and
+       DocsPerSecond).'''
+    self.querier.switchCollection(self.db, 'query_speed')
+    rawData = self.querier.queryCollection({"EntryType" : "Query Stream Timing"}, BY_TIME)
+    graphData = {}
+    for entry in rawData:
+      graphData.setdefault(entry['Query'], []).append(entry)
+    return graphData
+  
+  def getTrialData(self):
+    '''Function to get the repeated trial summaries logged by TrialRunner.
+       Returns a dictionary of (name, mode)-summaries key-value pairs, where
+       the summaries are in time order, and each holds its Samples and their
+       Mean, Median, StdDev and 95% confidence interval.'''
+    self.querier.switchCollection(self.db, 'query_speed')
+    rawData = self.querier.queryCollection({"EntryType" : "Trial Summary"}, BY_TIME)
+    graphData = {}
+    for entry in rawData:
+      graphData.setdefault((entry['Name'], entry['Mode']), []).append(entry)
+    return graphData
+  
+  def getQueryLoadData(self):
+    '''Function to get the results of the query load runs logged by
+       QueryLoad. Returns a list of (timestamp, driver, load, qps, byQuery)
+       values, where the load is the number of clients of a closed loop run,
+       or the target QPS of an open loop run, and byQuery holds the Count,
+       QPS, p50, p90, p99 and Max latency in seconds of every query type.'''
+    self.querier.switchCollection(self.db, 'query_speed')
+    rawData = self.querier.queryCollection({"EntryType" : "Query Load"}, BY_TIME)
+    data = []
+    for entry in rawData:
+      if entry['Driver'] == 'open loop':
+        load = entry['TargetQPS']
+      else:
+        load = entry['Clients']
+      data.append((entry['Timestamp'], entry['Driver'], load, entry['QPS'], entry['ByQuery']))
+    return data
+  
+  def _trendGranularity(self, start, end):
+    '''Helper function to pick the rollup granularity to read a time range
+       from, or None for the raw entries'''
+    for granularity, shortest in COARSE_RANGES:
+      if end - start >= shortest:
+        return granularity
+    return None
+  
+  def _rolledUpTo(self, coll_name, granularity):
+    '''Helper function to get the watermark of a rollup collection, before
+       which every period has been rolled up from the raw entries'''
+    self.querier.switchCollection(self.db, BenchmarkRollups.ROLLUP_STATE_COLLECTION)
+    state = self.querier.queryCollection({"_id" : coll_name + '/' + granularity})
+    if state:
+      return state[0]["RolledUpTo"]
+    return None
+  
+  def getTrendData(self, coll_name, metric, start, end, query=None):
+    '''Function to get the trend of a metric of a rolled up benchmark
+       collection (e.g. SecondsToInsert of insertion_speed) from start to end.
+       Coarse ranges are read from the daily or hourly rollups (see
+       COARSE_RANGES), plus the raw entries of the periods not rolled up
+       yet; short ranges from the raw entries. query filters on the series
+       fields (e.g. {"EntryType" : "Insertion Speed"}). Returns a dictionary
+       of series-data_values key-value pairs, where the series is made of
+       the values of the rollup key fields not fixed by query, and the data_values is a list of
+       (time, summary) values, summary holding the Count, Mean, Min, Max,
+       p50, p90 and p99 of the metric in that period (or of a single entry).'''
+    key_fields, metrics = BenchmarkRollups.ROLLUP_SPECS[coll_name]
+    query = query or {}
+    granularity = self._trendGranularity(start, end)
+    graphData = {}
+    if granularity is None:
+      raw_query = dict(query, Timestamp={"$gte" : start, "$lt" : end})
+      self.querier.switchCollection(self.db, coll_name)
+      for entry in self.querier.queryCollection(raw_query, BY_TIME):
+        value = entry.get(metric)
+        if value is None:
+          continue
+        series = '/'.join([str(entry[field]) for field in key_fields if field in entry and field not in query])
+        summary = {"Count" : 1, "Mean" : value, "Min" : value, "Max" : value}
+        for name, percent in BenchmarkRollups.TREND_PERCENTILES:
+          summary[name] = value
+        graphData.setdefault(series, []).append((entry['Timestamp'], summary))
+      return graphData
+    first = BenchmarkRollups.periodStart(start, granularity)
+    watermark = self._rolledUpTo(coll_name, granularity) or first
+    self.querier.switchCollection(self.db, BenchmarkRollups.rollupCollectionName(coll_name, granularity))
+    docs = self.querier.queryCollection(dict(query, Period={"$gte" : first, "$lt" : end}), [("Period", 1)])
+    if watermark < end:
+      # Periods past the watermark are rolled up here from the raw entries,
+      # which hold every entry of those periods. Rollup documents kept on
+      # write for them only hold the entries of the processes that keep
+      # rollups on write, so they are replaced by the ones built here.
+      rollup = BenchmarkRollups.PeriodRollup(key_fields, metrics, granularity)
+      self.querier.switchCollection(self.db, coll_name)
+      for entry in self.querier.queryCollection(dict(query, Timestamp={"$gte" : max(watermark, first), "$lt" : end})):
+        rollup.add(entry)
+      docs = [doc for doc in docs if doc['Period'] < watermark]
+      docs += sorted(rollup.documents(), key=lambda doc: doc['Period'])
+    for doc in docs:
+      if metric not in doc['Metrics']:
+        continue
+      series = '/'.join([str(doc['Key'][field]) for field in key_fields if field in doc['Key'] and field not in query])
+      graphData.setdefault(series, []).append((doc['Period'], BenchmarkRollups.metricSummary(doc['Metrics'][metric])))
+    return graphData
+  
+  def getInsertSpeedTrendData(self, days=7):
+    '''Function to get the trend of insert times over the last days, as
+       returned by getTrendData. Ranges of a day or more are read from the
+       rollups rather than from every raw insertion speed entry.'''
+    end = datetime.datetime.now()
+    return self.getTrendData('insertion_speed', 'SecondsToInsert', end - datetime.timedelta(days=days), end,
+                             {"EntryType" : "Insertion Speed"})
+  
   def getChunkDistributionGraphData(self):
     '''Function to get graph data for the distribution of chunks among the servers.
        Returns a dictionary of shard#-data_values key-value pairs, where the
@@ -100,7 +268,7 @@ class BenchmarkDataGrabber:
        
        This method is dependant on there being 5 shards'''
     self.querier.switchCollection(self.db, 'db_status')
-    rawData = self.querier.queryCollection({"EntryType" : "Chunk Distribution"})
+    rawData = self.querier.queryCollection({"EntryType" : "Chunk Distribution"}, BY_TIME)
     graphData = {}
     shard1data = []
     shard2data = []
@@ -174,6 +342,89 @@ class BenchmarkCSVGenerator:
     assert f.closed
     print 'Insert Speed CSV file written'
   
+  def makeInsertSpeedSeriesCSVFile(self, data, filename='insert_speed_series_data'):
+    '''Function to generate a CSV file for tagged insert speed series data.'''
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Series', 'Insert Amount', 'Insert Speed'])
+      for series in data.keys():
+        for entry in data[series]:
+          writer.writerow([series, entry[0], entry[1]])
+    assert f.closed
+    print 'Insert Speed Series CSV file written'
+  
+  def makeInsertLatencySummaryCSVFile(self, data, filename='insert_latency_summary_data'):
+    '''Function to generate a CSV file for the insert latency percentiles.'''
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Series', 'Timestamp', 'Count', 'Mean', 'p50', 'p90', 'p99', 'p99.9', 'Max'])
+      for series, timestamp, summary in data:
+        writer.writerow([series, timestamp, summary['Count'], summary['Mean'], summary['p50'],
+                         summary['p90'], summary['p99'], summary['p99_9'], summary['Max']])
+    assert f.closed
+    print 'Insert Latency Summary CSV file written'
+  
+  def makeTrendCSVFile(self, data, filename='insert_speed_trend_data'):
+    '''Function to generate a CSV file for trend data, as returned by
+       BenchmarkDataGrabber.getTrendData.'''
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Series', 'Time', 'Count', 'Mean', 'Min', 'p50', 'p90', 'p99', 'Max'])
+      for series in sorted(data.keys()):
+        for period, summary in data[series]:
+          writer.writerow([series, period, summary['Count'], summary['Mean'], summary['Min'], summary['p50'],
+                           summary['p90'], summary['p99'], summary['Max']])
+    assert f.closed
+    print 'Trend CSV file written'
+  
+  def makeQueryStreamCSVFile(self, data, filename='query_stream_data'):
+    '''Function to generate a CSV file for the streamed query timings.'''
+    fields = ['Timestamp', 'BatchSize', 'Limit', 'Documents', 'Bytes', 'RoundTrips', 'FirstBatchSeconds',
+              'FetchSeconds', 'ClientSeconds', 'TotalSeconds', 'DocsPerSecond']
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Query'] + fields)
+      for query in data.keys():
+        for entry in data[query]:
+          writer.writerow([query] + [entry.get(field) for field in fields])
+    assert f.closed
+    print 'Query Stream CSV file written'
+  
+  def makeTrialCSVFile(self, data, filename='trial_data'):
+    '''Function to generate a CSV file for the repeated trial summaries,
+       with every run's change from the previous run of the same benchmark
+       and mode, and whether that change is larger than the noise.'''
+    fields = ['Timestamp', 'Count', 'Mean', 'Median', 'StdDev', 'CI95Low', 'CI95High', 'RelativeCI95']
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Name', 'Mode'] + fields + ['Change', 'ChangeCI95Low', 'ChangeCI95High', 'Significant'])
+      for name, mode in sorted(data.keys()):
+        previous = None
+        for entry in data[(name, mode)]:
+          row = [name, mode] + [entry.get(field) for field in fields]
+          if previous:
+            comparison = TrialRunner.compareTrials(previous, entry)
+            row += [comparison['Change'], comparison['ChangeCI95Low'], comparison['ChangeCI95High'],
+                    comparison['Significant']]
+          writer.writerow(row)
+          previous = entry
+    assert f.closed
+    print 'Trial CSV file written'
+  
+  def makeQueryLoadCSVFile(self, data, filename='query_load_data'):
+    '''Function to generate a CSV file for the concurrent query load data.'''
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Timestamp', 'Driver', 'Clients or Target QPS', 'Total QPS', 'Query', 'Count', 'QPS',
+                       'p50', 'p90', 'p99', 'Max'])
+      for timestamp, driver, load, qps, by_query in data:
+        for query in sorted(by_query.keys()):
+          summary = by_query[query]
+          writer.writerow([timestamp, driver, load, qps, query, summary['Count'], summary['QPS'], summary['p50'],
+                           summary['p90'], summary['p99'], summary['Max']])
+    assert f.closed
+    print 'Query Load CSV file written'
+  
   def makeHDUsageCSVFile(self, data, filename='hd_usage_data'):
     '''Function to generate a CSV file for the HD usage data.'''
     with open(filename+'.csv', 'wb') as f:
@@ -210,6 +461,17 @@ class BenchmarkCSVGenerator:
     assert f.closed
     print 'Map Reduce Speed CSV file written'
     
+  def makeQueryTimingCSVFile(self, data, filename='query_timing_data'):
+    '''Function to generate a CSV file for the backend comparison query timings'''
+    with open(filename+'.csv', 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['Query', 'Backend', 'Median Query Time'])
+      for query in data.keys():
+        for entry in data[query]:
+          writer.writerow([query, entry[0], entry[1]])
+    assert f.closed
+    print 'Query Timing CSV file written'
+    
   def makeChunkDistributionCSVFile(self, data, filename='chunk_distribution_data'):
     '''Function to generate a CSV file for the Chunk Distribution data'''
     with open(filename+'.csv', 'wb') as f:
@@ -227,12 +489,14 @@ def usage():
   '''Prints command line usage help of the script'''
   print 'Sample Usage:'
   print '\tpython BenchmarkAnalyzer.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name]'
+  print 'Optional Args:'
+  print '\t--days [days of insert speed trend to report, read from the rollups if long enough; default 7]'
   print
 
 def main():
   '''Function to run the BenchmarkAnalyzer module from the command line'''
   try:
-    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll='])
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'days='])
   except getopt.error, msg:
     usage()
     print 'Error:', str(msg)
@@ -241,6 +505,7 @@ def main():
   port = 27017
   db = 'benchmarks'
   coll = 'hd_usage'
+  trend_days = 7
   # Parse command line options
   for option, arg in opts:
     if option == '--host':
@@ -251,6 +516,8 @@ def main():
       db = arg
     elif option == '--coll':
       coll = arg
+    elif option == '--days':
+      trend_days = float(arg)
   # Get remaining necessary arguments
   '''while not coll:
     coll = raw_input('Please enter the collection name to import data to: ')'''
@@ -261,6 +528,15 @@ def main():
   # Generate Insert Data CSV
   insert_data = dataGrabber.getInsertSpeedGraphData()
   csv_generator.makeInsertSpeedCSVFile(insert_data)
+  # Generate Insert Speed Series CSV
+  insert_series_data = dataGrabber.getInsertSpeedSeriesGraphData()
+  csv_generator.makeInsertSpeedSeriesCSVFile(insert_series_data)
+  # Generate Insert Latency Summary CSV
+  latency_data = dataGrabber.getInsertLatencySummaryData()
+  csv_generator.makeInsertLatencySummaryCSVFile(latency_data)
+  # Generate Insert Speed Trend CSV
+  trend_data = dataGrabber.getInsertSpeedTrendData(trend_days)
+  csv_generator.makeTrendCSVFile(trend_data)
   # Generate HD Usage CSV
   hd_usage_data = dataGrabber.getHdUsageGraphData()
   csv_generator.makeHDUsageCSVFile(hd_usage_data)
@@ -270,6 +546,18 @@ def main():
   # Generate Map Reduce Speed CSV
   mr_data = dataGrabber.getMapReduceSpeedGraphData()
   csv_generator.makeMapReduceSpeedCSVFile(mr_data)
+  # Generate Query Timing (backend comparison) CSV
+  timing_data = dataGrabber.getQueryTimingGraphData()
+  csv_generator.makeQueryTimingCSVFile(timing_data)
+  # Generate Query Stream Timing CSV
+  stream_data = dataGrabber.getQueryStreamData()
+  csv_generator.makeQueryStreamCSVFile(stream_data)
+  # Generate Trial Summary CSV
+  trial_data = dataGrabber.getTrialData()
+  csv_generator.makeTrialCSVFile(trial_data)
+  # Generate Query Load CSV
+  load_data = dataGrabber.getQueryLoadData()
+  csv_generator.makeQueryLoadCSVFile(load_data)
   # Generate Chunk Distribution CSV
   #chunk_data = dataGrabber.getChunkDistributionGraphData()
   #csv_generator.makeChunkDistributionCSVFile(chunk_data)
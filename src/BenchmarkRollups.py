@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+'''
+BenchmarkRollups.py - Python script to keep hourly and daily rollups of the
+raw benchmark log entries, so that trends over long time ranges can be
+read without scanning the raw entries, and history outlives the raw
+entries' retention.
+
+Raw insertion_speed and query_speed entries are rolled up into
+<collection>_hourly and <collection>_daily: one document per period and
+series, with the entry count and, for each numeric metric, its count, sum,
+min, max and a percentile sketch. The sketch is a LatencyHistogram of the
+metric's values (exact to 1e-6 of the metric's unit, and within 1/64 above
+that), stored as bucket counts, so sketches of several periods can be
+added together and percentiles read off the sum.
+
+Rollups are kept up to date in one of two ways:
+
+  on write  - mongoCRUD(rollup_on_write=True) adds every batch of log
+              entries it writes to the open periods' rollups with $inc,
+              $min and $max upserts (needs MongoDB 2.6 or later).
+  watermark - rollupBenchmarkHistory rebuilds every complete period past
+              a watermark per collection and granularity (kept in
+              rollup_state) from the raw entries, and moves the watermark
+              up. Each run only reads the raw entries written since the
+              last one. benchmarks.py runs it on every invocation.
+
+Rebuilt periods replace their rollup documents, so running both never
+counts an entry twice. With retention set, run the watermark job at least
+once per retention period so that no raw entry expires before its day is
+rolled up.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import datetime
+import LatencyHistogram
+
+
+# Raw collections that are rolled up: the fields a rollup series is keyed
+# on, and the numeric metrics summarized for it. The query_speed metrics
+# cover every entry type logged there: explain (millisTotal), map-reduce
+# (timeMillis), backend timing (MedianSeconds, MeanSeconds), stream timing
+# (TotalSeconds, FirstBatchSeconds), query load (QPS) and trial summaries
+# (Mean, Median).
+ROLLUP_SPECS = {"insertion_speed" : (["EntryType", "Series", "Sink"],
+                                     ["SecondsToInsert", "InsertAmount", "SecondsSinceScheduled"]),
+                "query_speed" : (["EntryType", "Query", "Mapper", "Backend", "BatchSize", "Driver", "Clients",
+                                  "TargetQPS", "Name", "Mode"],
+                                 ["millisTotal", "timeMillis", "MedianSeconds", "MeanSeconds", "TotalSeconds",
+                                  "FirstBatchSeconds", "QPS", "Mean", "Median"])}
+# Rollup granularities, finest first: name, period length and collection suffix
+GRANULARITIES = [("hour", datetime.timedelta(hours=1), '_hourly'),
+                 ("day", datetime.timedelta(days=1), '_daily')]
+ROLLUP_STATE_COLLECTION = 'rollup_state'
+TREND_PERCENTILES = [("p50", 50.0), ("p90", 90.0), ("p99", 99.0)]
+
+
+def periodStart(timestamp, granularity):
+  '''Returns the start of the hour or day a datetime falls in'''
+  if granularity == "hour":
+    return datetime.datetime(timestamp.year, timestamp.month, timestamp.day, timestamp.hour)
+  return datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+
+def dayStart(timestamp):
+  '''Returns midnight of the day a datetime falls on'''
+  return periodStart(timestamp, "day")
+
+def rollupCollectionName(coll_name, granularity="day"):
+  '''Returns the name of the collection holding the hourly or daily rollups
+     of a raw benchmark collection'''
+  for name, length, suffix in GRANULARITIES:
+    if name == granularity:
+      return coll_name + suffix
+  raise ValueError('Unknown rollup granularity: ' + str(granularity))
+
+def rollupId(period, key):
+  '''Returns the _id of the rollup document of a period and series key, so
+     rolling up the same period again overwrites rather than duplicates it'''
+  return '|'.join([period.strftime('%Y-%m-%dT%H')] + ['%s=%s' % item for item in sorted(key.iteritems())])
+
+def metricHistogram(stats):
+  '''Returns the LatencyHistogram held in the sketch of a rollup metric'''
+  sketch = stats["Sketch"]
+  return LatencyHistogram.LatencyHistogram.fromDocument({"SubBucketBits" : sketch["SubBucketBits"],
+                                                         "Counts" : sketch["Counts"],
+                                                         "Count" : stats["Count"],
+                                                         "Total" : stats["Sum"],
+                                                         "Min" : stats["Min"],
+                                                         "Max" : stats["Max"]})
+
+def metricSummary(stats):
+  '''Returns the count, mean, min, max and p50/p90/p99 of a rollup metric,
+     or of several merged with mergeMetricStats'''
+  histogram = metricHistogram(stats)
+  summary = {"Count" : stats["Count"],
+             "Mean" : stats["Sum"] / max(stats["Count"], 1),
+             "Min" : stats["Min"],
+             "Max" : stats["Max"]}
+  for name, percent in TREND_PERCENTILES:
+    summary[name] = histogram.percentile(percent)
+  return summary
+
+def mergeMetricStats(stats_list):
+  '''Returns the stats of a metric over several rollup periods'''
+  histogram = LatencyHistogram.LatencyHistogram()
+  for stats in stats_list:
+    histogram.merge(metricHistogram(stats))
+  return _histogramStats(histogram)
+
+def _histogramStats(histogram):
+  '''Helper function to turn a histogram of metric values into rollup
+     metric stats'''
+  return {"Count" : histogram.count,
+          "Sum" : histogram.total,
+          "Min" : histogram.min,
+          "Max" : histogram.max,
+          "Sketch" : {"SubBucketBits" : histogram.sub_bucket_bits,
+                      "Counts" : dict((str(index), count) for index, count in histogram.counts.iteritems())}}
+
+
+class PeriodRollup:
+  '''Class to accumulate the rollups of a set of raw entries at one
+     granularity, as one histogram per period, series and metric'''
+  def __init__(self, key_fields, metrics, granularity="day"):
+    self.key_fields = key_fields
+    self.metrics = metrics
+    self.granularity = granularity
+    self.rollups = {}
+
+  def add(self, entry):
+    '''Adds a raw log entry to the rollup of its period and series'''
+    period = periodStart(entry["Timestamp"], self.granularity)
+    key = dict((field, entry[field]) for field in self.key_fields if field in entry)
+    doc_id = rollupId(period, key)
+    rollup = self.rollups.get(doc_id)
+    if rollup is None:
+      rollup = {"Period" : period, "Key" : key, "Count" : 0, "Histograms" : {}}
+      self.rollups[doc_id] = rollup
+    rollup["Count"] += 1
+    for metric in self.metrics:
+      value = entry.get(metric)
+      if isinstance(value, (int, long, float)) and not isinstance(value, bool) and value >= 0:
+        if metric not in rollup["Histograms"]:
+          rollup["Histograms"][metric] = LatencyHistogram.LatencyHistogram()
+        rollup["Histograms"][metric].record(value)
+
+  def documents(self):
+    '''Returns the accumulated rollups as complete rollup documents'''
+    docs = []
+    for doc_id, rollup in self.rollups.iteritems():
+      doc = {"_id" : doc_id,
+             "Period" : rollup["Period"],
+             "Granularity" : self.granularity,
+             "Key" : rollup["Key"],
+             "Count" : rollup["Count"],
+             "Metrics" : dict((metric, _histogramStats(histogram))
+                              for metric, histogram in rollup["Histograms"].iteritems())}
+      doc.update(rollup["Key"])
+      docs.append(doc)
+    return docs
+
+  def updates(self):
+    '''Returns the accumulated rollups as (selector, update) pairs that add
+       them to existing rollup documents, creating them if needed'''
+    pairs = []
+    for doc_id, rollup in self.rollups.iteritems():
+      set_fields = {"Period" : rollup["Period"], "Granularity" : self.granularity, "Key" : rollup["Key"]}
+      set_fields.update(rollup["Key"])
+      update = {"$set" : set_fields, "$inc" : {"Count" : rollup["Count"]}, "$min" : {}, "$max" : {}}
+      for metric, histogram in rollup["Histograms"].iteritems():
+        prefix = "Metrics." + metric + "."
+        update["$set"][prefix + "Sketch.SubBucketBits"] = histogram.sub_bucket_bits
+        update["$inc"][prefix + "Count"] = histogram.count
+        update["$inc"][prefix + "Sum"] = histogram.total
+        update["$min"][prefix + "Min"] = histogram.min
+        update["$max"][prefix + "Max"] = histogram.max
+        for index, count in histogram.counts.iteritems():
+          update["$inc"][prefix + "Sketch.Counts." + str(index)] = count
+      # Empty modifiers are rejected by the server, so drop them when no
+      # metric was rolled up
+      for modifier in ["$min", "$max"]:
+        if not update[modifier]:
+          del update[modifier]
+      pairs.append(({"_id" : doc_id}, update))
+    return pairs
+
+
+def rollupEntries(database, coll_name, entries):
+  '''Adds a batch of just written raw entries of a rolled up collection to
+     the hourly and daily rollups of their periods, with one upsert per
+     period and series'''
+  key_fields, metrics = ROLLUP_SPECS[coll_name]
+  for granularity, length, suffix in GRANULARITIES:
+    rollup = PeriodRollup(key_fields, metrics, granularity)
+    for entry in entries:
+      if "Timestamp" in entry:
+        rollup.add(entry)
+    rollups = database[coll_name + suffix]
+    for selector, update in rollup.updates():
+      rollups.update(selector, update, upsert=True)
+
+def rollupCollection(database, coll_name, granularity="day", now=None):
+  '''Rebuilds every complete period of a raw benchmark collection past its
+     watermark at one granularity, and moves the watermark up to the
+     current period. Returns the number of raw entries read.'''
+  key_fields, metrics = ROLLUP_SPECS[coll_name]
+  raw = database[coll_name]
+  state = database[ROLLUP_STATE_COLLECTION]
+  state_id = coll_name + '/' + granularity
+  end = periodStart(now or datetime.datetime.now(), granularity)
+  watermark = state.find_one({"_id" : state_id})
+  if watermark:
+    start = watermark["RolledUpTo"]
+  else:
+    first = list(raw.find({"Timestamp" : {"$exists" : True}}, ["Timestamp"]).sort("Timestamp", 1).limit(1))
+    if not first:
+      return 0
+    start = periodStart(first[0]["Timestamp"], granularity)
+  if start >= end:
+    return 0
+  rollup = PeriodRollup(key_fields, metrics, granularity)
+  count = 0
+  for entry in raw.find({"Timestamp" : {"$gte" : start, "$lt" : end}}, ["Timestamp"] + key_fields + metrics):
+    rollup.add(entry)
+    count += 1
+  rollups = database[rollupCollectionName(coll_name, granularity)]
+  for doc in rollup.documents():
+    rollups.save(doc)
+  state.save({"_id" : state_id, "RolledUpTo" : end, "Timestamp" : datetime.datetime.now()})
+  return count
+
+def rollupBenchmarkHistory(database, now=None):
+  '''Runs the watermark job on every raw benchmark collection that has a
+     rollup spec, at every granularity. Returns a dictionary of
+     collection/granularity - raw entries read pairs.'''
+  counts = {}
+  for coll_name in sorted(ROLLUP_SPECS):
+    for granularity, length, suffix in GRANULARITIES:
+      counts[coll_name + '/' + granularity] = rollupCollection(database, coll_name, granularity, now)
+  return counts
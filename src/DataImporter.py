@@ -15,16 +15,651 @@ import os
 import csv
 import gzip
 import datetime
+import _strptime # import before threads use strptime, its lazy import is not thread safe
+import time
+import multiprocessing
+import threading
+import Queue
+import traceback
+import subprocess
+import itertools
+import sqlite3
 import MongoLogger
 import MySQLLogger
+import DocumentSchema
+import DataSinks
+import LatencyHistogram
 
 
-class MongoDataImporter:
+
+DEFAULT_BATCH_DOCS = 10000
+
+# Run by a separate python process to decompress a gzip file to its stdout.
+# Reports the uncompressed byte count and the seconds spent decompressing
+# (not counting time blocked on the pipe) on stderr when it finishes.
+GZ_DECOMPRESS_SCRIPT = '''
+import gzip, sys, time
+f = gzip.open(sys.argv[1], 'rb')
+f.seek(int(sys.argv[2]))
+total = 0
+busy = 0.0
+while True:
+  start = time.time()
+  data = f.read(1048576)
+  busy += time.time() - start
+  if not data:
+    break
+  total += len(data)
+  sys.stdout.write(data)
+sys.stdout.flush()
+sys.stderr.write('%d %f' % (total, busy))
+'''
+
+def blankToNum(input):
+  '''Helper function to allow for conversion of a blank column value to an
+     integer or float in the parsing functions'''
+  if input == '':
+    return 0
+  else:
+    return input
+
+def parseTickRows(reader, filepath):
+  '''Generator that turns the rows of a single tick file (as returned by a
+     csv reader, or any other iterable of field lists) into valid dicts to be
+     added to the database. Documents are yielded one at a time, so memory
+     use does not depend on the size of the file. The filepath is the bare
+     file name, which holds the region and the trading date.'''
+  region = filepath[0:3]
+  for line in reader:
+    if not line:
+      continue
+    # Do blank value catching to avoid parsing errors
+    row = [blankToNum(i) for i in line]
+    # Generate the data entry to insert
+    if row[0] == 'T': # Tick Data
+      yield {"EntryType" : "Historical Tick Data",
+             "TickType" : "Trade",
+             "Timestamp" : datetime.datetime.now(),
+             "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
+             "Region" : region,
+             "Symbol" : str(row[2]),
+             "Price" : float(row[3]),
+             "Volume" : int(row[4]),
+             "ExchangeID" : int(row[5])}
+    elif row[0] == 'Q': # Quote Data
+      yield {"EntryType" : "Historical Tick Data",
+             "TickType" : "Quote",
+             "Timestamp" : datetime.datetime.now(),
+             "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
+             "Region" : region,
+             "Symbol" : str(row[2]),
+             "AskPrice" : float(row[3]),
+             "AskSize" : int(row[4]),
+             "AskExchangeID" : int(row[5]),
+             "BidPrice" : float(row[6]),
+             "BidSize" : int(row[7]),
+             "BidExchangeID" : int(row[8])}
+    elif row[0] == 's': # Start Record
+      print 'Starting new record:', row[2]
+    elif row[0] == 'e': # End Record
+      print 'Ending record:', row[2]
+    elif row[0] == 'z': # EOF Continuation Record
+      print 'End of file', filepath
+    else:
+      print 'Invalid entry:', row
+
+def estimateEntrySize(entry):
+  '''Rough estimate of the size in bytes of a document once it is BSON
+     encoded. Used for byte based batching, where encoding every document
+     just to measure it would cost more than the insert.'''
+  size = 5
+  for key, value in entry.iteritems():
+    size += len(key) + 2
+    if isinstance(value, basestring):
+      size += len(value) + 5
+    else:
+      size += 8
+  return size
+
+def batchEntries(entries, batch_docs=DEFAULT_BATCH_DOCS, batch_bytes=None):
+  '''Generator that groups a stream of entries into lists for bulk
+     insertion. A batch is closed as soon as it holds batch_docs documents,
+     or (if batch_bytes is given) once its estimated size reaches batch_bytes.'''
+  batch = []
+  size = 0
+  for entry in entries:
+    batch.append(entry)
+    if batch_bytes:
+      size += estimateEntrySize(entry)
+    if len(batch) >= batch_docs or (batch_bytes and size >= batch_bytes):
+      yield batch
+      batch = []
+      size = 0
+  if batch:
+    yield batch
+
+def trackLines(lines, progress):
+  '''Generator that passes lines through unchanged, while advancing
+     progress["Offset"] by the number of bytes read. Used to find the byte
+     offset of the row that closed a batch.'''
+  for line in lines:
+    progress["Offset"] += len(line)
+    yield line
+
+
+class ImportManifest:
+  '''Class to keep track of how far a tick import has got, in a local SQLite
+     file, so an interrupted import can be restarted where it stopped. For
+     every file it records the byte offset, document count and number of the
+     last committed batch, plus whether the file is finished. Every committed
+     batch is also logged with its id. Safe to share between threads, and
+     between processes that each open their own ImportManifest.'''
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    self.conn.execute('create table if not exists files (file text primary key, offset integer, documents integer, batch integer, done integer)')
+    self.conn.execute('create table if not exists batches (file text, batch integer, offset integer, documents integer, committed timestamp)')
+    self.conn.commit()
+    self.last = {}
+    self.pending = {}
+
+  def getFileState(self, filepath):
+    '''Returns the last committed state of a file as a dict with the keys
+       Offset, Documents, Batch and Done, or None if it was never started'''
+    with self.lock:
+      row = self.conn.execute('select offset, documents, batch, done from files where file = ?', (filepath,)).fetchone()
+    if row is None:
+      return None
+    return {"Offset" : row[0], "Documents" : row[1], "Batch" : row[2], "Done" : bool(row[3])}
+
+  def commit(self, checkpoint):
+    '''Records a checkpoint, as produced by TickDataImporter._fileBatches,
+       once its batch has been inserted. With several inserter threads the
+       batches of a file can finish out of order, so the file's position only
+       advances over batches that are committed without gaps.'''
+    filepath = checkpoint["File"]
+    with self.lock:
+      if filepath not in self.pending:
+        row = self.conn.execute('select batch from files where file = ?', (filepath,)).fetchone()
+        self.last[filepath] = row[0] if row else 0
+        self.pending[filepath] = {}
+      pending = self.pending[filepath]
+      if checkpoint["Done"]:
+        pending["Done"] = checkpoint
+      else:
+        pending[checkpoint["Batch"]] = checkpoint
+        self.conn.execute('insert into batches values (?, ?, ?, ?, ?)',
+                          (filepath, checkpoint["Batch"], checkpoint["Offset"],
+                           checkpoint["Documents"], datetime.datetime.now()))
+      latest = None
+      while self.last[filepath] + 1 in pending:
+        self.last[filepath] += 1
+        latest = pending.pop(self.last[filepath])
+      if "Done" in pending and pending["Done"]["Batch"] == self.last[filepath]:
+        latest = pending.pop("Done")
+      if latest:
+        self.conn.execute('insert or replace into files values (?, ?, ?, ?, ?)',
+                          (filepath, latest["Offset"], latest["Documents"],
+                           latest["Batch"], int(latest["Done"])))
+      self.conn.commit()
+
+
+_worker_importer = None
+
+def _initImportWorker(importer_class, init_args, options):
+  '''Process pool initializer. Gives every worker process its own importer,
+     and with it its own database connection and parser.'''
+  global _worker_importer
+  _worker_importer = importer_class(*init_args, **options)
+  if hasattr(_worker_importer.logger, 'deferInsertionLogging'):
+    _worker_importer.logger.deferInsertionLogging()
+
+def _importFileWorker(args):
+  '''Process pool task. Imports a single tick file with the worker's
+     importer, and returns the statistics, insertion speed log entries and
+     latency histograms for the parent process to merge.'''
+  folderpath, filepath, parse_name = args
+  parse_fun = getattr(_worker_importer, parse_name)
+  start = time.time()
+  count = _worker_importer._importFile(folderpath, filepath, parse_fun)
+  end = time.time()
+  insert_log = []
+  if hasattr(_worker_importer.logger, 'popDeferredInsertionEntries'):
+    insert_log = _worker_importer.logger.popDeferredInsertionEntries()
+  latency = None
+  if hasattr(_worker_importer.logger, 'resetLatency'):
+    latency = _worker_importer.logger.resetLatency().toDocument()
+  return {"Worker" : os.getpid(),
+          "File" : filepath,
+          "Documents" : count,
+          "Seconds" : end - start,
+          "InsertionEntries" : insert_log,
+          "Latency" : latency}
+
+
+class TickDataImporter:
+  '''Base class for the tick data importers. Owns the file handling and
+     batching of tick imports, and writes each batch to self.logger, which
+     the subclasses set to a logger providing an insertData method.
+     If columnar is set, files are decoded with TickDecoder (requires numpy)
+     instead of the row at a time parser. If gz_process is set, gzip files
+     are decompressed by a separate process and piped into the parser.
+     If manifest is the path of an ImportManifest file, progress is recorded
+     there after every batch, and finished files are skipped and partly
+     imported files resumed when the import is run again. schema names the
+     DocumentSchema the documents are stored in (the full layout by default).'''
+  def __init__(self, batch_docs=DEFAULT_BATCH_DOCS, batch_bytes=None, columnar=False, gz_process=False, manifest=None,
+               schema=None):
+    self.batch_docs = batch_docs
+    self.batch_bytes = batch_bytes
+    self.columnar = columnar
+    self.gz_process = gz_process
+    self.manifest = None
+    if manifest:
+      self.manifest = ImportManifest(manifest)
+    self.router = None
+    self.schema = DocumentSchema.getSchema(schema)
+    self.baseline = None
+
+  def _fileBatches(self, folderpath, filepath, parse_fun):
+    '''Generator that parses a single file and yields (batch, checkpoint)
+       pairs, where the checkpoint describes how far into the file the import
+       is once the batch is inserted. The last pair has a None batch and a
+       checkpoint marking the file as done. When a manifest is in use, files
+       it lists as done yield nothing, and partly imported files pick up
+       after their last committed batch. The row parser resumes by seeking to
+       the committed byte offset; the columnar decoder reads ahead, so it
+       resumes by skipping the committed number of documents instead (resume
+       with the same decoder that was interrupted).'''
+    state = {"File" : filepath, "Offset" : 0, "Documents" : 0, "Batch" : 0, "Done" : False}
+    if self.manifest:
+      saved = self.manifest.getFileState(filepath)
+      if saved:
+        state.update(saved)
+      if state["Done"]:
+        print 'Skipping completed file:', filepath
+        return
+      if state["Batch"]:
+        print 'Resuming file:', filepath, 'after batch', state["Batch"]
+    if self.columnar:
+      progress = {"Offset" : 0, "Skip" : state["Documents"]}
+    else:
+      progress = {"Offset" : state["Offset"], "Skip" : 0}
+    entries = parse_fun(folderpath, filepath, progress)
+    if self.schema.name != "full":
+      entries = itertools.imap(self.schema.encode, entries)
+    for batch in batchEntries(entries, self.batch_docs, self.batch_bytes):
+      state["Offset"] = progress["Offset"]
+      state["Documents"] += len(batch)
+      state["Batch"] += 1
+      yield batch, dict(state)
+    state["Done"] = True
+    yield None, dict(state)
+
+  def _commitBatch(self, batch, checkpoint):
+    '''Helper function to insert a batch produced by _fileBatches, and then
+       record its checkpoint in the manifest (if there is one). If the importer
+       has a router, the batch is split up and inserted one shard at a time.'''
+    if batch:
+      if self.router:
+        for group in self.router.routeBatch(batch):
+          self.logger.insertData(group)
+      else:
+        self.logger.insertData(batch)
+    if self.manifest:
+      self.manifest.commit(checkpoint)
+
+  def _importFile(self, folderpath, filepath, parse_fun):
+    '''Helper function to parse a single file, and insert it batch by batch
+       into the database. Returns the number of documents inserted.'''
+    count = 0
+    for batch, checkpoint in self._fileBatches(folderpath, filepath, parse_fun):
+      self._commitBatch(batch, checkpoint)
+      if batch:
+        count += len(batch)
+    return count
+
+  def _decodeTickFile(self, f, filepath, progress=None):
+    '''Helper function to turn an open tick file into a stream of entries,
+       using the parser selected for this importer. If a progress dict is
+       given, its Offset is kept up to date as lines are read, and its first
+       Skip entries are dropped.'''
+    if progress is not None:
+      f = trackLines(f, progress)
+    if self.columnar:
+      import TickDecoder
+      entries = TickDecoder.ColumnarTickDecoder(filepath).iterEntries(f)
+    else:
+      entries = parseTickRows(csv.reader(f, delimiter='|'), filepath)
+    if progress is not None and progress["Skip"]:
+      entries = itertools.islice(entries, progress["Skip"], None)
+    return entries
+
+  def _parseSingleRawTickFile(self, folderpath, filepath, progress=None):
+    '''Helper function to parse a single, raw tick file (not gzipped), 
+       yielding valid dicts to be added to the database. Parsing starts at
+       the byte offset in progress, if one is given.'''
+    print 'Parsing file:', filepath
+    with open(os.path.join(folderpath, filepath), 'r') as f:
+      if progress:
+        f.seek(progress["Offset"])
+      for entry in self._decodeTickFile(f, filepath, progress):
+        yield entry
+    assert f.closed
+
+  def _parseSingleGzTickFile(self, folderpath, filepath, progress=None):
+    '''Helper function to parse a single tick file gzip container, yielding
+       valid dicts to be added to the database. Essentially does the same
+       thing as the _parseSingleRawTickFile function, but allows for
+       decompression on the fly, with the drawback of slower performance.
+       The slowdown is avoided when the importer has gz_process set.'''
+    if self.gz_process:
+      for entry in self._parseSingleGzTickFileInProcess(folderpath, filepath, progress):
+        yield entry
+      return
+    print 'Parsing file:', filepath
+    with gzip.open(os.path.join(folderpath, filepath), 'rb') as f:
+      if progress:
+        f.seek(progress["Offset"])
+      for entry in self._decodeTickFile(f, filepath, progress):
+        yield entry
+    assert f.closed
+
+  def _parseSingleGzTickFileInProcess(self, folderpath, filepath, progress=None):
+    '''Helper function to parse a single tick file gzip container that is
+       decompressed by a separate python process, so decompression runs on
+       another core while this one parses. Prints the decompression speed
+       and the parse speed of the file separately once it is done.'''
+    print 'Parsing file:', filepath
+    offset = 0
+    if progress:
+      offset = progress["Offset"]
+    proc = subprocess.Popen([sys.executable, '-c', GZ_DECOMPRESS_SCRIPT, os.path.join(folderpath, filepath), str(offset)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    count = 0
+    parse_secs = 0.0
+    finished = False
+    try:
+      resume = time.time()
+      for entry in self._decodeTickFile(proc.stdout, filepath, progress):
+        parse_secs += time.time() - resume
+        count += 1
+        yield entry
+        resume = time.time()
+      parse_secs += time.time() - resume
+      finished = True
+    finally:
+      if not finished and proc.poll() is None:
+        proc.kill()
+      stats = proc.stderr.read()
+      proc.wait()
+    if proc.returncode != 0:
+      raise IOError('Decompression of %s failed: %s' % (filepath, stats))
+    total, busy = stats.split()
+    total_mb = int(total) / 1048576.0
+    print 'Decompressed %.1f MB in %.2f seconds (%.1f MB/s)' % (total_mb, float(busy), total_mb / max(float(busy), 1e-9))
+    print 'Parsed %d docs in %.2f seconds (%.1f docs/sec)' % (count, parse_secs, count / max(parse_secs, 1e-9))
+
+  def _parseTickDataFolderToDB(self, folderpath, parse_fun):
+    '''Helper function to run every file in a folder through the given
+       single file parser, and insert the results into the database'''
+    if os.path.exists(folderpath) and os.path.isdir(folderpath):
+      print 'Historical tick data folder import initiated'
+      listing = os.listdir(folderpath)
+      total = 0
+      start = time.time()
+      for f in listing:
+        total += self._importFile(folderpath, f, parse_fun)
+      self._finishFolderImport(total, time.time() - start)
+      print 'Historical tick data folder import completed'
+    else:
+      print 'Invalid directory', folderpath
+
+  def parseRawTickDataFolderToDB(self, folderpath):
+    '''Function to handle going through a folder containing historical tick data, 
+       located in raw text files, separated by day, and converting the 
+       information into JSON documents to be stored in the database'''
+    self._parseTickDataFolderToDB(folderpath, self._parseSingleRawTickFile)
+
+  def parseGzTickDataFolderToDB(self, folderpath):
+    '''Function to handle going through a folder containing historical tick data, 
+       located in gzipped containers, separated by day, and converting the 
+       information into JSON documents to be stored in the database. Essentially
+       the same thing as parseRawTickDataFolderToDB function, but allows for
+       dealing with compressed files, with the drawback of slower performance.'''
+    self._parseTickDataFolderToDB(folderpath, self._parseSingleGzTickFile)
+
+  def _printTotal(self, total, elapsed):
+    '''Helper function to print the docs/sec of a folder import, and how it
+       compares to the null sink baseline if one was measured'''
+    rate = total / max(elapsed, 1e-9)
+    line = 'Total: %d docs in %.1f seconds, %.1f docs/sec' % (total, elapsed, rate)
+    if self.baseline:
+      line += ' (%.1f%% of the %.1f docs/sec null sink baseline)' % (
+          100.0 * rate / max(self.baseline["DocsPerSecond"], 1e-9), self.baseline["DocsPerSecond"])
+    print line
+
+  def _finishFolderImport(self, total, elapsed):
+    '''Helper function to report on a finished folder import. Prints the
+       total docs/sec, and if the logger keeps insert latency histograms
+       (mongoCRUD does), logs and prints their percentile summary.'''
+    self._printTotal(total, elapsed)
+    if hasattr(self.logger, 'logLatencySummary'):
+      summary = self.logger.logLatencySummary({"Series" : "import"})["Summary"]
+      print 'Insert latency: p50 %.4f p90 %.4f p99 %.4f p99.9 %.4f max %.4f s' % (
+          summary["p50"], summary["p90"], summary["p99"], summary["p99_9"], summary["Max"])
+
+  def measureParseBaseline(self, folderpath, gz=False):
+    '''Function to import a folder of tick files into a null sink (see
+       DataSinks.py), with this importer's parser and schema but without the
+       database, manifest or shard routing. The docs/sec is the client side
+       ceiling for the real import, and is kept as self.baseline so later
+       folder imports report against it. The null sink's insertion speed log
+       entries are added to the real sink's log as the "baseline/null"
+       series, when it keeps one. Returns the baseline summary.'''
+    if not (os.path.exists(folderpath) and os.path.isdir(folderpath)):
+      print 'Invalid directory', folderpath
+      return None
+    if gz:
+      parse_fun = self._parseSingleGzTickFile
+    else:
+      parse_fun = self._parseSingleRawTickFile
+    sink = DataSinks.NullSink()
+    saved = (self.logger, self.manifest, self.router)
+    self.logger, self.manifest, self.router = sink, None, None
+    start = time.time()
+    try:
+      for f in os.listdir(folderpath):
+        self._importFile(folderpath, f, parse_fun)
+    finally:
+      self.logger, self.manifest, self.router = saved
+    elapsed = time.time() - start
+    entries = sink.popDeferredInsertionEntries()
+    for entry in entries:
+      entry["Series"] = "baseline/null"
+    if entries and hasattr(self.logger, 'addInsertionSpeedEntry'):
+      self.logger.addInsertionSpeedEntry(entries)
+    self.baseline = {"Sink" : "null",
+                     "Documents" : sink.documents,
+                     "Seconds" : elapsed,
+                     "DocsPerSecond" : sink.documents / max(elapsed, 1e-9)}
+    print 'Null sink baseline: %d docs in %.1f seconds, %.1f docs/sec' % (sink.documents, elapsed,
+                                                                          self.baseline["DocsPerSecond"])
+    return self.baseline
+
+  def parseTickDataFolderParallel(self, folderpath, workers, gz=False):
+    '''Function to import a folder of tick files (raw, or gzipped if gz is
+       set) using a pool of worker processes, one file per task. Every worker
+       has its own connection and parser, and the insertion speed log entries
+       they produce are written by this process. Prints per worker and total
+       docs/sec, and returns the per worker statistics.'''
+    if not (os.path.exists(folderpath) and os.path.isdir(folderpath)):
+      print 'Invalid directory', folderpath
+      return None
+    print 'Parallel historical tick data folder import initiated with', workers, 'workers'
+    if gz:
+      parse_name = '_parseSingleGzTickFile'
+    else:
+      parse_name = '_parseSingleRawTickFile'
+    tasks = [(folderpath, f, parse_name) for f in os.listdir(folderpath)]
+    pool = multiprocessing.Pool(workers, _initImportWorker, (self.__class__, self.init_args, self.options))
+    worker_stats = {}
+    total = 0
+    start = time.time()
+    try:
+      for result in pool.imap_unordered(_importFileWorker, tasks):
+        if result["InsertionEntries"]:
+          self.logger.addInsertionSpeedEntry(result["InsertionEntries"])
+        if result["Latency"] and hasattr(self.logger, 'latency'):
+          self.logger.latency.merge(LatencyHistogram.LatencyRecorder.fromDocument(result["Latency"]))
+        stats = worker_stats.setdefault(result["Worker"], {"Files" : 0, "Documents" : 0, "Seconds" : 0.0})
+        stats["Files"] += 1
+        stats["Documents"] += result["Documents"]
+        stats["Seconds"] += result["Seconds"]
+        total += result["Documents"]
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+    elapsed = time.time() - start
+    for worker, stats in sorted(worker_stats.iteritems()):
+      stats["DocsPerSecond"] = stats["Documents"] / max(stats["Seconds"], 1e-9)
+      print 'Worker %d: %d files, %d docs, %.1f docs/sec' % (worker, stats["Files"], stats["Documents"], stats["DocsPerSecond"])
+    self._finishFolderImport(total, elapsed)
+    print 'Parallel historical tick data folder import completed'
+    return worker_stats
+
+  def _runPipelineParser(self, files, batches, parse_fun, folderpath, stats, failed):
+    '''Parser stage of the pipelined import. Takes files off the files queue
+       and puts their batches on the bounded batches queue, counting the time
+       spent blocked on a full queue as idle time.'''
+    try:
+      while not failed.is_set():
+        try:
+          filepath = files.get_nowait()
+        except Queue.Empty:
+          return
+        for item in self._fileBatches(folderpath, filepath, parse_fun):
+          wait_start = time.time()
+          while not failed.is_set():
+            try:
+              batches.put(item, timeout=0.5)
+              break
+            except Queue.Full:
+              pass
+          stats["Idle"] += time.time() - wait_start
+          if failed.is_set():
+            return
+    except:
+      failed.set()
+      raise
+
+  def _runPipelineInserter(self, batches, stats, failed):
+    '''Inserter stage of the pipelined import. Drains the batches queue into
+       the logger until it gets the None end marker, counting the time spent
+       waiting on an empty queue as idle time. After a failed insert it keeps
+       draining (without inserting) until the end marker, so that nobody
+       blocks on a full queue.'''
+    while True:
+      wait_start = time.time()
+      item = batches.get()
+      stats["Idle"] += time.time() - wait_start
+      if item is None:
+        return
+      if failed.is_set():
+        continue
+      batch, checkpoint = item
+      try:
+        self._commitBatch(batch, checkpoint)
+        if batch:
+          stats["Documents"] += len(batch)
+      except:
+        failed.set()
+        traceback.print_exc()
+
+  def parseTickDataFolderPipelined(self, folderpath, parsers=1, inserters=1, queue_depth=8, gz=False):
+    '''Function to import a folder of tick files (raw, or gzipped if gz is
+       set) with parsing and inserting overlapped. Parser threads put batches
+       on a queue holding at most queue_depth batches, which inserter threads
+       drain, so a slow database holds the parsers back instead of letting
+       batches pile up in memory. Prints how long each stage spent idle, and
+       returns the per stage statistics. Using more than one inserter needs a
+       logger that is safe to share between threads (mongoCRUD is).'''
+    if not (os.path.exists(folderpath) and os.path.isdir(folderpath)):
+      print 'Invalid directory', folderpath
+      return None
+    print 'Pipelined historical tick data folder import initiated'
+    if gz:
+      parse_fun = self._parseSingleGzTickFile
+    else:
+      parse_fun = self._parseSingleRawTickFile
+    files = Queue.Queue()
+    for f in os.listdir(folderpath):
+      files.put(f)
+    batches = Queue.Queue(maxsize=queue_depth)
+    failed = threading.Event()
+    parser_stats = [{"Idle" : 0.0} for i in range(parsers)]
+    inserter_stats = [{"Idle" : 0.0, "Documents" : 0} for i in range(inserters)]
+    parser_threads = [threading.Thread(target=self._runPipelineParser,
+                                       args=(files, batches, parse_fun, folderpath, stats, failed))
+                      for stats in parser_stats]
+    inserter_threads = [threading.Thread(target=self._runPipelineInserter,
+                                         args=(batches, stats, failed))
+                        for stats in inserter_stats]
+    start = time.time()
+    for thread in parser_threads + inserter_threads:
+      thread.start()
+    for thread in parser_threads:
+      thread.join()
+    for thread in inserter_threads:
+      batches.put(None)
+    for thread in inserter_threads:
+      thread.join()
+    elapsed = time.time() - start
+    if failed.is_set():
+      print 'Pipelined historical tick data folder import failed'
+      return None
+    total = sum([stats["Documents"] for stats in inserter_stats])
+    for i, stats in enumerate(parser_stats):
+      print 'Parser %d: idle %.2f of %.2f seconds' % (i, stats["Idle"], elapsed)
+    for i, stats in enumerate(inserter_stats):
+      print 'Inserter %d: %d docs, idle %.2f of %.2f seconds' % (i, stats["Documents"], stats["Idle"], elapsed)
+    self._finishFolderImport(total, elapsed)
+    print 'Pipelined historical tick data folder import completed'
+    return {"Parsers" : parser_stats, "Inserters" : inserter_stats, "Seconds" : elapsed}
+
+class MongoDataImporter(TickDataImporter):
   '''Class to handle reading arbitrary csv files, and make the data they 
-     contain into usable JSON data for storage in MongoDB'''
-  def __init__(self, host, port, db_name, coll_name):
+     contain into usable JSON data for storage in MongoDB. If bucket_seconds
+     is given, ticks are stored in per symbol, per interval bucket documents
+     (see TickBuckets.py) instead of one document per tick.'''
+  def __init__(self, host, port, db_name, coll_name, shard_key=None, bucket_seconds=None, **options):
+    TickDataImporter.__init__(self, **options)
+    self.init_args = (host, port, db_name, coll_name)
+    self.options = dict(options, shard_key=shard_key, bucket_seconds=bucket_seconds)
     self.logger = MongoLogger.mongoCRUD(host, port)
     self.logger.initDataDB(db_name, coll_name)
+    if bucket_seconds:
+      if self.schema.name != "full":
+        raise ValueError('Bucketed storage needs the full document schema, not ' + self.schema.name)
+      import TickBuckets
+      self.logger = TickBuckets.BucketedLogger(self.logger, bucket_seconds)
+      self.logger.ensureIndexes()
+    if shard_key:
+      # Group every batch by destination shard before inserting it
+      import ShardPreSplitter
+      self.router = ShardPreSplitter.ShardPreSplitter(host, port, db_name, coll_name, shard_key,
+                                                      schema=self.schema)
+
+  def preSplitCollection(self, folderpath, num_chunks):
+    '''Function to pre-split the (sharded) data collection into num_chunks
+       chunks spread over all the shards, based on a sample of the shard key
+       in the tick files of a folder. Requires the importer to have been
+       created with a shard_key.'''
+    return self.router.preSplitFromFolder(folderpath, num_chunks)
   
   def parseHistoricalStockDataToDB(self, filepath):
     '''Function to handle reading historical stock data from a file, and
@@ -91,245 +726,62 @@ class MongoDataImporter:
     else:
       print 'Invalid directory', folderpath
 
-  def _blankToNum(self, input):
-    '''Helper function to allow for conversion of a blank column value to an
-       integer or float in the parsing functions'''
-    if input == '':
-      return 0
-    else:
-      return input
-
-  def _parseSingleRawTickFile(self, folderpath, filepath):
-    '''Helper function to parse a single, raw tick file (not gzipped), 
-       and return a list of valid dicts to be added to the database.'''
-    print 'Parsing file:', filepath
-    entry_list = []
-    with open(os.path.join(folderpath, filepath), 'r') as f:
-      reader = csv.reader(f, delimiter='|')
-      region = filepath[0:3]
-      for line in reader:
-        # Do blank value catching to avoid parsing errors
-        row = [self._blankToNum(i) for i in line]
-        # Generate the data entry to insert
-        if row[0] == 'T': # Tick Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Trade",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "Price" : float(row[3]),
-                   "Volume" : int(row[4]),
-                   "ExchangeID" : int(row[5])}
-          entry_list.append(entry)
-        elif row[0] == 'Q': # Quote Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Quote",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "AskPrice" : float(row[3]),
-                   "AskSize" : int(row[4]),
-                   "AskExchangeID" : int(row[5]),
-                   "BidPrice" : float(row[6]),
-                   "BidSize" : int(row[7]),
-                   "BidExchangeID" : int(row[8])}
-          entry_list.append(entry)
-        elif row[0] == 's': # Start Record
-          print 'Starting new record:', row[2]
-        elif row[0] == 'e': # End Record
-          print 'Ending record:', row[2]
-        elif row[0] == 'z': # EOF Continuation Record
-          print 'End of file', filepath
-        else:
-          print 'Invalid entry:', row
-        '''Begin hack to deal with memory overflow problem'''
-        if len(entry_list) > 10000:
-          self.logger.insertData(entry_list)
-          entry_list = []
-        '''End hack'''
-    assert f.closed
-    return entry_list
-
-  def parseRawTickDataFolderToDB(self, folderpath):
-    '''Function to handle going through a folder containing historical tick data, 
-       located in raw text files, separated by day, and converting the 
-       information into JSON documents to be stored in MongoDB'''
-    if os.path.exists(folderpath) and os.path.isdir(folderpath):
-      print 'Historical tick data folder import initiated'
-      listing = os.listdir(folderpath)
-      for f in listing:
-        entries = self._parseSingleRawTickFile(folderpath, f)
-        self.logger.insertData(entries)
-      print 'Historical tick data folder import completed'
-    else:
-      print 'Invalid directory', folderpath
-
-  def _parseSingleGzTickFile(self, folderpath, filepath):
-    '''Helper function to parse a single tick file gzip container, and return
-       a list of valid dicts to be added to the database. Essentially does 
-       the same thing as the _parseSingleRawTickFle function, but allows for
-       decompression on the fly, with the drawback of slower performance.'''
-    print 'Parsing file:', filepath
-    entry_list = []
-    with gzip.open(os.path.join(folderpath, filepath), 'rb') as f:
-      reader = csv.reader(f, delimiter='|')
-      region = filepath[0:3]
-      for line in reader:
-        # Do blank value catching to avoid parsing errors
-        row = [self._blankToNum(i) for i in line]
-        # Generate the data entry to insert
-        if row[0] == 'T': # Tick Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Trade",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "Price" : float(row[3]),
-                   "Volume" : int(row[4]),
-                   "ExchangeID" : int(row[5])}
-          entry_list.append(entry)
-        elif row[0] == 'Q': # Quote Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Quote",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "AskPrice" : float(row[3]),
-                   "AskSize" : int(row[4]),
-                   "AskExchangeID" : int(row[5]),
-                   "BidPrice" : float(row[6]),
-                   "BidSize" : int(row[7]),
-                   "BidExchangeID" : int(row[8])}
-          entry_list.append(entry)
-        elif row[0] == 's': # Start Record
-          print 'Starting new record:', row[2]
-        elif row[0] == 'e': # End Record
-          print 'Ending record:', row[2]
-        elif row[0] == 'z': # EOF Continuation Record
-          print 'End of file', filepath
-        else:
-          print 'Invalid entry:', row
-        '''Begin hack to deal with memory overflow problem'''
-        if len(entry_list) > 100000:
-          self.logger.insertData(entry_list)
-          entry_list = []
-        '''End hack'''
-    assert f.closed
-    return entry_list
-
-  def parseGzTickDataFolderToDB(self, folderpath):
-    '''Function to handle going through a folder containing historical tick data, 
-       located in gzipped containers, separated by day, and converting the 
-       information into JSON documents to be stored in MongoDB. Essentially
-       the same thing as parseRawTickDataFolderToDB function, but allows for
-       dealing with compressed files, with the drawback of slower performance.'''
-    if os.path.exists(folderpath) and os.path.isdir(folderpath):
-      print 'Historical tick data folder import initiated'
-      listing = os.listdir(folderpath)
-      for f in listing:
-        entries = self._parseSingleGzTickFile(folderpath, f)
-        self.logger.insertData(entries)
-      print 'Historical tick data folder import completed'
-    else:
-      print 'Invalid directory', folderpath
-
-class SQLDataImporter:
+class SQLDataImporter(TickDataImporter):
   '''Class to handle reading arbitrary csv files, and sending them to MySQL 
-     to be stored'''
-  def __init__(self, host, dbName, userID, password):
-    self.logger = MySQLLogger.MySQLCRUD(host, dbName, userID, password)
+     to be stored. batch_rows and load_data set how MySQLCRUD sends each
+     batch (multi-row inserts of batch_rows rows, or LOAD DATA LOCAL INFILE).'''
+  def __init__(self, host, dbName, userID, password, batch_rows=MySQLLogger.DEFAULT_BATCH_ROWS, load_data=False,
+               **options):
+    TickDataImporter.__init__(self, **options)
+    self.init_args = (host, dbName, userID, password)
+    self.options = dict(options, batch_rows=batch_rows, load_data=load_data)
+    self.logger = MySQLLogger.MySQLCRUD(host, dbName, userID, password, batch_rows, load_data)
     #self.logger.initDataDB()
-  
-  def _parseSingleRawTickFile(self, folderpath, filepath):
-    '''Helper function to parse a single, raw tick file (not gzipped), 
-       and return a list of valid dicts to be added to the database.'''
-    print 'Parsing file:', filepath
-    entry_list = []
-    with open(os.path.join(folderpath, filepath), 'r') as f:
-      reader = csv.reader(f, delimiter='|')
-      region = filepath[0:3]
-      for line in reader:
-        # Do blank value catching to avoid parsing errors
-        row = [self._blankToNum(i) for i in line]
-        # Generate the data entry to insert
-        if row[0] == 'T': # Tick Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Trade",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "Price" : float(row[3]),
-                   "Volume" : int(row[4]),
-                   "ExchangeID" : int(row[5])}
-          entry_list.append(entry)
-        elif row[0] == 'Q': # Quote Data
-          entry = {"EntryType" : "Historical Tick Data",
-                   "TickType" : "Quote",
-                   "Timestamp" : datetime.datetime.now(),
-                   "HistoricalTimestamp" : datetime.datetime.strptime(filepath[4:12] + ':' + row[1][0:8], '%Y%m%d:%H:%M:%S'),
-                   "Region" : region,
-                   "Symbol" : str(row[2]),
-                   "AskPrice" : float(row[3]),
-                   "AskSize" : int(row[4]),
-                   "AskExchangeID" : int(row[5]),
-                   "BidPrice" : float(row[6]),
-                   "BidSize" : int(row[7]),
-                   "BidExchangeID" : int(row[8])}
-          entry_list.append(entry)
-        elif row[0] == 's': # Start Record
-          print 'Starting new record:', row[2]
-        elif row[0] == 'e': # End Record
-          print 'Ending record:', row[2]
-        elif row[0] == 'z': # EOF Continuation Record
-          print 'End of file', filepath
-        else:
-          print 'Invalid entry:', row
-        '''Begin hack to deal with memory overflow problem'''
-        if len(entry_list) > 10000:
-          self.logger.insertData(entry_list)
-          entry_list = []
-        '''End hack'''
-    assert f.closed
-    return entry_list
 
-  def parseRawTickDataFolderToDB(self, folderpath):
-    '''Function to handle going through a folder containing historical tick data, 
-       located in raw text files, separated by day, and converting the 
-       information into JSON documents to be stored in MongoDB'''
-    if os.path.exists(folderpath) and os.path.isdir(folderpath):
-      print 'Historical tick data folder import initiated'
-      listing = os.listdir(folderpath)
-      for f in listing:
-        entries = self._parseSingleRawTickFile(folderpath, f)
-        self.logger.insertData(entries)
-      print 'Historical tick data folder import completed'
-    else:
-      print 'Invalid directory', folderpath
-  
-  def _blankToNum(self, input):
-    '''Helper function to allow for conversion of a blank column value to an
-       integer or float in the parsing functions'''
-    if input == '':
-      return 0
-    else:
-      return input
+
+class SinkDataImporter(TickDataImporter):
+  '''Class to import tick data into any of the sinks in DataSinks.py, such
+     as the null sink (to measure parsing alone), a SQLite file or a JSON
+     lines file. sink is the sink's name, and sink_args the keyword arguments
+     for DataSinks.openSink.'''
+  def __init__(self, sink, sink_args=None, **options):
+    TickDataImporter.__init__(self, **options)
+    self.init_args = (sink, sink_args)
+    self.options = options
+    self.logger = DataSinks.openSink(sink, **(sink_args or {}))
   
 
 def usage():
   '''Prints command line usage help of the script'''
   print 'Sample Usage:'
   print '\tpython DataImporter.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --path [file|folder path]'
+  print 'Optional Args:'
+  print '\t--gz (folder holds gzipped tick files)'
+  print '\t--batchdocs [max documents per insert batch]'
+  print '\t--batchbytes [max estimated bytes per insert batch]'
+  print '\t--workers [number of import processes]'
+  print '\t--columnar (decode tick files into NumPy columns, requires numpy)'
+  print '\t--gzprocess (decompress gzipped tick files in a separate process)'
+  print '\t--manifest [progress file path, to make the import resumable]'
+  print '\t--shardkey [route each batch by shard using this shard key]'
+  print '\t--presplit [# of chunks to pre-split the collection into, needs --shardkey]'
+  print '\t--schema [document layout: full, compact or compactint]'
+  print '\t--bucket [seconds per symbol bucket document, instead of a document per tick]'
+  print '\t--pipeline (overlap parsing and inserting in separate threads)'
+  print '\t--parsers [parser threads, with --pipeline]'
+  print '\t--inserters [inserter threads, with --pipeline]'
+  print '\t--queuedepth [max batches waiting to be inserted, with --pipeline]'
+  print '\t--sqlbatch [rows per multi-row insert, with --sql]'
+  print '\t--loaddata (bulk load batches with LOAD DATA LOCAL INFILE, with --sql)'
+  print '\t--sink [import into a local sink instead: null, sqlite, jsonl or bson]'
+  print '\t--sinkpath [file for the sqlite, jsonl or bson sink]'
+  print '\t--baseline (measure a null sink import first, and report against it)'
   print
 
 def main():
   '''Function to test the DataImporter module from the command line'''
   try:
-    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'userID=', 'pwd=', 'path=', 'sql'])
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'userID=', 'pwd=', 'path=', 'sql', 'gz', 'batchdocs=', 'batchbytes=', 'workers=', 'columnar', 'gzprocess', 'manifest=', 'shardkey=', 'presplit=', 'schema=', 'bucket=', 'pipeline', 'parsers=', 'inserters=', 'queuedepth=', 'sink=', 'sinkpath=', 'baseline', 'sqlbatch=', 'loaddata'])
   except getopt.error, msg:
     usage()
     print 'Error:', str(msg)
@@ -342,6 +794,26 @@ def main():
   pwd = 'root'
   path = ''
   sql_option = False
+  gz_option = False
+  batch_docs = DEFAULT_BATCH_DOCS
+  batch_bytes = None
+  workers = 1
+  columnar = False
+  gz_process = False
+  manifest = None
+  shard_key = None
+  presplit_chunks = 0
+  schema = None
+  bucket_seconds = None
+  sink = None
+  sink_path = None
+  baseline = False
+  sql_batch_rows = MySQLLogger.DEFAULT_BATCH_ROWS
+  load_data = False
+  pipeline = False
+  parsers = 1
+  inserters = 1
+  queue_depth = 8
   # Parse command line options
   for option, arg in opts:
     if option == '--host':
@@ -362,20 +834,82 @@ def main():
       sql_option = True
       host = 'VM-Atlas01-SDNY'
       db = 'test'
+    elif option == '--gz':
+      gz_option = True
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+    elif option == '--batchbytes':
+      batch_bytes = int(arg)
+    elif option == '--workers':
+      workers = int(arg)
+    elif option == '--columnar':
+      columnar = True
+    elif option == '--gzprocess':
+      gz_option = True
+      gz_process = True
+    elif option == '--manifest':
+      manifest = arg
+    elif option == '--shardkey':
+      shard_key = arg
+    elif option == '--presplit':
+      presplit_chunks = int(arg)
+    elif option == '--schema':
+      schema = arg
+    elif option == '--bucket':
+      bucket_seconds = int(arg)
+    elif option == '--pipeline':
+      pipeline = True
+    elif option == '--parsers':
+      parsers = int(arg)
+    elif option == '--inserters':
+      inserters = int(arg)
+    elif option == '--queuedepth':
+      queue_depth = int(arg)
+    elif option == '--sink':
+      sink = arg
+    elif option == '--sinkpath':
+      sink_path = arg
+    elif option == '--baseline':
+      baseline = True
+    elif option == '--sqlbatch':
+      sql_batch_rows = int(arg)
+    elif option == '--loaddata':
+      load_data = True
     else:
       assert False, "unhandled option"
   # Get remaining necessary arguments
   while not path:
     path = raw_input('Please enter the path of the folder to extract data from: ')
   # Instantiate the importer, and import the data
-  if sql_option: #Import to SQL database
+  options = {"batch_docs" : batch_docs,
+             "batch_bytes" : batch_bytes,
+             "columnar" : columnar,
+             "gz_process" : gz_process,
+             "manifest" : manifest,
+             "schema" : schema}
+  if sink: #Import to a local sink
+    print 'Importing to', sink, 'sink'
+    importer = SinkDataImporter(sink, {"path" : sink_path}, **options)
+  elif sql_option: #Import to SQL database
     print 'Importing to SQL database'
-    importer = SQLDataImporter(host, db, userID, pwd)
-    importer.parseRawTickDataFolderToDB(path)
+    importer = SQLDataImporter(host, db, userID, pwd, sql_batch_rows, load_data, **options)
   else: #Do the default Mongo importing
     print 'If db has been dropped recently, make sure to reenable sharding, and ensure indexes'
-    importer = MongoDataImporter(host, port, db, coll)
+    importer = MongoDataImporter(host, port, db, coll, shard_key, bucket_seconds, **options)
+    if shard_key and presplit_chunks:
+      importer.preSplitCollection(path, presplit_chunks)
+  if baseline:
+    importer.measureParseBaseline(path, gz_option)
+  if workers > 1:
+    importer.parseTickDataFolderParallel(path, workers, gz_option)
+  elif pipeline:
+    importer.parseTickDataFolderPipelined(path, parsers, inserters, queue_depth, gz_option)
+  elif gz_option:
+    importer.parseGzTickDataFolderToDB(path)
+  else:
     importer.parseRawTickDataFolderToDB(path)
+  if sink:
+    importer.logger.close()
 
 # Boilerplate code to get the program to run from the command line
 if __name__ == '__main__':
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+'''
+DataSinks.py - Python script defining the places imported tick data can be
+written to.
+
+A sink is anything with an insertData(entry, scheduledStart=None) method
+that takes a document or a list of documents, and returns an insertion speed
+log entry. mongoCRUD (MongoLogger.py) and MySQLCRUD (MySQLLogger.py) are
+sinks for their databases. This module adds sinks that need no server:
+
+  null   - counts the documents and throws them away. Importing into it
+           measures the parse speed alone, which is the client side ceiling
+           for every database sink.
+  sqlite - a local SQLite file, with the same Ticks table as MySQLCRUD.
+  jsonl  - a file of JSON documents, one per line.
+  bson   - a file of concatenated BSON documents (requires pymongo's bson).
+
+The local sinks have no benchmark database, so they keep their insertion
+speed log entries in memory (see popDeferredInsertionEntries). openSink
+opens any sink, database or local, by name, and DataImporter's
+SinkDataImporter (--sink on its command line) imports tick files into it.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import time
+import datetime
+import json
+import sqlite3
+import threading
+import MySQLLogger
+
+
+SINKS = ["mongo", "mysql", "sqlite", "jsonl", "bson", "null"]
+# SQLite types of MySQLCRUD's Ticks table columns (MySQLLogger.TICK_COLUMNS)
+SQLITE_COLUMN_TYPES = {"EntryType" : "text", "TickType" : "text", "InsertTime" : "timestamp",
+                       "HistoricalTimestamp" : "timestamp", "Region" : "text", "Symbol" : "text",
+                       "QuotePrice" : "real", "Volume" : "integer", "QuoteExchangeID" : "integer",
+                       "AskPrice" : "real", "AskSize" : "integer", "AskExchangeID" : "integer",
+                       "BidPrice" : "real", "BidSize" : "integer", "BidExchangeID" : "integer",
+                       "Open" : "real", "High" : "real", "Low" : "real", "Close" : "real"}
+
+
+class LocalSink:
+  '''Base class for the sinks that need no database server. Subclasses
+     override _write(entries), which stores a list of documents. insertData
+     times every write and keeps its log entry, tagged with the sink's name,
+     in insertionEntries. Writes are serialized with a lock, so one sink can
+     be shared by the pipelined importer's inserter threads.'''
+  def __init__(self, name):
+    self.name = name
+    self.documents = 0
+    self.insertionEntries = []
+    self.lock = threading.Lock()
+
+  def _write(self, entries):
+    '''Stores a list of documents. Does nothing here, so a sink that does
+       not override it only counts the documents it is given.'''
+    pass
+
+  def insertData(self, entry, scheduledStart=None):
+    '''Stores a document, or a list of documents, and logs how long it took
+       like mongoCRUD.insertData. Returns the log entry.'''
+    if isinstance(entry, dict):
+      entry = [entry]
+    logEntry = {"EntryType" : "Insertion Speed",
+                "Timestamp" : datetime.datetime.now(),
+                "InsertAmount" : len(entry),
+                "InsertType" : str(type(entry)),
+                "Sink" : self.name}
+    start = time.time()
+    with self.lock:
+      self._write(entry)
+      self.documents += len(entry)
+    end = time.time()
+    logEntry["Start"] = float(start)
+    logEntry["End"] = float(end)
+    logEntry["SecondsToInsert"] = float(end - start)
+    if scheduledStart is not None:
+      logEntry["ScheduledStart"] = float(scheduledStart)
+      logEntry["SecondsSinceScheduled"] = float(end - scheduledStart)
+    with self.lock:
+      self.insertionEntries.append(logEntry)
+    return logEntry
+
+  def addInsertionSpeedEntry(self, entry):
+    '''Keeps insertion speed log entries passed in from elsewhere (such as
+       import worker processes) with this sink's own'''
+    if isinstance(entry, dict):
+      entry = [entry]
+    self.insertionEntries.extend(entry)
+
+  def deferInsertionLogging(self):
+    '''Nothing to do, local sinks always hold on to their log entries'''
+    pass
+
+  def popDeferredInsertionEntries(self):
+    '''Returns the insertion speed log entries kept since the last call, and
+       clears them'''
+    entries = self.insertionEntries
+    self.insertionEntries = []
+    return entries
+
+  def close(self):
+    '''Flushes and closes whatever the sink writes to'''
+    pass
+
+
+class NullSink(LocalSink):
+  '''Sink that only counts the documents it is given'''
+  def __init__(self):
+    LocalSink.__init__(self, "null")
+
+
+class FileSink(LocalSink):
+  '''Sink that appends documents to a file, as JSON lines (format jsonl) or
+     concatenated BSON documents (format bson). Each batch is written with a
+     single write call, so several import processes can append to the same
+     file without interleaving documents.'''
+  def __init__(self, path, format='jsonl'):
+    LocalSink.__init__(self, format)
+    if format == 'bson':
+      import bson
+      self.encode = lambda entry: bson.BSON.encode(entry)
+    elif format == 'jsonl':
+      self.encode = lambda entry: json.dumps(entry, default=self._jsonDefault) + '\n'
+    else:
+      raise ValueError('Unknown file sink format: ' + format)
+    self.f = open(path, 'ab')
+
+  def _jsonDefault(self, value):
+    '''Helper function to write the values json has no type for (dates, and
+       the _id the Mongo driver may have added) as strings'''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+      return value.isoformat()
+    return str(value)
+
+  def _write(self, entries):
+    self.f.write(''.join([self.encode(entry) for entry in entries]))
+
+  def close(self):
+    self.f.close()
+
+
+class SQLiteSink(LocalSink):
+  '''Sink that stores documents in the Ticks table of a local SQLite file,
+     with the same columns as MySQLCRUD, whose column mapping and row builder
+     it shares. Useful as a SQL stand-in when no MySQL server is available.'''
+  def __init__(self, path):
+    LocalSink.__init__(self, "sqlite")
+    self.conn = sqlite3.connect(path, check_same_thread=False)
+    self.conn.execute('create table if not exists Ticks (' +
+                      ', '.join([name + ' ' + SQLITE_COLUMN_TYPES[name] for name in MySQLLogger.TICK_COLUMNS]) + ')')
+    self.conn.execute('create index if not exists SymbolIndex on Ticks (Symbol)')
+    self.conn.execute('create index if not exists HistTime on Ticks (HistoricalTimestamp)')
+    self.conn.commit()
+    self.statement = 'insert into Ticks (' + ', '.join(MySQLLogger.TICK_COLUMNS) + ') values (' + \
+                     ', '.join(['?'] * len(MySQLLogger.TICK_COLUMNS)) + ')'
+
+  def _write(self, entries):
+    self.conn.executemany(self.statement, [MySQLLogger.entryToRow(entry) for entry in entries])
+    self.conn.commit()
+
+  def close(self):
+    self.conn.close()
+
+
+def openSink(kind, host=None, port=27017, db=None, coll=None, user=None, password=None, path=None,
+             batch_rows=None, load_data=False):
+  '''Returns a sink by name (one of SINKS). mongo needs host, port, db and
+     coll; mysql needs host, db, user and password, and takes batch_rows and
+     load_data (see MySQLCRUD); sqlite, jsonl and bson need a path.'''
+  if kind == 'mongo':
+    import MongoLogger
+    sink = MongoLogger.mongoCRUD(host, port)
+    sink.initDataDB(db, coll)
+    return sink
+  elif kind == 'mysql':
+    import MySQLLogger
+    return MySQLLogger.MySQLCRUD(host, db, user, password, batch_rows or MySQLLogger.DEFAULT_BATCH_ROWS, load_data)
+  elif kind == 'sqlite':
+    return SQLiteSink(path)
+  elif kind in ('jsonl', 'bson'):
+    return FileSink(path, kind)
+  elif kind == 'null':
+    return NullSink()
+  raise ValueError('Unknown sink: ' + str(kind))
+
+def measureNullSinkBaseline(batch_factory):
+  '''Function to run a workload (a function returning an iterable of
+     batches, as used by the benchmarks) into a null sink. The docs/sec this
+     returns is the speed of producing the workload alone, the ceiling for
+     any database it is inserted into.'''
+  sink = NullSink()
+  start = time.time()
+  for batch in batch_factory():
+    sink.insertData(batch)
+  elapsed = time.time() - start
+  return {"Sink" : "null",
+          "Documents" : sink.documents,
+          "Seconds" : elapsed,
+          "DocsPerSecond" : sink.documents / max(elapsed, 1e-9)}
+
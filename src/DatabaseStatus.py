@@ -17,7 +17,7 @@ Resources used:
 __author__ = ('jasonrdsouza (Jason Dsouza)')
 
 import pymongo
-from pymongo import Connection
+import MongoConnections
 import datetime
 import re
 
@@ -27,7 +27,7 @@ class databaseStatus:
      useful statistics from it by utilizing mongo's build in monitoring
      and profiling functions.'''
   def __init__(self, host, port, db):
-    connection = Connection(host, port)
+    connection = MongoConnections.getConnection(host, port)
     self.host = host
     self.port = port
     self.database = pymongo.database.Database(connection, db)
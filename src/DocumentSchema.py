@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+'''
+DocumentSchema.py - Python script defining the document layouts that tick
+data can be stored in, and how to translate documents and queries between
+them.
+
+The full schema is the layout the importers produce, with long field names,
+the constant EntryType and the insert time Timestamp. The compact schemas
+use short keys and drop those two fields, and can also store prices as
+scaled integers. The same schema object is used by the importer to encode
+documents, and by QueryBuilder to rewrite its queries and map-reduce
+functions to match.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import re
+
+
+COMPACT_KEYS = {"HistoricalTimestamp" : "t",
+                "TickType" : "k",
+                "Region" : "r",
+                "Symbol" : "s",
+                "Price" : "p",
+                "Volume" : "v",
+                "ExchangeID" : "x",
+                "AskPrice" : "ap",
+                "AskSize" : "as",
+                "AskExchangeID" : "ax",
+                "BidPrice" : "bp",
+                "BidSize" : "bs",
+                "BidExchangeID" : "bx"}
+COMPACT_TICK_TYPES = {"Trade" : "T", "Quote" : "Q"}
+PRICE_FIELDS = ["Price", "AskPrice", "BidPrice"]
+DROPPED_FIELDS = ["EntryType", "Timestamp"]
+
+
+class DocumentSchema:
+  '''The full document layout, as produced by the importers. Documents and
+     queries are passed through unchanged. Subclasses override the field
+     and value mappings.'''
+  def __init__(self, name='full'):
+    self.name = name
+
+  def fieldName(self, field):
+    '''Returns the stored name of a full schema field'''
+    return field
+
+  def encodeValue(self, field, value):
+    '''Returns the stored form of a value of a full schema field'''
+    return value
+
+  def encode(self, entry):
+    '''Returns the stored form of a full schema document'''
+    return entry
+
+  def encodeQuery(self, query):
+    '''Returns a query (or part of one) rewritten for the stored layout.
+       Field names are mapped, and the values they are compared with are
+       encoded, including inside operators such as $gte or $in.'''
+    return query
+
+  def encodeJavascript(self, code):
+    '''Returns javascript (a $where query, or a map/reduce function) with
+       its this.Field references rewritten for the stored layout'''
+    return code
+
+
+class CompactSchema(DocumentSchema):
+  '''Short keys, no EntryType or insert Timestamp, single letter tick types.
+     If price_scale is given, prices are stored as integers of price *
+     price_scale (e.g. 10000 for prices to 1/100th of a cent).'''
+  def __init__(self, name='compact', price_scale=None):
+    DocumentSchema.__init__(self, name)
+    self.price_scale = price_scale
+
+  def fieldName(self, field):
+    return COMPACT_KEYS.get(field, field)
+
+  def encodeValue(self, field, value):
+    if field == "TickType":
+      return COMPACT_TICK_TYPES.get(value, value)
+    if self.price_scale and field in PRICE_FIELDS and isinstance(value, (int, long, float)):
+      return int(round(value * self.price_scale))
+    return value
+
+  def encode(self, entry):
+    doc = {}
+    for field, value in entry.iteritems():
+      if field not in DROPPED_FIELDS:
+        doc[self.fieldName(field)] = self.encodeValue(field, value)
+    return doc
+
+  def _encodeCondition(self, field, condition):
+    '''Encodes the right hand side of a query on a single field'''
+    if isinstance(condition, dict):
+      encoded = {}
+      for operator, operand in condition.iteritems():
+        if operator in ("$regex", "$options", "$exists"):
+          encoded[operator] = operand
+        else:
+          encoded[operator] = self._encodeCondition(field, operand)
+      return encoded
+    if isinstance(condition, list):
+      return [self._encodeCondition(field, value) for value in condition]
+    return self.encodeValue(field, condition)
+
+  def encodeQuery(self, query):
+    if not isinstance(query, dict):
+      return query
+    encoded = {}
+    for field, condition in query.iteritems():
+      if field in ("$and", "$or", "$nor"):
+        encoded[field] = [self.encodeQuery(part) for part in condition]
+      elif field == "$where":
+        encoded[field] = self.encodeJavascript(condition)
+      else:
+        encoded[self.fieldName(field)] = self._encodeCondition(field, condition)
+    return encoded
+
+  def encodeJavascript(self, code):
+    def replaceField(match):
+      return 'this.' + self.fieldName(match.group(1))
+    code = re.sub(r'this\.(\w+)', replaceField, code)
+    for tick_type, short in COMPACT_TICK_TYPES.iteritems():
+      code = code.replace('"' + tick_type + '"', '"' + short + '"')
+    return code
+
+
+SCHEMAS = {"full" : DocumentSchema("full"),
+           "compact" : CompactSchema("compact"),
+           "compactint" : CompactSchema("compactint", price_scale=10000)}
+
+
+def getSchema(name):
+  '''Returns the schema registered under a name (full, compact or
+     compactint). A schema object passed in is returned as is.'''
+  if isinstance(name, DocumentSchema):
+    return name
+  return SCHEMAS[name or "full"]
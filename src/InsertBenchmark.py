@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+'''
+InsertBenchmark.py - Python script to benchmark insertion speed under each
+combination of write concern and insert ordering.
+
+The same workload is inserted once per combination, and every insert is
+logged to insertion_speed by mongoCRUD.insertData, tagged with the
+combination's Series, WriteConcern and Ordering, so the runs can be
+compared side by side. The workload is either a replay cache (see
+ReplayCache.py) or synthetic ticks from a fixed seed (see TickGenerator.py).
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import time
+import MongoLogger
+import DataImporter
+import DataSinks
+
+
+WRITE_CONCERNS = {"unacknowledged" : {"w" : 0},
+                  "acknowledged" : {"w" : 1},
+                  "journaled" : {"w" : 1, "j" : True},
+                  "majority" : {"w" : "majority"}}
+WRITE_CONCERN_ORDER = ["unacknowledged", "acknowledged", "journaled", "majority"]
+ORDERINGS = {"ordered" : {"continue_on_error" : False},
+             "unordered" : {"continue_on_error" : True}}
+ORDERING_ORDER = ["ordered", "unordered"]
+
+
+class InsertModeMatrix:
+  '''Class to run one insert workload under several write concern and
+     ordering combinations. The workload is given as a function that returns
+     a fresh iterable of batches every time it is called, since the driver
+     adds an _id to every document it inserts.'''
+  def __init__(self, host, port, db_name, coll_name):
+    self.logger = MongoLogger.mongoCRUD(host, port)
+    self.logger.initDataDB(db_name, coll_name)
+
+  def runCombination(self, batch_factory, concern, ordering, reset=True):
+    '''Function to insert the workload once with the given write concern and
+       ordering (keys of WRITE_CONCERNS and ORDERINGS). If reset is set, the
+       documents in the data collection are removed first (remove rather than
+       drop, so the collection keeps its sharding and indexes), and the
+       remove is acknowledged before the run starts. The run ends with an
+       acknowledged getlasterror round trip, so unacknowledged inserts still
+       queued on the server are counted in the run's time rather than the
+       next run's. The run's insert latency histograms are logged as an
+       "Insertion Latency Summary". Returns a summary of the run.'''
+    series = concern + '/' + ordering
+    options = dict(WRITE_CONCERNS[concern])
+    options.update(ORDERINGS[ordering])
+    if reset:
+      self.logger.dataColl.remove(safe=True)
+    self.logger.setInsertMode(options, {"Series" : series,
+                                        "WriteConcern" : concern,
+                                        "Ordering" : ordering})
+    count = 0
+    batches = 0
+    self.logger.resetLatency()
+    start = time.time()
+    try:
+      for batch in batch_factory():
+        self.logger.insertData(batch)
+        count += len(batch)
+        batches += 1
+      # Wait for the server to apply every insert sent on this connection
+      self.logger.dataColl.database.command('getlasterror')
+      elapsed = time.time() - start
+      latency = self.logger.logLatencySummary()["Summary"]
+    finally:
+      self.logger.setInsertMode()
+    summary = {"Series" : series,
+               "Documents" : count,
+               "Batches" : batches,
+               "Seconds" : elapsed,
+               "DocsPerSecond" : count / max(elapsed, 1e-9),
+               "SecondsPerBatch" : elapsed / max(batches, 1),
+               "Latency" : latency}
+    print '%-28s %10d docs %8.2f s %12.1f docs/sec %8.4f s/batch  p99 %.4f p99.9 %.4f max %.4f s' % (
+        series, count, elapsed, summary["DocsPerSecond"], summary["SecondsPerBatch"],
+        latency["p99"], latency["p99_9"], latency["Max"])
+    return summary
+
+  def run(self, batch_factory, concerns=WRITE_CONCERN_ORDER, orderings=ORDERING_ORDER, reset=True):
+    '''Function to run the workload under every combination of the given
+       write concerns and orderings. The first summary is the null sink
+       baseline (see DataSinks.py), the speed of producing the workload with
+       no database at all. Returns the list of run summaries.'''
+    baseline = DataSinks.measureNullSinkBaseline(batch_factory)
+    baseline["Series"] = "baseline/null"
+    print '%-28s %10d docs %8.2f s %12.1f docs/sec' % (baseline["Series"], baseline["Documents"],
+                                                       baseline["Seconds"], baseline["DocsPerSecond"])
+    summaries = [baseline]
+    for concern in concerns:
+      for ordering in orderings:
+        summaries.append(self.runCombination(batch_factory, concern, ordering, reset))
+    return summaries
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython InsertBenchmark.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name]'
+  print 'Optional Args:'
+  print '\t--cache [replay cache folder to use as the workload]'
+  print '\t--symbols, --rate, --days, --seed (synthetic workload, used without --cache)'
+  print '\t--batchdocs [documents per insert batch]'
+  print '\t--concerns [comma separated, from ' + ','.join(WRITE_CONCERN_ORDER) + ']'
+  print '\t--orderings [comma separated, from ' + ','.join(ORDERING_ORDER) + ']'
+  print '\t--noreset (do not empty the collection between runs)'
+  print
+
+def main():
+  '''Function to run the write concern/ordering matrix from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'cache=', 'symbols=', 'rate=', 'days=', 'seed=', 'batchdocs=', 'concerns=', 'orderings=', 'noreset'])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'insert_benchmark'
+  cache = ''
+  generator_options = {"seed" : 0}
+  batch_docs = DataImporter.DEFAULT_BATCH_DOCS
+  concerns = WRITE_CONCERN_ORDER
+  orderings = ORDERING_ORDER
+  reset = True
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--cache':
+      cache = arg
+    elif option == '--symbols':
+      generator_options["num_symbols"] = int(arg)
+    elif option == '--rate':
+      generator_options["rate"] = float(arg)
+    elif option == '--days':
+      generator_options["days"] = int(arg)
+    elif option == '--seed':
+      generator_options["seed"] = int(arg)
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+    elif option == '--concerns':
+      concerns = arg.split(',')
+    elif option == '--orderings':
+      orderings = arg.split(',')
+    elif option == '--noreset':
+      reset = False
+  if cache:
+    import ReplayCache
+    replay_cache = ReplayCache.ReplayCache(cache)
+    batch_factory = lambda: replay_cache.iterBatches(batch_docs)
+  else:
+    import TickGenerator
+    batch_factory = lambda: DataImporter.batchEntries(
+        TickGenerator.SyntheticTickGenerator(**generator_options).iterEntries(), batch_docs)
+  matrix = InsertModeMatrix(host, port, db, coll)
+  matrix.run(batch_factory, concerns, orderings, reset)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
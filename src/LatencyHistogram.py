@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+'''
+LatencyHistogram.py - Python script to record insert latencies in
+mergeable, high resolution histograms.
+
+Latencies are measured with a monotonic clock (clock_gettime on Linux,
+through ctypes, since Python 2 has no time.monotonic), so they are not
+thrown off by the wall clock being adjusted. They are counted in HDR-style
+log-linear buckets of microseconds: exact below 2**sub_bucket_bits
+microseconds, and within 1 part in 2**(sub_bucket_bits - 1) above that,
+whatever the magnitude. Histograms only hold counts per bucket, so the
+histograms of several batches, processes or runs can be merged by adding
+them up, and percentiles read off the result.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import math
+import time
+import threading
+
+
+DEFAULT_SUB_BUCKET_BITS = 7
+SUMMARY_PERCENTILES = [("p50", 50.0), ("p90", 90.0), ("p99", 99.0), ("p99_9", 99.9)]
+
+
+def _monotonicClock():
+  '''Returns the best monotonic, high resolution clock function available'''
+  if sys.platform == 'win32':
+    # time.clock is a high resolution performance counter on Windows
+    return time.clock
+  try:
+    import ctypes
+    import ctypes.util
+
+    class timespec(ctypes.Structure):
+      _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+      ts = timespec()
+      if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+        raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+      return ts.tv_sec + ts.tv_nsec * 1e-9
+    monotonic()
+    return monotonic
+  except (OSError, AttributeError, TypeError):
+    return time.time
+
+monotonicTime = _monotonicClock()
+
+
+class LatencyHistogram:
+  '''Histogram of latencies, counted in microsecond buckets. Only the
+     non-empty buckets are stored, keyed by bucket index.'''
+  def __init__(self, sub_bucket_bits=DEFAULT_SUB_BUCKET_BITS):
+    self.sub_bucket_bits = sub_bucket_bits
+    self.sub_bucket_count = 1 << sub_bucket_bits
+    self.half_count = self.sub_bucket_count >> 1
+    self.counts = {}
+    self.count = 0
+    self.total = 0.0
+    self.min = None
+    self.max = None
+
+  def _bucketIndex(self, micros):
+    '''Returns the index of the bucket holding a value in microseconds'''
+    if micros < self.sub_bucket_count:
+      return micros
+    shift = micros.bit_length() - self.sub_bucket_bits
+    return self.sub_bucket_count + (shift - 1) * self.half_count + ((micros >> shift) - self.half_count)
+
+  def _bucketHighest(self, index):
+    '''Returns the highest value in microseconds that falls in a bucket'''
+    if index < self.sub_bucket_count:
+      return index
+    shift = (index - self.sub_bucket_count) // self.half_count + 1
+    sub = (index - self.sub_bucket_count) % self.half_count + self.half_count
+    return ((sub + 1) << shift) - 1
+
+  def record(self, seconds, count=1):
+    '''Adds a latency (in seconds) to the histogram count times'''
+    micros = max(0, int(seconds * 1e6))
+    index = self._bucketIndex(micros)
+    self.counts[index] = self.counts.get(index, 0) + count
+    self.count += count
+    self.total += seconds * count
+    if self.min is None or seconds < self.min:
+      self.min = seconds
+    if self.max is None or seconds > self.max:
+      self.max = seconds
+
+  def merge(self, other):
+    '''Adds the counts of another histogram (with the same sub_bucket_bits)
+       to this one'''
+    for index, count in other.counts.iteritems():
+      self.counts[index] = self.counts.get(index, 0) + count
+    self.count += other.count
+    self.total += other.total
+    if other.min is not None and (self.min is None or other.min < self.min):
+      self.min = other.min
+    if other.max is not None and (self.max is None or other.max > self.max):
+      self.max = other.max
+
+  def percentile(self, percent):
+    '''Returns the latency in seconds that percent of the recorded values
+       are at or below (the top of the bucket it falls in, capped at the
+       exact maximum)'''
+    if not self.count:
+      return 0.0
+    target = max(1, int(math.ceil(self.count * percent / 100.0 - 1e-9)))
+    seen = 0
+    for index in sorted(self.counts):
+      seen += self.counts[index]
+      if seen >= target:
+        return min(self._bucketHighest(index) / 1e6, self.max)
+    return self.max
+
+  def summary(self):
+    '''Returns the count, min, mean, p50, p90, p99, p99.9 (as p99_9, since
+       Mongo keys cannot hold dots) and max latency in seconds'''
+    summary = {"Count" : self.count,
+               "Min" : self.min or 0.0,
+               "Mean" : self.total / max(self.count, 1),
+               "Max" : self.max or 0.0}
+    for name, percent in SUMMARY_PERCENTILES:
+      summary[name] = self.percentile(percent)
+    return summary
+
+  def toDocument(self):
+    '''Returns the histogram as a document that can be stored in Mongo, or
+       passed between processes, and read back with fromDocument'''
+    return {"SubBucketBits" : self.sub_bucket_bits,
+            "Unit" : "microseconds",
+            "Counts" : dict((str(index), count) for index, count in self.counts.iteritems()),
+            "Count" : self.count,
+            "Total" : self.total,
+            "Min" : self.min,
+            "Max" : self.max}
+
+  def fromDocument(cls, doc):
+    '''Returns the histogram stored in a document made by toDocument'''
+    histogram = cls(doc["SubBucketBits"])
+    histogram.counts = dict((int(index), count) for index, count in doc["Counts"].iteritems())
+    histogram.count = doc["Count"]
+    histogram.total = doc["Total"]
+    histogram.min = doc["Min"]
+    histogram.max = doc["Max"]
+    return histogram
+  fromDocument = classmethod(fromDocument)
+
+
+def batchSizeClass(amount):
+  '''Returns the label of the batch size class an insert of amount
+     documents falls in (the next power of two, e.g. "<=1024")'''
+  size = 1
+  while size < amount:
+    size <<= 1
+  return '<=' + str(size)
+
+
+class LatencyRecorder:
+  '''Class to keep a latency histogram of a whole run, and one per batch
+     size class. Safe to share between threads.'''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.histogram = LatencyHistogram()
+    self.byBatchSize = {}
+
+  def record(self, amount, seconds):
+    '''Records the latency of one insert of amount documents'''
+    with self.lock:
+      self.histogram.record(seconds)
+      size_class = batchSizeClass(amount)
+      if size_class not in self.byBatchSize:
+        self.byBatchSize[size_class] = LatencyHistogram()
+      self.byBatchSize[size_class].record(seconds)
+
+  def merge(self, other):
+    '''Adds the histograms of another recorder to this one'''
+    with self.lock:
+      self.histogram.merge(other.histogram)
+      for size_class, histogram in other.byBatchSize.iteritems():
+        if size_class not in self.byBatchSize:
+          self.byBatchSize[size_class] = LatencyHistogram(histogram.sub_bucket_bits)
+        self.byBatchSize[size_class].merge(histogram)
+
+  def toDocument(self):
+    '''Returns the recorder as a document, read back with fromDocument'''
+    with self.lock:
+      return {"Histogram" : self.histogram.toDocument(),
+              "ByBatchSize" : dict((size_class, histogram.toDocument())
+                                   for size_class, histogram in self.byBatchSize.iteritems())}
+
+  def fromDocument(cls, doc):
+    '''Returns the recorder stored in a document made by toDocument'''
+    recorder = cls()
+    recorder.histogram = LatencyHistogram.fromDocument(doc["Histogram"])
+    for size_class, histogram in doc["ByBatchSize"].iteritems():
+      recorder.byBatchSize[size_class] = LatencyHistogram.fromDocument(histogram)
+    return recorder
+  fromDocument = classmethod(fromDocument)
+
+  def getSummaryLogEntry(self):
+    '''Returns an "Insertion Latency Summary" log entry with the percentile
+       summary of the run and of every batch size class, and the
+       histograms themselves so later runs can be merged with them'''
+    with self.lock:
+      entry = {"EntryType" : "Insertion Latency Summary",
+               "Summary" : self.histogram.summary(),
+               "BatchSizeSummaries" : dict((size_class, histogram.summary())
+                                           for size_class, histogram in self.byBatchSize.iteritems())}
+    entry.update(self.toDocument())
+    return entry
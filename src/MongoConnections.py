@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+'''
+MongoConnections.py - Python script to share MongoDB connections between
+all the benchmark components of a process.
+
+mongoCRUD, databaseStatus, MongoQuerier (and with it BenchmarkDataGrabber)
+and ShardPreSplitter all get their connection from here instead of opening
+their own, so one benchmark run makes one connection (and one socket pool)
+per host, port and set of connection options, rather than one per object.
+
+The pool size, connect and socket timeouts, socket keepalive and how long a
+thread waits for a free pooled socket are set process-wide with
+setConnectionOptions, before the first connection is made, and can be
+overridden per call. The time threads spend waiting to check a socket out
+of a pool is recorded in a latency histogram, and logged with the other
+database status entries by getPoolStatsLogEntry.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import os
+import datetime
+import threading
+import pymongo
+from pymongo import Connection
+import LatencyHistogram
+
+
+# Defaults for every connection made through the registry, in the keyword
+# form taken by pymongo's Connection. Options left at None are not passed
+# at all, so that drivers which do not know them (socketKeepAlive needs
+# pymongo 2.8) still connect.
+DEFAULT_CONNECTION_OPTIONS = {"max_pool_size" : 10,
+                              "connectTimeoutMS" : 20000,
+                              "socketTimeoutMS" : None,
+                              "socketKeepAlive" : None,
+                              "waitQueueTimeoutMS" : None}
+
+_options = dict(DEFAULT_CONNECTION_OPTIONS)
+_connections = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+_opened = 0
+_reused = 0
+# Kept apart from _lock, since opening a connection checks a socket out
+_poolWaitLock = threading.Lock()
+_poolWait = LatencyHistogram.LatencyHistogram()
+
+
+def _timePoolCheckouts():
+  '''Wraps pymongo's socket pool checkout, where available, so that the
+     time every thread spends waiting for a pooled socket is recorded'''
+  pool_class = getattr(getattr(pymongo, 'pool', None), 'Pool', None)
+  if pool_class is None or not hasattr(pool_class, 'get_socket'):
+    return
+  get_socket = pool_class.get_socket
+  if getattr(get_socket, 'timesPoolWait', False):
+    return
+
+  def timedGetSocket(self, *args, **kwargs):
+    start = LatencyHistogram.monotonicTime()
+    try:
+      return get_socket(self, *args, **kwargs)
+    finally:
+      seconds = LatencyHistogram.monotonicTime() - start
+      with _poolWaitLock:
+        _poolWait.record(seconds)
+  timedGetSocket.timesPoolWait = True
+  pool_class.get_socket = timedGetSocket
+
+_timePoolCheckouts()
+
+
+def setConnectionOptions(**options):
+  '''Sets the options (max_pool_size, connectTimeoutMS, socketTimeoutMS,
+     socketKeepAlive, waitQueueTimeoutMS, or any other Connection keyword)
+     used for connections made from now on. None leaves an option to the
+     driver default.'''
+  with _lock:
+    _options.update(options)
+
+def getConnectionOptions():
+  '''Returns a copy of the process-wide connection options'''
+  with _lock:
+    return dict(_options)
+
+def getConnection(host, port, **options):
+  '''Returns the shared connection to host and port with the process-wide
+     options, updated with any given here, opening it on first use. A
+     forked child process gets its own connections, never the parent's.'''
+  global _pid, _opened, _reused
+  port = int(port)
+  with _lock:
+    if _pid != os.getpid():
+      _connections.clear()
+      _pid = os.getpid()
+    connection_options = dict(_options)
+    connection_options.update(options)
+    connection_options = dict((key, value) for key, value in connection_options.iteritems() if value is not None)
+    key = (host, port, tuple(sorted(connection_options.iteritems())))
+    if key in _connections:
+      _reused += 1
+    else:
+      _connections[key] = Connection(host, port, **connection_options)
+      _opened += 1
+    return _connections[key]
+
+def closeConnections():
+  '''Closes every shared connection of this process'''
+  with _lock:
+    for connection in _connections.values():
+      connection.disconnect()
+    _connections.clear()
+
+def getPoolStatsLogEntry():
+  '''Returns a "Connection Pool Stats" log entry with the options of every
+     open connection, how many were opened and how many times one was
+     shared, and the percentile summary of the time spent waiting for
+     pooled sockets (empty if the driver does not expose its pool)'''
+  with _lock:
+    entry = {"EntryType" : "Connection Pool Stats",
+             "Timestamp" : datetime.datetime.now(),
+             "Connections" : [dict(options, Host=host, Port=port) for host, port, options in _connections],
+             "Opened" : _opened,
+             "Reused" : _reused}
+  with _poolWaitLock:
+    entry["PoolWait"] = _poolWait.summary()
+    entry["PoolWaitHistogram"] = _poolWait.toDocument()
+  return entry
@@ -13,17 +13,192 @@ __author__ = ('jasonrdsouza (Jason Dsouza)')
 import sys
 import getopt
 import datetime
+import os
 import time
+import threading
+import atexit
 #import pymongo
-from pymongo import Connection
+from pymongo.errors import DuplicateKeyError, ConnectionFailure
+import MongoConnections
+import LatencyHistogram
+import BenchmarkRollups
+
+
+DEFAULT_LOG_FLUSH_ENTRIES = 1000
+DEFAULT_LOG_FLUSH_SECONDS = 1.0
+# Attempts at an upsert that loses a race to create its document
+UPSERT_ATTEMPTS = 3
+# Compound indexes of the benchmark collections, matching the filters (and
+# Timestamp sort) of BenchmarkDataGrabber. Distinct on Query, Mapper, Series
+# and Hostname is served by the indexes led by those fields.
+BENCHMARK_INDEXES = {"hd_usage" : [[("Hostname", 1), ("Timestamp", 1)]],
+                     "insertion_speed" : [[("EntryType", 1), ("Timestamp", 1)],
+                                          [("Series", 1), ("EntryType", 1), ("Timestamp", 1)]],
+                     "query_speed" : [[("EntryType", 1), ("Timestamp", 1)],
+                                      [("Query", 1), ("EntryType", 1), ("Timestamp", 1)],
+                                      [("Mapper", 1), ("EntryType", 1), ("Timestamp", 1)]],
+                     "db_status" : [[("EntryType", 1), ("Timestamp", 1)]]}
+TIMESTAMP_INDEX = "Timestamp_1"
+
+
+class BufferedLogWriter:
+  '''Class to write benchmark log entries in the background. Entries are
+     added to an in-memory buffer, and a daemon thread inserts them in bulk,
+     one insert per collection, once flush_entries are waiting or every
+     flush_seconds. The buffer is also flushed when the program exits
+     normally (through atexit), and can be flushed at any time with flush.
+     If a flush loses the connection, its entries go back in the buffer for
+     the next one. If the server rejects an insert for any other reason, the
+     entries are inserted one at a time, and those that still fail (such as
+     entries with keys containing '.') are reported and dropped, so one bad
+     entry cannot hold up the rest. A forked child process starts with an
+     empty buffer and its own flush thread, so entries buffered by the
+     parent are never written twice.
+     If after_insert is given, it is called with the collection and the
+     entries after every successful insert.'''
+  def __init__(self, flush_entries=DEFAULT_LOG_FLUSH_ENTRIES, flush_seconds=DEFAULT_LOG_FLUSH_SECONDS,
+               after_insert=None):
+    self.flush_entries = flush_entries
+    self.flush_seconds = flush_seconds
+    self.after_insert = after_insert
+    self.closed = False
+    self._start()
+    atexit.register(self.close)
+
+  def _start(self):
+    '''Helper function to start the flush thread of this process, with an
+       empty buffer'''
+    self.pid = os.getpid()
+    self.buffer = []
+    self.pending = 0
+    self.condition = threading.Condition()
+    self.flush_lock = threading.Lock()
+    self.thread = threading.Thread(target=self._run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def add(self, collection, entry):
+    '''Buffers an entry, or a list of entries, to be inserted into a
+       collection'''
+    if not isinstance(entry, list):
+      entry = [entry]
+    if self.pid != os.getpid():
+      self._start()
+    with self.condition:
+      self.buffer.append((collection, entry))
+      self.pending += len(entry)
+      if self.pending >= self.flush_entries:
+        self.condition.notify()
+
+  def _run(self):
+    '''Flush thread. Waits for enough entries or for the flush interval,
+       whichever comes first, then writes out the buffer.'''
+    while True:
+      with self.condition:
+        if not self.closed and self.pending < self.flush_entries:
+          self.condition.wait(self.flush_seconds)
+        if self.closed:
+          return
+      self.flush()
+
+  def flush(self):
+    '''Writes every buffered entry out now, in one insert per collection'''
+    if self.pid != os.getpid():
+      self._start()
+    with self.flush_lock:
+      with self.condition:
+        buffered = self.buffer
+        self.buffer = []
+        self.pending = 0
+      if not buffered:
+        return
+      by_collection = []
+      for collection, entries in buffered:
+        for group in by_collection:
+          if group[0] is collection:
+            group[1].extend(entries)
+            break
+        else:
+          by_collection.append((collection, list(entries)))
+      failed = []
+      for collection, entries in by_collection:
+        # continue_on_error, so that a batch cut short by a lost connection
+        # is written as far as possible, and the rest is retried rather than
+        # the whole batch re-sent
+        try:
+          collection.insert(entries, continue_on_error=True)
+          written = entries
+        except ConnectionFailure, e:
+          print 'Benchmark log write to', collection.name, 'failed, will retry:', e
+          failed.append((collection, entries))
+          continue
+        except Exception:
+          written, retry = self._insertEach(collection, entries)
+          if retry:
+            failed.append((collection, retry))
+        if self.after_insert and written:
+          self.after_insert(collection, written)
+      if failed:
+        with self.condition:
+          self.buffer = failed + self.buffer
+          self.pending += sum([len(entries) for collection, entries in failed])
+
+  def _insertEach(self, collection, entries):
+    '''Helper function to insert entries one at a time after a batch insert
+       failed. Entries already written by the batch (which then fail with a
+       duplicate key error) count as written; entries the server rejects
+       are reported and dropped. Returns the written entries and, if the
+       connection was lost, the entries still to retry.'''
+    written = []
+    for i, entry in enumerate(entries):
+      try:
+        collection.insert(entry)
+      except DuplicateKeyError:
+        pass
+      except ConnectionFailure, e:
+        print 'Benchmark log write to', collection.name, 'failed, will retry:', e
+        return written, entries[i:]
+      except Exception, e:
+        print 'Dropped a benchmark log entry', collection.name, 'rejected:', e
+        continue
+      written.append(entry)
+    return written, []
+
+  def close(self):
+    '''Stops the flush thread and writes out whatever is left, reporting
+       any entries that could not be written. Safe to call more than once.'''
+    if self.pid != os.getpid():
+      return
+    with self.condition:
+      if self.closed:
+        return
+      self.closed = True
+      self.condition.notify()
+    self.thread.join()
+    self.flush()
+    if self.pending:
+      print self.pending, 'benchmark log entries could not be written, and were dropped'
 
 
 class mongoCRUD:
   '''Simple class for persistant storage using MongoDB.
      Requires that MongoDB is installed to work.
-     Defaults to connecting to a local MongoDB instance.'''
-  def __init__(self, host, port):
-    self.connection = Connection(host, port)
+     Defaults to connecting to a local MongoDB instance.
+     Benchmark log entries are written in the background by a
+     BufferedLogWriter, unless buffer_logs is turned off, in which case
+     every add*Entry call inserts straight away. If rollup_on_write is set,
+     every insertion_speed and query_speed entry written is also added to
+     its hourly and daily rollups (see BenchmarkRollups).'''
+  def __init__(self, host, port, buffer_logs=True, rollup_on_write=False):
+    self.connection = MongoConnections.getConnection(host, port)
+    self.deferredInsertionEntries = None
+    self.insertOptions = {}
+    self.insertTags = {}
+    self.latency = LatencyHistogram.LatencyRecorder()
+    self.rollupOnWrite = rollup_on_write
+    self.logWriter = None
+    if buffer_logs:
+      self.logWriter = BufferedLogWriter(after_insert=self._rollupLogEntries)
   
   def _createDB(self, db_name):
     '''Creates a new database with the given name'''
@@ -34,16 +209,66 @@ class mongoCRUD:
        database.'''
     return db[coll_name]
   
-  def initBenchmarkDB(self, db_name):
+  def initBenchmarkDB(self, db_name, retention_days=None):
     '''Creates a new database in MongoDB, that has the necessary structure
        to function as a database for benchmarking the DB, and store all its
-       data'''
+       data. If retention_days is given, raw entries of the collections that
+       are rolled up expire after that many days (see setRetention).'''
     self.database = self._createDB(db_name)
     self.hd_usage = self._createCollection(self.database, 'hd_usage')
     self.insertion_speed = self._createCollection(self.database, 'insertion_speed')
     self.query_speed = self._createCollection(self.database, 'query_speed')
     self.db_status = self._createCollection(self.database, 'db_status')
     #self.full_log = self._createCollection(self.database, 'full_log') --> add more collections here, if necessary
+    self._ensureBenchmarkIndexes()
+    if retention_days is not None:
+      self.setRetention(retention_days)
+  
+  def _ensureBenchmarkIndexes(self):
+    '''Helper function to create the indexes of the benchmark collections and
+       of their rollups'''
+    for coll_name, indexes in BENCHMARK_INDEXES.iteritems():
+      coll = self.database[coll_name]
+      for index in indexes:
+        coll.ensure_index(index)
+      # Left alone if it exists, since it may be a TTL index
+      if TIMESTAMP_INDEX not in coll.index_information():
+        coll.create_index("Timestamp")
+    for coll_name in BenchmarkRollups.ROLLUP_SPECS:
+      for granularity, length, suffix in BenchmarkRollups.GRANULARITIES:
+        rollups = self.database[coll_name + suffix]
+        rollups.ensure_index([("EntryType", 1), ("Period", 1)])
+        rollups.ensure_index("Period")
+  
+  def setRetention(self, days):
+    '''Makes raw entries of the rolled up benchmark collections
+       (insertion_speed and query_speed) expire days after their Timestamp,
+       through a TTL index, or keeps them forever if days is None or 0. Their
+       history is kept in the hourly and daily rollups, as long as
+       rollupBenchmarkHistory runs at least once per retention period. Small
+       collections (hd_usage, db_status) are always kept in full.'''
+    for coll_name in BenchmarkRollups.ROLLUP_SPECS:
+      coll = self.database[coll_name]
+      index = coll.index_information().get(TIMESTAMP_INDEX, {})
+      if not days:
+        if "expireAfterSeconds" in index:
+          coll.drop_index(TIMESTAMP_INDEX)
+          coll.create_index("Timestamp")
+      elif "expireAfterSeconds" in index:
+        self.database.command("collMod", coll_name, index={"keyPattern" : {"Timestamp" : 1},
+                                                            "expireAfterSeconds" : int(days * 86400)})
+      else:
+        if index:
+          coll.drop_index(TIMESTAMP_INDEX)
+        coll.create_index("Timestamp", expireAfterSeconds=int(days * 86400))
+  
+  def rollupBenchmarkHistory(self):
+    '''Writes out buffered log entries, then rebuilds every complete hour
+       and day of raw insertion_speed and query_speed entries past the
+       watermarks into their rollup collections. Returns the number of raw
+       entries read per collection and granularity.'''
+    self.flushLogs()
+    return BenchmarkRollups.rollupBenchmarkHistory(self.database)
   
   def initDataDB(self, db_name, coll_name):
     '''Creates a database for inserting "application data" into, to benchmark 
@@ -57,55 +282,189 @@ class mongoCRUD:
        the benchmarking. Useful if the user wants to start over with a fresh 
        database with nothing in it. Once executed, call 'initBenchmarkDB' to 
        get a clean Benchmark database.'''
+    self.flushLogs()
     self.hd_usage.drop()
     self.insertion_speed.drop()
     self.query_speed.drop()
     self.db_status.drop()
+    for coll_name in BenchmarkRollups.ROLLUP_SPECS:
+      for granularity, length, suffix in BenchmarkRollups.GRANULARITIES:
+        self.database[coll_name + suffix].drop()
+    self.database[BenchmarkRollups.ROLLUP_STATE_COLLECTION].drop()
     #self.full_log.drop() --> add more collections here, if necessary, as well
   
   def killDataDB(self):
     '''Drops the data datebase. Similar to the killBenchmarkDB function'''
     self.dataColl.drop()
   
+  def _addLogEntry(self, collection, entry):
+    '''Helper function to write log entries to a benchmark collection,
+       through the log writer if logs are buffered'''
+    if self.logWriter:
+      self.logWriter.add(collection, entry)
+      return None
+    ids = collection.insert(entry)
+    if isinstance(entry, list):
+      self._rollupLogEntries(collection, entry)
+    else:
+      self._rollupLogEntries(collection, [entry])
+    return ids
+  
+  def _rollupLogEntries(self, collection, entries):
+    '''Helper function to add just written log entries to their rollups, if
+       rollups are kept on write and the collection is rolled up. A failure
+       is printed rather than raised, since the entries themselves are
+       written, and the watermark job can rebuild their periods.'''
+    if not self.rollupOnWrite or collection.name not in BenchmarkRollups.ROLLUP_SPECS:
+      return
+    try:
+      BenchmarkRollups.rollupEntries(collection.database, collection.name, entries)
+    except Exception, e:
+      print 'Rollup of', collection.name, 'entries failed:', e
+  
+  def flushLogs(self):
+    '''Writes out any buffered benchmark log entries now'''
+    if self.logWriter:
+      self.logWriter.flush()
+  
   def addHdUsageEntry(self, entry):
     '''Inserts a harddrive usage log entry into the database. The entry must be a valid
        JSON string. Function accepts multiple entries as a list. 
-       This function returns the entry ID(s)'''
-    return self.hd_usage.insert(entry)
+       This function returns the entry ID(s), or None if logs are buffered'''
+    return self._addLogEntry(self.hd_usage, entry)
     
   def addInsertionSpeedEntry(self, entry):
     '''Inserts an insertion speed log entry into the database. The entry must be a valid
        JSON string. Function accepts multiple entries as a list. 
-       This function returns the entry ID(s)'''
-    return self.insertion_speed.insert(entry)
+       This function returns the entry ID(s), or None if logs are buffered'''
+    return self._addLogEntry(self.insertion_speed, entry)
     
   def addQuerySpeedEntry(self, entry):
     '''Inserts a query speed log entry into the database. The entry must be a valid
        JSON string. Function accepts multiple entries as a list. 
-       This function returns the entry ID(s)'''
-    return self.query_speed.insert(entry)
+       This function returns the entry ID(s), or None if logs are buffered'''
+    return self._addLogEntry(self.query_speed, entry)
     
   def addDbStatusEntry(self, entry):
     '''Inserts a DB status log entry into the database. The entry must be a valid
        JSON string. Function accepts multiple entries as a list. 
-       This function returns the entry ID(s)'''
-    return self.db_status.insert(entry)
+       This function returns the entry ID(s), or None if logs are buffered'''
+    return self._addLogEntry(self.db_status, entry)
   
-  def insertData(self, entry):
+  def insertData(self, entry, scheduledStart=None):
     '''Inserts a data entry into the data database. The entry must be a valid JSON
        string. Function accepts multiple entries as a list.
-       This function also logs how long the insertion takes.'''
+       This function also logs how long the insertion takes. If the insert was
+       scheduled to start at a given time.time() value, the log entry also
+       records how long after that time the insert completed. Returns the
+       log entry.'''
     logEntry = {"EntryType" : "Insertion Speed",
            "Timestamp" : datetime.datetime.now(),
            "InsertAmount" : int(len(entry)),
            "InsertType" : str(type(entry))}
     start = time.time()
-    self.dataColl.insert(entry)
-    end = time.time()
+    clock_start = LatencyHistogram.monotonicTime()
+    self.dataColl.insert(entry, **self.insertOptions)
+    seconds = LatencyHistogram.monotonicTime() - clock_start
+    return self._logDataWrite(logEntry, start, time.time(), seconds, scheduledStart)
+  
+  def upsertData(self, updates, amount, scheduledStart=None):
+    '''Applies a list of (selector, update) pairs to the data collection as
+       upserts, for layouts that add to existing documents rather than
+       inserting new ones (see TickBuckets.py). amount is the number of ticks
+       the updates hold, logged as the InsertAmount. Logged and returned like
+       insertData, with the number of documents touched as Upserts.
+       Upserts are acknowledged unless the insert mode sets a write concern.
+       When two writers upsert the same new document at once, the unique
+       index on the selector fails one of them with a duplicate key error,
+       and that upsert is retried, which then updates the document the other
+       one created.'''
+    logEntry = {"EntryType" : "Insertion Speed",
+           "Timestamp" : datetime.datetime.now(),
+           "InsertAmount" : int(amount),
+           "InsertType" : "Upsert",
+           "Upserts" : len(updates)}
+    # Insert ordering options do not apply to updates, only the write concern
+    options = dict(self.insertOptions)
+    options.pop("continue_on_error", None)
+    options.setdefault("w", 1)
+    start = time.time()
+    clock_start = LatencyHistogram.monotonicTime()
+    for selector, update in updates:
+      for attempt in range(UPSERT_ATTEMPTS):
+        try:
+          self.dataColl.update(selector, update, upsert=True, **options)
+          break
+        except DuplicateKeyError:
+          if attempt == UPSERT_ATTEMPTS - 1:
+            raise
+    seconds = LatencyHistogram.monotonicTime() - clock_start
+    return self._logDataWrite(logEntry, start, time.time(), seconds, scheduledStart)
+  
+  def _logDataWrite(self, logEntry, start, end, seconds, scheduledStart=None):
+    '''Helper function to finish and store the insertion speed log entry of
+       a write to the data collection that ran from start to end (wall clock
+       times) and took seconds by the monotonic clock, and to add it to the
+       latency histograms'''
+    logEntry.update(self.insertTags)
     logEntry["Start"] = float(start)
     logEntry["End"] = float(end)
-    logEntry["SecondsToInsert"] = float(end - start)
-    self.addInsertionSpeedEntry(logEntry)
+    logEntry["SecondsToInsert"] = float(seconds)
+    self.latency.record(logEntry["InsertAmount"], seconds)
+    if scheduledStart is not None:
+      logEntry["ScheduledStart"] = float(scheduledStart)
+      logEntry["SecondsSinceScheduled"] = float(end - scheduledStart)
+    if self.deferredInsertionEntries is None:
+      self.addInsertionSpeedEntry(logEntry)
+    else:
+      self.deferredInsertionEntries.append(logEntry)
+    return logEntry
+  
+  def resetLatency(self):
+    '''Starts new latency histograms for the inserts that follow, and
+       returns the LatencyHistogram.LatencyRecorder holding the old ones'''
+    recorder = self.latency
+    self.latency = LatencyHistogram.LatencyRecorder()
+    return recorder
+  
+  def logLatencySummary(self, tags=None):
+    '''Logs the latency histograms of every insert since the last summary
+       (or reset) as an "Insertion Latency Summary" entry in insertion_speed,
+       with p50/p90/p99/p99.9/max for the whole run and per batch size, and
+       starts new histograms. The entry is tagged like the inserts were, plus
+       any extra tags given. Returns the entry.'''
+    entry = self.resetLatency().getSummaryLogEntry()
+    entry["Timestamp"] = datetime.datetime.now()
+    entry.update(self.insertTags)
+    entry.update(tags or {})
+    if self.deferredInsertionEntries is None:
+      self.addInsertionSpeedEntry(entry)
+    else:
+      self.deferredInsertionEntries.append(entry)
+    return entry
+  
+  def setInsertMode(self, options=None, tags=None):
+    '''Sets the keyword options passed to the driver on every insertData call
+       (write concern w/j/wtimeout, continue_on_error for unordered inserts),
+       and the tags added to its insertion speed log entries, so that runs in
+       different modes are stored as separate series. Call with no arguments
+       to go back to the driver defaults.'''
+    self.insertOptions = options or {}
+    self.insertTags = tags or {}
+  
+  def deferInsertionLogging(self):
+    '''Makes insertData hold on to its insertion speed log entries instead of
+       writing them to the benchmark database. Used by import worker processes,
+       whose entries are collected with popDeferredInsertionEntries and
+       written by the parent process.'''
+    self.deferredInsertionEntries = []
+  
+  def popDeferredInsertionEntries(self):
+    '''Returns the insertion speed log entries held back since the last call,
+       and clears them.'''
+    entries = self.deferredInsertionEntries or []
+    self.deferredInsertionEntries = []
+    return entries
   
   def Test(self):
     '''Method that gets called when executing MongoLogger.py from the
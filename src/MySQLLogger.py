@@ -12,12 +12,63 @@ import getopt
 import datetime
 import time
 import types
-import MySQLdb
+import os
+import tempfile
+
+
+DEFAULT_BATCH_ROWS = 1000
+# Columns of the Ticks table, in the order rows are sent. DataSinks' SQLite
+# sink creates and fills the same table from these and entryToRow.
+TICK_COLUMNS = ['EntryType', 'TickType', 'InsertTime', 'HistoricalTimestamp', 'Region', 'Symbol',
+                'QuotePrice', 'Volume', 'QuoteExchangeID', 'AskPrice', 'AskSize', 'AskExchangeID',
+                'BidPrice', 'BidSize', 'BidExchangeID', 'Open', 'High', 'Low', 'Close']
+# Entry keys that are stored under a different column name
+COLUMN_NAMES = {'Ticker' : 'Symbol',
+                'Timestamp' : 'InsertTime',
+                'HistoricalDate' : 'HistoricalTimestamp',
+                'ExchangeID' : 'QuoteExchangeID',
+                'Price' : 'QuotePrice'}
+
+
+def loadDataValue(value):
+    '''Formats a value for a LOAD DATA file: \\N for NULL, and backslash,
+       tab and newline escaped in strings'''
+    if value is None:
+        return '\\N'
+    if type(value) == types.FloatType:
+        return repr(value)
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def entryToRow(entry):
+    '''Turns an entry into a tuple of values in TICK_COLUMNS order, with
+       None (NULL) for the columns the entry does not have. Keys without
+       a column are ignored.'''
+    row = dict.fromkeys(TICK_COLUMNS)
+    for key, value in entry.iteritems():
+        column = COLUMN_NAMES.get(key, key)
+        if column in row:
+            row[column] = value
+    return tuple([row[column] for column in TICK_COLUMNS])
 
 
 class MySQLCRUD:
-    def __init__(self, host, dbname, user, password):
-        self.conn=MySQLdb.connect(host=host, user=user, passwd=password, db=dbname)
+    '''Class for storing data in the Ticks table of a MySQL database.
+       batch_rows is the number of rows sent per multi-row insert. If
+       load_data is set, batches are bulk loaded with LOAD DATA LOCAL INFILE
+       instead, which needs local_infile enabled on the server.'''
+    def __init__(self, host, dbname, user, password, batch_rows=DEFAULT_BATCH_ROWS, load_data=False):
+        import MySQLdb
+        if load_data:
+            self.conn=MySQLdb.connect(host=host, user=user, passwd=password, db=dbname, local_infile=1)
+        else:
+            self.conn=MySQLdb.connect(host=host, user=user, passwd=password, db=dbname)
+        self.batch_rows = batch_rows
+        self.load_data = load_data
+        self.insertStatement = 'insert into Ticks (' + ', '.join(TICK_COLUMNS) + ') values (' + \
+                               ', '.join(['%s'] * len(TICK_COLUMNS)) + ')'
+        self.loadStatement = "load data local infile %s into table Ticks fields terminated by '\\t' " + \
+                             "lines terminated by '\\n' (" + ', '.join(TICK_COLUMNS) + ')'
         
     def initDataDB(self):
         cursor = self.conn.cursor()
@@ -40,58 +91,55 @@ class MySQLCRUD:
         
 
 
-    def insertData(self, entry):
-        if type(entry) == types.ListType:
-            for thisEntry in entry:
-                self.insertSingleEntry(thisEntry)
-            self.conn.commit()
-        elif type(entry) == types.DictType:
-            self.insertSingleEntry(entry)
-            self.conn.commit()
-        else:
+    def insertData(self, entry, scheduledStart=None):
+        '''Inserts an entry, or a list of entries, into the Ticks table and
+           commits once. Rows are sent as parameterized multi-row inserts of
+           up to batch_rows rows, or through LOAD DATA LOCAL INFILE if the
+           logger was created with load_data. Returns an insertion speed log
+           entry like mongoCRUD.insertData.'''
+        if type(entry) == types.DictType:
+            entry = [entry]
+        elif type(entry) != types.ListType:
             print 'Unexpected type passed to insertData: '
             print type(entry)
-
-    def insertSingleEntry(self, entry):
-        sqlStringBase = 'insert into Ticks ('
-        sqlStringVals = ''
-        firstTimeThrough = True
-
-        for key in entry.keys():
-            value = entry[key]
-            if firstTimeThrough == True:
-                firstTimeThrough = False;
-            else:
-                sqlStringBase = sqlStringBase + ', '
-                sqlStringVals = sqlStringVals + ', '
-            if key == 'Ticker':
-                sqlStringBase = sqlStringBase + 'Symbol'
-            elif key == 'Timestamp':
-                sqlStringBase = sqlStringBase + 'InsertTime'
-            elif key == 'HistoricalDate':
-                sqlStringBase = sqlStringBase + 'HistoricalTimestamp'
-            elif key == 'ExchangeID':
-                sqlStringBase = sqlStringBase + 'QuoteExchangeID'
-            elif key == 'Price':
-                sqlStringBase = sqlStringBase + 'QuotePrice'
-            else:
-                sqlStringBase = sqlStringBase + key
-
-            if type(value) == types.StringType:
-                sqlStringVals = sqlStringVals + "'" + str(value) + "'"
-            elif type(value) == datetime.datetime:
-                sqlStringVals = sqlStringVals + "'" + str(value) + "'"
-            else:
-                sqlStringVals = sqlStringVals + str(value)
-        
-        sqlStatement = sqlStringBase +  ') values (' + sqlStringVals + ')'
-        print sqlStatement
-        
+            return None
+        logEntry = {"EntryType" : "Insertion Speed",
+                    "Timestamp" : datetime.datetime.now(),
+                    "InsertAmount" : len(entry),
+                    "InsertType" : str(type(entry)),
+                    "Sink" : "mysql"}
+        start = time.time()
+        rows = [entryToRow(thisEntry) for thisEntry in entry]
         cursor = self.conn.cursor()
-        cursor.execute(sqlStatement)
+        if self.load_data:
+            self.loadRows(cursor, rows)
+        else:
+            for i in range(0, len(rows), self.batch_rows):
+                cursor.executemany(self.insertStatement, rows[i:i + self.batch_rows])
+        self.conn.commit()
+        end = time.time()
+        logEntry["Start"] = float(start)
+        logEntry["End"] = float(end)
+        logEntry["SecondsToInsert"] = float(end - start)
+        if scheduledStart is not None:
+            logEntry["ScheduledStart"] = float(scheduledStart)
+            logEntry["SecondsSinceScheduled"] = float(end - scheduledStart)
+        return logEntry
+
+    def loadRows(self, cursor, rows):
+        '''Writes rows to a temporary tab separated file, and bulk loads it
+           into the Ticks table with LOAD DATA LOCAL INFILE'''
+        f = tempfile.NamedTemporaryFile(suffix='.tsv', delete=False)
+        try:
+            for row in rows:
+                f.write('\t'.join([loadDataValue(value) for value in row]) + '\n')
+            f.close()
+            cursor.execute(self.loadStatement, (f.name,))
+        finally:
+            f.close()
+            os.remove(f.name)
 
 
-        
     def Test(self):
         cursor = self.conn.cursor()
         cursor.execute('create table testtable (theName varchar(20), theNum integer)')
@@ -0,0 +1,485 @@
+#!/usr/bin/python
+
+'''
+QueryLoad.py - Python script to measure query throughput and latency under
+concurrent load.
+
+A number of clients (threads, or processes so that result decoding is not
+held back by the GIL) each run queries back to back for a fixed duration,
+picking every query at random from a weighted mix of the QueryBuilder
+queries (smallSet, mediumSet, largeSet, regex and javascript). Latencies
+are counted per query type in LatencyHistograms, which are merged over all
+the clients. A run can step through several client counts, to find how
+many concurrent readers the cluster serves before latency breaks an SLO.
+
+Clients that wait for each query before sending the next (closed loop)
+slow down along with the server, so they send fewer queries exactly when
+latency is high, and under-report the tail. OpenLoopQueryDriver instead
+sends the mix on a fixed arrival schedule (constant or Poisson) at a target
+QPS, whether or not earlier queries have returned, and measures every
+query's latency from its scheduled start, so time spent queued behind a
+slow server is counted. A pool of sender threads runs the blocking pymongo
+calls, like SteadyStateIngest does for inserts.
+
+Every step is logged to query_speed as a "Query Load" entry, with the
+aggregate QPS and the percentile summary (and histogram) of every query
+type.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import bisect
+import random
+import time
+import datetime
+import threading
+import multiprocessing
+import MongoLogger
+import MongoConnections
+import LatencyHistogram
+from QueryWorkload import MongoQueryBackend
+
+
+# Default weights of the query mix: mostly selective lookups, some scans
+DEFAULT_QUERY_MIX = "smallSet:40,mediumSet:25,largeSet:10,regex:15,javascript:10"
+DEFAULT_DURATION = 30.0
+DEFAULT_SENDERS = 32
+ARRIVALS = ["constant", "poisson"]
+
+
+class QueryMix:
+  '''Class to pick query names at random in proportion to their weights'''
+  def __init__(self, weights):
+    self.weights = dict((name, float(weight)) for name, weight in weights.iteritems() if weight > 0)
+    if not self.weights:
+      raise ValueError('Query mix has no queries with a positive weight')
+    self.names = sorted(self.weights)
+    self.cumulative = []
+    total = 0.0
+    for name in self.names:
+      total += self.weights[name]
+      self.cumulative.append(total)
+    self.total = total
+
+  def fromString(cls, mix):
+    '''Returns the mix described by a string of comma separated name:weight
+       pairs, e.g. "smallSet:40,largeSet:10"'''
+    weights = {}
+    for item in mix.split(','):
+      name, weight = item.split(':')
+      weights[name.strip()] = float(weight)
+    return cls(weights)
+  fromString = classmethod(fromString)
+
+  def choose(self, rand):
+    '''Returns a query name, drawn with the given random.Random'''
+    return self.names[bisect.bisect_right(self.cumulative, rand.random() * self.total)]
+
+  def toDocument(self):
+    '''Returns the weights, normalized to fractions of the mix'''
+    return dict((name, weight / self.total) for name, weight in self.weights.iteritems())
+
+
+def runClosedLoopClient(backend, mix, duration, seed):
+  '''Runs queries from the mix back to back on a backend for duration
+     seconds. Returns a dictionary of query name - LatencyHistogram pairs
+     for the queries that succeeded, and one for those that failed.'''
+  rand = random.Random(seed)
+  histograms = {}
+  errors = {}
+  deadline = LatencyHistogram.monotonicTime() + duration
+  while True:
+    start = LatencyHistogram.monotonicTime()
+    if start >= deadline:
+      break
+    name = mix.choose(rand)
+    try:
+      backend.runQuery(name)
+      recordLatency(histograms, name, LatencyHistogram.monotonicTime() - start)
+    except Exception:
+      recordLatency(errors, name, LatencyHistogram.monotonicTime() - start)
+  return histograms, errors
+
+def recordLatency(histograms, name, seconds):
+  '''Records a latency in the histogram of a query name, in a dictionary of
+     query name - LatencyHistogram pairs'''
+  if name not in histograms:
+    histograms[name] = LatencyHistogram.LatencyHistogram()
+  histograms[name].record(seconds)
+
+
+def _loadProcessWorker(args):
+  '''Process pool task. Runs one client with its own connection, and returns
+     its histograms as documents for the parent process to merge.'''
+  host, port, db_name, coll_name, mix, duration, seed = args
+  backend = MongoQueryBackend(host, port, db_name, coll_name)
+  histograms, errors = runClosedLoopClient(backend, QueryMix(mix), duration, seed)
+  return (dict((name, histogram.toDocument()) for name, histogram in histograms.iteritems()),
+          dict((name, histogram.toDocument()) for name, histogram in errors.iteritems()))
+
+
+def mergeClientResults(results):
+  '''Merges the (histograms, errors) results of several clients, each a
+     dictionary of query name - LatencyHistogram pairs of the successful
+     and the failed queries. Returns the merged dictionaries of successful
+     queries, the histogram of all successful queries, and the merged
+     dictionary of failed queries.'''
+  total = LatencyHistogram.LatencyHistogram()
+  by_query = {}
+  errors = {}
+  for histograms, client_errors in results:
+    for name, histogram in histograms.iteritems():
+      if name not in by_query:
+        by_query[name] = LatencyHistogram.LatencyHistogram()
+      by_query[name].merge(histogram)
+      total.merge(histogram)
+    for name, histogram in client_errors.iteritems():
+      if name not in errors:
+        errors[name] = LatencyHistogram.LatencyHistogram()
+      errors[name].merge(histogram)
+  return by_query, total, errors
+
+def queryLoadLogEntry(driver, collection, mix, elapsed, by_query, total, errors):
+  '''Returns the "Query Load" log entry of a step that ran for elapsed
+     seconds, with the aggregate QPS and latency summary, and those of
+     every query type. QPS and latencies are those of the successful
+     queries; failed ones are counted in Errors, and the latency until they
+     failed is summarized in ErrorSummary.'''
+  failed = LatencyHistogram.LatencyHistogram()
+  for histogram in errors.itervalues():
+    failed.merge(histogram)
+  return {"EntryType" : "Query Load",
+          "Timestamp" : datetime.datetime.now(),
+          "Driver" : driver,
+          "Collection" : collection,
+          "Mix" : mix.toDocument(),
+          "Seconds" : elapsed,
+          "Queries" : total.count,
+          "Errors" : failed.count,
+          "ErrorSummary" : failed.summary(),
+          "QPS" : total.count / max(elapsed, 1e-9),
+          "Summary" : total.summary(),
+          "ByQuery" : dict((name, dict(histogram.summary(), QPS=histogram.count / max(elapsed, 1e-9),
+                                       Errors=name in errors and errors[name].count or 0))
+                           for name, histogram in by_query.iteritems()),
+          "Histograms" : dict((name, histogram.toDocument()) for name, histogram in by_query.iteritems())}
+
+def printQueryLoadStep(label, entry):
+  '''Prints the results of a step, overall and per query type'''
+  print '%s: %8d queries in %6.1f s, %9.1f QPS, p50 %.4f p99 %.4f max %.4f s, %d errors' % (
+      label, entry["Queries"], entry["Seconds"], entry["QPS"], entry["Summary"]["p50"], entry["Summary"]["p99"],
+      entry["Summary"]["Max"], entry["Errors"])
+  for name in sorted(entry["ByQuery"]):
+    summary = entry["ByQuery"][name]
+    print '    %-12s %8d queries, p50 %.4f p90 %.4f p99 %.4f s' % (name, summary["Count"], summary["p50"],
+                                                               summary["p90"], summary["p99"])
+
+def printSLOResult(entries, load_key, load_name, slo_p99):
+  '''Prints the highest load (clients or target QPS) of a run whose overall
+     p99 stayed within the SLO'''
+  within = [entry[load_key] for entry in entries if entry["Summary"]["p99"] <= slo_p99]
+  if within:
+    print 'Most %s within the p99 SLO of %.4f s: %g' % (load_name, slo_p99, max(within))
+  else:
+    print 'No %s met the p99 SLO of %.4f s' % (load_name, slo_p99)
+
+
+def stepConnectionOptions(concurrency):
+  '''Returns the connection options for a step whose concurrency threads
+     share one connection: a pool at least that large, so they never queue
+     for sockets. The options apply to the step's connection only, and the
+     process-wide options are left alone.'''
+  pool_size = MongoConnections.getConnectionOptions().get("max_pool_size")
+  if pool_size and concurrency > pool_size:
+    return {"max_pool_size" : concurrency}
+  return {}
+
+
+class QueryLoadGenerator:
+  '''Class to run the query mix from several concurrent clients against a
+     collection. Thread clients share one connection, with a pool at least
+     as large as the client count; process clients each open their own. If a
+     benchmark logger (mongoCRUD with initBenchmarkDB done) is given,
+     every step is logged to query_speed.'''
+  def __init__(self, host, port, db_name, coll_name, mix=None, processes=False, logger=None, seed=0):
+    self.host = host
+    self.port = port
+    self.db_name = db_name
+    self.coll_name = coll_name
+    self.mix = mix or QueryMix.fromString(DEFAULT_QUERY_MIX)
+    self.processes = processes
+    self.logger = logger
+    self.seed = seed
+
+  def _runThreads(self, clients, duration):
+    '''Helper function to run the clients as threads. Returns the results of
+       every client.'''
+    results = [None] * clients
+    options = stepConnectionOptions(clients)
+    backends = [MongoQueryBackend(self.host, self.port, self.db_name, self.coll_name, **options)
+                for i in range(clients)]
+
+    def client(i):
+      results[i] = runClosedLoopClient(backends[i], self.mix, duration, self.seed + i)
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def _runProcesses(self, clients, duration):
+    '''Helper function to run the clients as processes. Returns the results
+       of every client.'''
+    tasks = [(self.host, self.port, self.db_name, self.coll_name, self.mix.weights, duration, self.seed + i)
+             for i in range(clients)]
+    pool = multiprocessing.Pool(clients)
+    try:
+      documents = pool.map(_loadProcessWorker, tasks)
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+    fromDocuments = lambda docs: dict((name, LatencyHistogram.LatencyHistogram.fromDocument(doc))
+                                      for name, doc in docs.iteritems())
+    return [(fromDocuments(histograms), fromDocuments(errors)) for histograms, errors in documents]
+
+  def runStep(self, clients, duration=DEFAULT_DURATION):
+    '''Function to run the mix from clients concurrent clients for duration
+       seconds. Prints and returns the "Query Load" log entry of the step.'''
+    start = LatencyHistogram.monotonicTime()
+    if self.processes:
+      results = self._runProcesses(clients, duration)
+    else:
+      results = self._runThreads(clients, duration)
+    elapsed = LatencyHistogram.monotonicTime() - start
+    by_query, total, errors = mergeClientResults(results)
+    entry = queryLoadLogEntry("closed loop", self.db_name + '.' + self.coll_name, self.mix, elapsed,
+                              by_query, total, errors)
+    entry["Clients"] = clients
+    entry["ClientType"] = self.processes and "process" or "thread"
+    printQueryLoadStep('%3d clients' % clients, entry)
+    if self.logger:
+      self.logger.addQuerySpeedEntry(entry)
+    return entry
+
+  def run(self, client_counts, duration=DEFAULT_DURATION, slo_p99=None):
+    '''Function to run a step for every client count in turn. If slo_p99 (in
+       seconds) is given, prints the most clients whose overall p99 stayed
+       within it. Returns the list of step entries.'''
+    entries = [self.runStep(clients, duration) for clients in client_counts]
+    if slo_p99 is not None:
+      printSLOResult(entries, "Clients", "clients", slo_p99)
+    return entries
+
+
+def arrivalSchedule(mix, qps, duration, arrival="poisson", seed=0):
+  '''Generator of the (offset, query name) pairs of an open loop run, where
+     offset is the number of seconds after the start of the run that the
+     query is due. Queries arrive at qps per second on average, evenly
+     spaced ("constant") or with exponentially distributed gaps
+     ("poisson"), for duration seconds.'''
+  if arrival not in ARRIVALS:
+    raise ValueError('Unknown arrival process: ' + str(arrival))
+  rand = random.Random(seed)
+  offset = 0.0
+  while True:
+    if arrival == "poisson":
+      offset += rand.expovariate(qps)
+    else:
+      offset += 1.0 / qps
+    if offset >= duration:
+      return
+    yield (offset, mix.choose(rand))
+
+
+class OpenLoopQueryDriver:
+  '''Class to send the query mix on a fixed arrival schedule. senders is the
+     number of threads running queries (each with its own backend on the
+     shared connection); it bounds the queries in flight, so it should be
+     well above target QPS times the expected latency. A query still
+     counts its wait for a free sender, since latency is measured from its
+     scheduled start.'''
+  def __init__(self, host, port, db_name, coll_name, mix=None, senders=DEFAULT_SENDERS, logger=None, seed=0):
+    self.host = host
+    self.port = port
+    self.db_name = db_name
+    self.coll_name = coll_name
+    self.mix = mix or QueryMix.fromString(DEFAULT_QUERY_MIX)
+    self.senders = senders
+    self.logger = logger
+    self.seed = seed
+
+  def _send(self, backend, schedule, lock, start, results):
+    '''Sender thread. Takes the next scheduled query, waits for its start
+       time, runs it, and records its latency from the scheduled start, its
+       service time from when it was actually sent, and the dispatch lag
+       in between. The latency of failed queries is recorded in their own
+       histograms, like runClosedLoopClient does.'''
+    latency = {}
+    service = LatencyHistogram.LatencyHistogram()
+    lag = LatencyHistogram.LatencyHistogram()
+    errors = {}
+    while True:
+      with lock:
+        try:
+          offset, name = next(schedule)
+        except StopIteration:
+          break
+      scheduled = start + offset
+      delay = scheduled - LatencyHistogram.monotonicTime()
+      if delay > 0:
+        time.sleep(delay)
+      sent = LatencyHistogram.monotonicTime()
+      lag.record(max(0.0, sent - scheduled))
+      try:
+        backend.runQuery(name)
+      except Exception:
+        recordLatency(errors, name, LatencyHistogram.monotonicTime() - scheduled)
+        continue
+      done = LatencyHistogram.monotonicTime()
+      recordLatency(latency, name, done - scheduled)
+      service.record(done - sent)
+    results.append((latency, errors, service, lag))
+
+  def runStep(self, qps, duration=DEFAULT_DURATION, arrival="poisson"):
+    '''Function to send the mix at qps queries per second for duration
+       seconds. Prints and returns the "Query Load" log entry of the step,
+       whose latencies are measured from the scheduled starts. The service
+       time (what a closed loop client would report) and the dispatch lag
+       are summarized alongside.'''
+    options = stepConnectionOptions(self.senders)
+    backends = [MongoQueryBackend(self.host, self.port, self.db_name, self.coll_name, **options)
+                for i in range(self.senders)]
+    schedule = arrivalSchedule(self.mix, qps, duration, arrival, self.seed)
+    lock = threading.Lock()
+    results = []
+    start = LatencyHistogram.monotonicTime()
+    threads = [threading.Thread(target=self._send, args=(backend, schedule, lock, start, results))
+               for backend in backends]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = LatencyHistogram.monotonicTime() - start
+    by_query, total, errors = mergeClientResults([(latency, errors) for latency, errors, service, lag in results])
+    service = LatencyHistogram.LatencyHistogram()
+    lag = LatencyHistogram.LatencyHistogram()
+    for result in results:
+      service.merge(result[2])
+      lag.merge(result[3])
+    entry = queryLoadLogEntry("open loop", self.db_name + '.' + self.coll_name, self.mix, elapsed,
+                              by_query, total, errors)
+    entry["TargetQPS"] = qps
+    entry["Arrival"] = arrival
+    entry["Senders"] = self.senders
+    entry["ServiceSummary"] = service.summary()
+    entry["DispatchLagSummary"] = lag.summary()
+    printQueryLoadStep('%8g QPS target' % qps, entry)
+    print '    service time p50 %.4f p99 %.4f s, dispatch lag p50 %.4f p99 %.4f s' % (
+        entry["ServiceSummary"]["p50"], entry["ServiceSummary"]["p99"],
+        entry["DispatchLagSummary"]["p50"], entry["DispatchLagSummary"]["p99"])
+    if entry["QPS"] < 0.95 * qps:
+      print '    target rate not sustained (%.1f of %g QPS)' % (entry["QPS"], qps)
+    if self.logger:
+      self.logger.addQuerySpeedEntry(entry)
+    return entry
+
+  def run(self, rates, duration=DEFAULT_DURATION, arrival="poisson", slo_p99=None):
+    '''Function to run a step at every target QPS in turn. If slo_p99 (in
+       seconds) is given, prints the highest rate whose overall p99 stayed
+       within it. Returns the list of step entries.'''
+    entries = [self.runStep(qps, duration, arrival) for qps in rates]
+    if slo_p99 is not None:
+      printSLOResult(entries, "TargetQPS", "QPS", slo_p99)
+    return entries
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython QueryLoad.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --clients [comma separated client counts]'
+  print '\tpython QueryLoad.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --qps [comma separated target rates]'
+  print 'Optional Args:'
+  print '\t--mix [comma separated query:weight pairs, default ' + DEFAULT_QUERY_MIX + ']'
+  print '\t--seconds [duration of every step]'
+  print '\t--processes (run clients as processes instead of threads)'
+  print '\t--arrival [constant or poisson, open loop (--qps) only]'
+  print '\t--senders [# of sending threads, open loop (--qps) only]'
+  print '\t--slo [p99 latency SLO in seconds]'
+  print '\t--seed [random seed of the query choices]'
+  print '\t--nolog (print the results only)'
+  print
+
+def main():
+  '''Function to run the query load generator from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'clients=', 'mix=', 'seconds=', 'processes', 'slo=', 'seed=', 'nolog',
+                                                  'qps=', 'arrival=', 'senders='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  client_counts = [1, 2, 4, 8, 16]
+  rates = []
+  arrival = "poisson"
+  senders = DEFAULT_SENDERS
+  mix = DEFAULT_QUERY_MIX
+  duration = DEFAULT_DURATION
+  processes = False
+  slo = None
+  seed = 0
+  log = True
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--clients':
+      client_counts = [int(count) for count in arg.split(',')]
+    elif option == '--mix':
+      mix = arg
+    elif option == '--seconds':
+      duration = float(arg)
+    elif option == '--processes':
+      processes = True
+    elif option == '--slo':
+      slo = float(arg)
+    elif option == '--seed':
+      seed = int(arg)
+    elif option == '--nolog':
+      log = False
+    elif option == '--qps':
+      rates = [float(qps) for qps in arg.split(',')]
+    elif option == '--arrival':
+      arrival = arg
+    elif option == '--senders':
+      senders = int(arg)
+  logger = None
+  if log:
+    logger = MongoLogger.mongoCRUD(host, port)
+    logger.initBenchmarkDB('benchmarks')
+  if rates:
+    driver = OpenLoopQueryDriver(host, port, db, coll, QueryMix.fromString(mix), senders, logger, seed)
+    driver.run(rates, duration, arrival, slo)
+  else:
+    generator = QueryLoadGenerator(host, port, db, coll, QueryMix.fromString(mix), processes, logger, seed)
+    generator.run(client_counts, duration, slo)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
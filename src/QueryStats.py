@@ -10,22 +10,34 @@ operations to be run against the database.
 
 __author__ = ('jasonrdsouza (Jason Dsouza)')
 
-from pymongo import Connection
+import MongoConnections
 from bson.code import Code
+from bson import BSON
 import time
 import datetime
 import sys
 import getopt
 #import ast
 import json
+import DocumentSchema
+import TickBuckets
+import LatencyHistogram
+
+
+def _cursorBuffer(cursor):
+  '''Returns the deque of documents a pymongo cursor has received but not
+     yet returned, or None if the driver does not expose it'''
+  return getattr(cursor, '_Cursor__data', None)
 
 
 class MongoQuerier:
   '''Simple class to query against the connected MongoDB.
      Requires an active mongod instance to work.
-     Defaults to connecting to a local MongoDB instance.'''
-  def __init__(self, host, port, db_name, collection_name):
-    self.connection = Connection(host, port)
+     Defaults to connecting to a local MongoDB instance. Any connection
+     options given override the process-wide ones for this querier's
+     connection (see MongoConnections.getConnection).'''
+  def __init__(self, host, port, db_name, collection_name, **connection_options):
+    self.connection = MongoConnections.getConnection(host, port, **connection_options)
     self.database = self.connection[db_name]
     self.collection = self.database[collection_name]
     # Set profiling level to log slow events
@@ -36,13 +48,18 @@ class MongoQuerier:
     self.database = self.connection[new_db_name]
     self.collection = self.database[new_collection_name]
     
-  def queryCollection(self, query = None):
+  def queryCollection(self, query = None, sort = None):
     '''Function to allow for querying the currently active collection.
        If no query is supplied, all the documents in the active collection
        are returned. Otherwise, documents matching the query are returned.
+       If sort (a list of (key, direction) pairs) is supplied, the results
+       come back in that order.
        The return type is a list of result documents'''
     resultsList = []
-    for doc in self.collection.find(query):
+    cursor = self.collection.find(query)
+    if sort:
+      cursor = cursor.sort(sort)
+    for doc in cursor:
       resultsList.append(doc)
     return resultsList
   
@@ -52,6 +69,85 @@ class MongoQuerier:
     self.queryCollection(query)
     return (time.time() - x)
   
+  def streamQuery(self, query = None, fields = None, batch_size = 0, limit = 0, count_bytes = True):
+    '''Function to time a query by iterating its cursor without keeping the
+       documents, so the timing is not inflated by building a result list,
+       and large result sets do not have to fit in memory. fields is an
+       optional projection, batch_size the documents per batch asked of the
+       server (0 for the server default) and limit the most documents
+       returned (0 for all).
+       The cursor's calls to the server are timed apart from the rest, so
+       FetchSeconds is the server and transfer time (including decoding of
+       each received batch) and ClientSeconds the time spent iterating.
+       Round trips and fetch time need the driver's cursor buffer, and are
+       None if it is not exposed. If count_bytes is set, every document is
+       re-encoded to count the BSON bytes received; that time is left out
+       of the timings.
+       Returns a dictionary of the timing fields.'''
+    clock = LatencyHistogram.monotonicTime
+    cursor = self.collection.find(query, fields)
+    if batch_size:
+      cursor = cursor.batch_size(batch_size)
+    if limit:
+      cursor = cursor.limit(limit)
+    docs = 0
+    received = 0
+    round_trips = 0
+    fetch_seconds = 0.0
+    counting_seconds = 0.0
+    first_batch = None
+    start = clock()
+    while True:
+      buffered = _cursorBuffer(cursor)
+      fetching = buffered is not None and not buffered and cursor.alive
+      before = clock()
+      try:
+        doc = cursor.next()
+      except StopIteration:
+        doc = None
+      after = clock()
+      if fetching:
+        round_trips += 1
+        fetch_seconds += after - before
+      if first_batch is None:
+        first_batch = after - start
+      if doc is None:
+        break
+      docs += 1
+      if count_bytes:
+        received += len(BSON.encode(doc))
+        counting_seconds += clock() - after
+    total = clock() - start - counting_seconds
+    timing = {"Documents" : docs,
+              "Bytes" : None,
+              "RoundTrips" : None,
+              "FirstBatchSeconds" : first_batch,
+              "FetchSeconds" : None,
+              "ClientSeconds" : None,
+              "TotalSeconds" : total,
+              "DocsPerSecond" : docs / max(total, 1e-9),
+              "BytesPerSecond" : None}
+    if count_bytes:
+      timing["Bytes"] = received
+      timing["BytesPerSecond"] = received / max(total, 1e-9)
+    if _cursorBuffer(cursor) is not None:
+      timing["RoundTrips"] = round_trips
+      timing["FetchSeconds"] = fetch_seconds
+      timing["ClientSeconds"] = total - fetch_seconds
+    return timing
+  
+  def getQueryStreamLogEntry(self, query = None, fields = None, batch_size = 0, limit = 0, count_bytes = True):
+    '''Performs the same task as the streamQuery function, and returns its
+       timings as a "Query Stream Timing" log entry'''
+    entry = self.streamQuery(query, fields, batch_size, limit, count_bytes)
+    entry["EntryType"] = "Query Stream Timing"
+    entry["Timestamp"] = datetime.datetime.now()
+    entry["Query"] = str(query)
+    entry["Fields"] = fields
+    entry["BatchSize"] = batch_size
+    entry["Limit"] = limit
+    return entry
+  
   def getQueryExplainLogEntry(self, query = None):
     '''Function to get the "explain plan" information for a specific query'''
     queryCursor = self.collection.find(query)
@@ -153,8 +249,10 @@ class MongoQuerier:
 
 
 class QueryBuilder:
-  '''Class to build queries for use with the MongoQuerier class'''
-  def __init__(self):
+  '''Class to build queries for use with the MongoQuerier class. If a
+     schema (a DocumentSchema, or the name of one) is given, the queries and
+     map-reduce functions are rewritten for that document layout.'''
+  def __init__(self, schema=None):
     self.timeStart = datetime.datetime(2011, 1, 3, 9, 52)
     self.timeEnd = datetime.datetime(2011, 1, 3, 9, 55)
     self.largeSetQuery = {"Symbol" : "MSFT"}
@@ -190,10 +288,54 @@ class QueryBuilder:
     self.finalize_averageAsk = Code("function (key, value) {"
                                     "  return value.AskPrice"
                                     "}")
+    self.schema = DocumentSchema.getSchema(schema)
+    self._applySchema()
     
     
     # self.uniqueKeyQuery = {"Ticker" : "GOOG", "High" : {"$gt":747}}
-    
+  
+  def _applySchema(self):
+    '''Rewrites all the queries and map-reduce functions for self.schema'''
+    for name in ["largeSetQuery", "mediumSetQuery", "smallSetQuery", "regexQuery"]:
+      setattr(self, name, self.schema.encodeQuery(getattr(self, name)))
+    self.javascriptQuery = self.schema.encodeJavascript(self.javascriptQuery)
+    for name in ["map_totalvolume", "reduce_totalvolume", "map_averageAsk",
+                 "reduce_averageAsk", "finalize_averageAsk"]:
+      setattr(self, name, Code(self.schema.encodeJavascript(str(getattr(self, name)))))
+
+
+class BucketQueryBuilder(QueryBuilder):
+  '''Class to build the QueryBuilder queries and map-reduces for tick data
+     stored in per symbol, per interval buckets (see TickBuckets.py). The
+     queries select the buckets holding the matching ticks. The time range
+     query selects whole buckets, so it can return up to one bucket's worth
+     of extra ticks at the start of the range if that is not bucket aligned.
+     The reduce and finalize functions are shared with QueryBuilder.'''
+  def __init__(self, bucket_seconds=TickBuckets.DEFAULT_BUCKET_SECONDS):
+    QueryBuilder.__init__(self)
+    self.bucket_seconds = bucket_seconds
+    self.largeSetQuery = {"Symbol" : "MSFT"}
+    self.mediumSetQuery = {"BucketStart" : {"$gte" : TickBuckets.bucketStart(self.timeStart, bucket_seconds),
+                                            "$lt" : self.timeEnd}}
+    self.smallSetQuery = {"Symbol" : "TRI", "Quotes" : {"$elemMatch" : {"BidSize" : 100, "AskPrice" : 37.96}}}
+    self.javascriptQuery = "this.Quotes && this.Quotes.some(function (q) {return q.AskSize > 100000;})"
+    self.regexQuery = {"Symbol" : {"$regex" : "B.S", "$options" : "i"}}
+    self.map_totalvolume = Code("function () {"
+                "if(this.TradeCount > 0)"
+                "  {emit(this.Symbol, this.Volume);}"
+                "}")
+    self.map_averageAsk = Code("function () {"
+                "  var totalPrice = 0;"
+                "  var totalSize = 0;"
+                "  var quotes = this.Quotes || [];"
+                "  for(var i = 0; i < quotes.length; i++) {"
+                "    totalPrice += (quotes[i].AskPrice * quotes[i].AskSize);"
+                "    totalSize += quotes[i].AskSize;"
+                "  }"
+                "  if(totalSize > 0)"
+                "    {emit(this.Symbol, {AskPrice: totalPrice/totalSize, AskSize: totalSize});}"
+                "}")
+
     
     
 
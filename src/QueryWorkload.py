@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+'''
+QueryWorkload.py - Python script to benchmark the same query workload
+against MongoDB and SQL databases, side by side.
+
+The workload is the set of QueryBuilder queries and map-reduces. Each one
+has a Mongo form (taken straight from QueryBuilder) and an equivalent SQL
+statement on the MySQLCRUD Ticks table, built from the same QueryBuilder
+values, so the two always ask the same question:
+
+  smallSet    - Symbol, BidSize and AskPrice equal to given values
+  mediumSet   - HistoricalTimestamp in a time range
+  largeSet    - Symbol equal to a given value
+  regex       - Symbol matching a case insensitive regular expression
+  javascript  - AskSize over a threshold ($where on the Mongo side)
+  totalVolume - total traded volume per symbol (map-reduce / group by)
+  averageAsk  - size weighted average ask price per symbol
+
+The SQL side runs on MySQL, or on a local SQLite file as loaded by
+DataImporter --sink sqlite. Every backend gets the same warmup and timed
+repetitions, and the results are logged to query_speed as "Query Timing"
+entries, tagged with the Backend they ran on.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import re
+import time
+import datetime
+import MongoLogger
+from QueryStats import MongoQuerier, QueryBuilder
+
+
+WORKLOAD_ORDER = ["smallSet", "mediumSet", "largeSet", "regex", "javascript", "totalVolume", "averageAsk"]
+
+
+def sqlWorkload(builder):
+  '''Returns the SQL form of the workload, as a dictionary of name -
+     (statement, parameters) pairs, built from a QueryBuilder's values.
+     Statements use %s placeholders (MySQLdb's paramstyle).'''
+  small = builder.smallSetQuery
+  # javascriptQuery is a single "this.Field > value" comparison
+  js_field, js_value = re.match(r'this\.(\w+) > (\d+)$', builder.javascriptQuery).groups()
+  return {"smallSet" : ("select * from Ticks where Symbol = %s and BidSize = %s and AskPrice = %s",
+                        (small["Symbol"], small["BidSize"], small["AskPrice"])),
+          "mediumSet" : ("select * from Ticks where HistoricalTimestamp >= %s and HistoricalTimestamp < %s",
+                         (builder.timeStart, builder.timeEnd)),
+          "largeSet" : ("select * from Ticks where Symbol = %s",
+                        (builder.largeSetQuery["Symbol"],)),
+          "regex" : ("select * from Ticks where lower(Symbol) regexp %s",
+                     (builder.regexQuery["Symbol"]["$regex"].lower(),)),
+          "javascript" : ("select * from Ticks where " + js_field + " > %s", (int(js_value),)),
+          "totalVolume" : ("select Symbol, sum(Volume) from Ticks where TickType = 'Trade' group by Symbol", ()),
+          "averageAsk" : ("select Symbol, sum(AskPrice * AskSize) / sum(AskSize), sum(AskSize) from Ticks "
+                          "where TickType = 'Quote' group by Symbol", ())}
+
+
+class MongoQueryBackend:
+  '''Class to run the workload against a MongoDB collection. Any
+     connection options are passed on to the MongoQuerier.'''
+  def __init__(self, host, port, db_name, coll_name, name='mongo', **connection_options):
+    self.name = name
+    self.querier = MongoQuerier(host, port, db_name, coll_name, **connection_options)
+    builder = QueryBuilder()
+    self.queries = {"smallSet" : builder.smallSetQuery,
+                    "mediumSet" : builder.mediumSetQuery,
+                    "largeSet" : builder.largeSetQuery,
+                    "regex" : builder.regexQuery,
+                    "javascript" : {"$where" : builder.javascriptQuery}}
+    self.mapReduces = {"totalVolume" : (builder.map_totalvolume, builder.reduce_totalvolume),
+                       "averageAsk" : (builder.map_averageAsk, builder.reduce_averageAsk)}
+
+  def runQuery(self, name):
+    '''Function to run one workload entry to completion. Returns the number
+       of result documents.'''
+    if name in self.mapReduces:
+      map_fun, reduce_fun = self.mapReduces[name]
+      return len(self.querier.collectionMapReduce(map_fun, reduce_fun, 'mr_' + name.lower()))
+    return len(self.querier.queryCollection(self.queries[name]))
+
+
+class SQLQueryBackend:
+  '''Class to run the workload against the Ticks table of a DB-API
+     connection. placeholder is the connection's parameter marker ('%s' for
+     MySQLdb, '?' for sqlite3).'''
+  def __init__(self, conn, name, placeholder='%s'):
+    self.conn = conn
+    self.name = name
+    self.statements = {}
+    for query, (statement, params) in sqlWorkload(QueryBuilder()).iteritems():
+      self.statements[query] = (statement.replace('%s', placeholder), params)
+
+  def runQuery(self, name):
+    '''Function to run one workload entry and fetch all its rows. Returns
+       the number of rows.'''
+    statement, params = self.statements[name]
+    cursor = self.conn.cursor()
+    cursor.execute(statement, params)
+    return len(cursor.fetchall())
+
+
+def sqliteRegexp(pattern, value):
+  '''REGEXP function for SQLite, which does not come with one'''
+  return value is not None and re.search(pattern, value) is not None
+
+def openMySQLBackend(host, db_name, user, password):
+  '''Returns a SQLQueryBackend on a MySQL database'''
+  import MySQLdb
+  return SQLQueryBackend(MySQLdb.connect(host=host, user=user, passwd=password, db=db_name), 'mysql')
+
+def openSQLiteBackend(path):
+  '''Returns a SQLQueryBackend on a SQLite file'''
+  import sqlite3
+  conn = sqlite3.connect(path)
+  conn.create_function("regexp", 2, sqliteRegexp)
+  return SQLQueryBackend(conn, 'sqlite', '?')
+
+
+class QueryWorkloadRunner:
+  '''Class to time the workload on several backends with the same rules.
+     Every query is first run warmup times untimed on each backend, then
+     repetitions times timed. If a benchmark logger (mongoCRUD with
+     initBenchmarkDB done) is given, results are logged to query_speed.'''
+  def __init__(self, backends, warmup=1, repetitions=5, logger=None):
+    self.backends = backends
+    self.warmup = warmup
+    self.repetitions = repetitions
+    self.logger = logger
+
+  def timeQuery(self, backend, name):
+    '''Function to time one query on one backend. Returns its "Query
+       Timing" log entry.'''
+    for i in range(self.warmup):
+      backend.runQuery(name)
+    times = []
+    results = 0
+    for i in range(self.repetitions):
+      start = time.time()
+      results = backend.runQuery(name)
+      times.append(time.time() - start)
+    ordered = sorted(times)
+    return {"EntryType" : "Query Timing",
+            "Timestamp" : datetime.datetime.now(),
+            "Backend" : backend.name,
+            "Query" : name,
+            "Results" : results,
+            "Warmup" : self.warmup,
+            "Times" : times,
+            "MinSeconds" : ordered[0],
+            "MedianSeconds" : ordered[len(ordered) // 2],
+            "MeanSeconds" : sum(times) / len(times)}
+
+  def run(self, queries=WORKLOAD_ORDER):
+    '''Function to time every query on every backend, print a table of
+       median times, and log the entries. Returns the list of entries.'''
+    entries = []
+    for name in queries:
+      for backend in self.backends:
+        entry = self.timeQuery(backend, name)
+        print '%-12s %-8s %10d results  median %9.4f s  min %9.4f s' % (name, backend.name, entry["Results"],
+                                                                         entry["MedianSeconds"], entry["MinSeconds"])
+        entries.append(entry)
+    if self.logger and entries:
+      self.logger.addQuerySpeedEntry(entries)
+    return entries
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython QueryWorkload.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --sqlite [sqlite file]'
+  print 'Backends (any combination):'
+  print '\t--host/--port/--db/--coll (MongoDB collection)'
+  print '\t--mysqlhost [host] --mysqldb [db name] --user [userid] --pwd [password] (MySQL Ticks table)'
+  print '\t--sqlite [file] (SQLite Ticks table, from DataImporter --sink sqlite)'
+  print 'Optional Args:'
+  print '\t--queries [comma separated, from ' + ','.join(WORKLOAD_ORDER) + ']'
+  print '\t--warmup [untimed runs per query]'
+  print '\t--reps [timed runs per query]'
+  print '\t--loghost [mongodb host of the benchmarks db, defaults to --host]'
+  print '\t--nolog (print the results only)'
+  print
+
+def main():
+  '''Function to run the query workload from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'mysqlhost=', 'mysqldb=', 'user=', 'pwd=', 'sqlite=', 'queries=', 'warmup=', 'reps=', 'loghost=', 'nolog'])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = ''
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  mysql_host = ''
+  mysql_db = 'test'
+  user = 'root'
+  pwd = 'root'
+  sqlite_path = ''
+  queries = WORKLOAD_ORDER
+  warmup = 1
+  repetitions = 5
+  log_host = ''
+  log = True
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--mysqlhost':
+      mysql_host = arg
+    elif option == '--mysqldb':
+      mysql_db = arg
+    elif option == '--user':
+      user = arg
+    elif option == '--pwd':
+      pwd = arg
+    elif option == '--sqlite':
+      sqlite_path = arg
+    elif option == '--queries':
+      queries = arg.split(',')
+    elif option == '--warmup':
+      warmup = int(arg)
+    elif option == '--reps':
+      repetitions = int(arg)
+    elif option == '--loghost':
+      log_host = arg
+    elif option == '--nolog':
+      log = False
+  backends = []
+  if host:
+    backends.append(MongoQueryBackend(host, port, db, coll))
+  if mysql_host:
+    backends.append(openMySQLBackend(mysql_host, mysql_db, user, pwd))
+  if sqlite_path:
+    backends.append(openSQLiteBackend(sqlite_path))
+  if not backends:
+    usage()
+    sys.exit(2)
+  logger = None
+  log_host = log_host or host
+  if log and log_host:
+    logger = MongoLogger.mongoCRUD(log_host, port)
+    logger.initBenchmarkDB('benchmarks')
+  QueryWorkloadRunner(backends, warmup, repetitions, logger).run(queries)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+'''
+ReplayCache.py - Python script to convert folders of tick files into a
+compact binary cache, and to replay that cache into the database.
+
+Parsing the csv (and gzip) tick files costs more client CPU than inserting
+them, so every insert benchmark that starts from the raw files measures the
+parser as much as the server. The cache is built once, as a flat file of
+fixed-width records (one per tick) plus a JSON table of the interned symbol
+and region strings. Replaying memory-maps the records and turns slices of
+them straight into documents for mongoCRUD.insertData.
+
+Requires numpy.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import os
+import gzip
+import json
+import datetime
+import calendar
+import time
+import numpy
+import TickDecoder
+
+
+TICK_DTYPE = numpy.dtype([("TickType", numpy.uint8),
+                          ("Time", numpy.int64),
+                          ("Region", numpy.int16),
+                          ("Symbol", numpy.int32),
+                          ("Price", numpy.float64),
+                          ("Volume", numpy.int64),
+                          ("ExchangeID", numpy.int64),
+                          ("AskPrice", numpy.float64),
+                          ("AskSize", numpy.int64),
+                          ("AskExchangeID", numpy.int64),
+                          ("BidPrice", numpy.float64),
+                          ("BidSize", numpy.int64),
+                          ("BidExchangeID", numpy.int64)])
+TICK_TYPES = ["Trade", "Quote"]
+TICK_FIELDS = {"Trade" : [name for name, kind in TickDecoder.TRADE_FIELDS],
+               "Quote" : [name for name, kind in TickDecoder.QUOTE_FIELDS]}
+RECORDS_FILE = 'ticks.bin'
+TABLE_FILE = 'table.json'
+EPOCH = datetime.datetime(1970, 1, 1)
+DEFAULT_BATCH_DOCS = 10000
+
+
+class ReplayCacheWriter:
+  '''Class to convert tick files into a replay cache directory'''
+  def __init__(self, cachepath):
+    self.cachepath = cachepath
+    self.symbols = {}
+    self.regions = {}
+    self.count = 0
+    self.files = []
+
+  def _intern(self, table, value):
+    '''Returns the id of a string in a dictionary table, adding it if new'''
+    if value not in table:
+      table[value] = len(table)
+    return table[value]
+
+  def _columnsToRecords(self, columns, region_id, base_time):
+    '''Converts a TickDecoder.TickColumns chunk into an array of records'''
+    records = numpy.zeros(len(columns), dtype=TICK_DTYPE)
+    records["TickType"] = TICK_TYPES.index(columns.tick_type)
+    records["Time"] = base_time + columns.seconds
+    records["Region"] = region_id
+    records["Symbol"] = [self._intern(self.symbols, symbol) for symbol in columns.symbols]
+    for name in TICK_FIELDS[columns.tick_type]:
+      records[name] = columns.values[name]
+    return records
+
+  def addFile(self, folderpath, filepath, out):
+    '''Function to decode a single raw or gzipped tick file and append its
+       records to the open records file'''
+    print 'Caching file:', filepath
+    decoder = TickDecoder.ColumnarTickDecoder(filepath)
+    region_id = self._intern(self.regions, decoder.region)
+    base_time = calendar.timegm(decoder.base_date.timetuple())
+    path = os.path.join(folderpath, filepath)
+    if filepath.endswith('.gz'):
+      f = gzip.open(path, 'rb')
+    else:
+      f = open(path, 'r')
+    try:
+      for trades, quotes in decoder.decodeChunks(f):
+        for columns in (trades, quotes):
+          if len(columns):
+            self._columnsToRecords(columns, region_id, base_time).tofile(out)
+            self.count += len(columns)
+    finally:
+      f.close()
+    self.files.append(filepath)
+
+  def buildFromFolder(self, folderpath):
+    '''Function to convert every tick file in a folder into the cache'''
+    if not os.path.isdir(self.cachepath):
+      os.makedirs(self.cachepath)
+    start = time.time()
+    with open(os.path.join(self.cachepath, RECORDS_FILE), 'wb') as out:
+      for f in sorted(os.listdir(folderpath)):
+        self.addFile(folderpath, f, out)
+    table = {"Count" : self.count,
+             "Files" : self.files,
+             "Symbols" : sorted(self.symbols, key=self.symbols.get),
+             "Regions" : sorted(self.regions, key=self.regions.get)}
+    with open(os.path.join(self.cachepath, TABLE_FILE), 'w') as f:
+      json.dump(table, f)
+    print 'Cached %d ticks in %.1f seconds' % (self.count, time.time() - start)
+
+
+class ReplayCache:
+  '''Class to read a replay cache directory. The records are memory-mapped,
+     so opening a cache is immediate whatever its size.'''
+  def __init__(self, cachepath):
+    with open(os.path.join(cachepath, TABLE_FILE), 'r') as f:
+      table = json.load(f)
+    self.symbols = [str(symbol) for symbol in table["Symbols"]]
+    self.regions = [str(region) for region in table["Regions"]]
+    if table["Count"]:
+      self.records = numpy.memmap(os.path.join(cachepath, RECORDS_FILE), dtype=TICK_DTYPE, mode='r',
+                                  shape=(table["Count"],))
+    else:
+      self.records = numpy.zeros(0, dtype=TICK_DTYPE)
+    self._time_cache = {}
+
+  def __len__(self):
+    return len(self.records)
+
+  def _timestamp(self, seconds):
+    '''Returns the datetime for a number of seconds since the epoch, building
+       each distinct one only once'''
+    if seconds not in self._time_cache:
+      self._time_cache[seconds] = EPOCH + datetime.timedelta(seconds=seconds)
+    return self._time_cache[seconds]
+
+  def recordsToEntries(self, records):
+    '''Function to turn an array of records into a list of documents with
+       the same layout as the tick importers produce'''
+    now = datetime.datetime.now()
+    columns = dict((name, records[name].tolist()) for name in TICK_DTYPE.names)
+    entries = []
+    for i in xrange(len(records)):
+      tick_type = TICK_TYPES[columns["TickType"][i]]
+      entry = {"EntryType" : "Historical Tick Data",
+               "TickType" : tick_type,
+               "Timestamp" : now,
+               "HistoricalTimestamp" : self._timestamp(columns["Time"][i]),
+               "Region" : self.regions[columns["Region"][i]],
+               "Symbol" : self.symbols[columns["Symbol"][i]]}
+      for name in TICK_FIELDS[tick_type]:
+        entry[name] = columns[name][i]
+      entries.append(entry)
+    return entries
+
+  def iterBatches(self, batch_docs=DEFAULT_BATCH_DOCS, start=0, stop=None):
+    '''Generator over lists of at most batch_docs documents, covering the
+       records from start to stop'''
+    if stop is None:
+      stop = len(self.records)
+    for offset in xrange(start, stop, batch_docs):
+      yield self.recordsToEntries(self.records[offset:min(offset + batch_docs, stop)])
+
+
+class ReplayImporter:
+  '''Class to insert the contents of a replay cache into the database
+     through a logger with an insertData method, such as mongoCRUD'''
+  def __init__(self, logger, cachepath):
+    self.logger = logger
+    self.cache = ReplayCache(cachepath)
+
+  def replayToDB(self, batch_docs=DEFAULT_BATCH_DOCS):
+    '''Function to insert the whole cache in batches of batch_docs documents.
+       Returns the number of documents inserted.'''
+    print 'Replay of', len(self.cache), 'ticks initiated'
+    count = 0
+    start = time.time()
+    for batch in self.cache.iterBatches(batch_docs):
+      self.logger.insertData(batch)
+      count += len(batch)
+    elapsed = time.time() - start
+    print 'Replayed %d docs in %.1f seconds, %.1f docs/sec' % (count, elapsed, count / max(elapsed, 1e-9))
+    return count
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython ReplayCache.py --build --path [tick folder path] --cache [cache folder path]'
+  print '\tpython ReplayCache.py --replay --cache [cache folder path] --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name]'
+  print 'Optional Args:'
+  print '\t--batchdocs [documents per insert batch]'
+  print
+
+def main():
+  '''Function to build or replay a tick replay cache from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['build', 'replay', 'path=', 'cache=', 'host=', 'port=', 'db=', 'coll=', 'batchdocs='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  build = False
+  replay = False
+  path = ''
+  cache = ''
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  batch_docs = DEFAULT_BATCH_DOCS
+  for option, arg in opts:
+    if option == '--build':
+      build = True
+    elif option == '--replay':
+      replay = True
+    elif option == '--path':
+      path = arg
+    elif option == '--cache':
+      cache = arg
+    elif option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+  if not (build or replay):
+    usage()
+    sys.exit(2)
+  while not cache:
+    cache = raw_input('Please enter the path of the cache folder: ')
+  if build:
+    while not path:
+      path = raw_input('Please enter the path of the folder to cache: ')
+    ReplayCacheWriter(cache).buildFromFolder(path)
+  if replay:
+    import MongoLogger
+    logger = MongoLogger.mongoCRUD(host, port)
+    logger.initDataDB(db, coll)
+    ReplayImporter(logger, cache).replayToDB(batch_docs)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
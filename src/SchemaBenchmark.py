@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+'''
+SchemaBenchmark.py - Python script to compare the document schemas in
+DocumentSchema, and the per symbol bucket layout in TickBuckets, on storage
+size and speed.
+
+The same workload is loaded into one collection per layout. Per tick
+layouts are indexed on Symbol and HistoricalTimestamp (under their stored
+names), bucketed ones on Symbol/BucketStart and BucketStart. For each layout
+the script reports bytes per document and per tick, data and index size,
+insert speed, and the time taken by the QueryBuilder (or BucketQueryBuilder)
+queries for that layout.
+The results are also logged to db_status as "Schema Comparison" entries.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import datetime
+import MongoLogger
+import DatabaseStatus
+import DataImporter
+import DataSinks
+import DocumentSchema
+import TickBuckets
+from QueryStats import MongoQuerier, QueryBuilder, BucketQueryBuilder
+
+
+BENCHMARK_QUERIES = ["smallSetQuery", "mediumSetQuery", "largeSetQuery", "regexQuery"]
+
+
+class SchemaBenchmark:
+  '''Class to load a workload once per layout and measure each one.
+     batch_factory returns a fresh iterable of full schema batches on every
+     call.'''
+  def __init__(self, host, port, db_name, coll_prefix='schema'):
+    self.host = host
+    self.port = port
+    self.db_name = db_name
+    self.coll_prefix = coll_prefix
+    self.logger = MongoLogger.mongoCRUD(host, port)
+
+  def _loadCollection(self, logger, batch_factory):
+    '''Helper function to insert the workload into the data collection
+       through a logger. Returns the number of ticks and the seconds the
+       inserts took, summed from their log entries, so that producing the
+       batches (and encoding or bucketing them in Python) is not counted.'''
+    count = 0
+    seconds = 0.0
+    for batch in batch_factory():
+      seconds += logger.insertData(batch)["SecondsToInsert"]
+      count += len(batch)
+    return count, seconds
+
+  def _measureCollection(self, layout, coll_name, ticks, insert_secs, builder):
+    '''Helper function to read the storage stats of a loaded collection and
+       time the builder's queries on it. Returns a "Schema Comparison" log
+       entry.'''
+    stats = DatabaseStatus.databaseStatus(self.host, self.port, self.db_name).getCollectionStatsLogEntry(coll_name)
+    entry = {"EntryType" : "Schema Comparison",
+             "Timestamp" : datetime.datetime.now(),
+             "Schema" : layout,
+             "Collection" : coll_name,
+             "Ticks" : ticks,
+             "Documents" : stats.get("count"),
+             "BytesPerDocument" : stats.get("avgObjSize"),
+             "BytesPerTick" : (stats.get("size") or 0) / float(max(ticks, 1)),
+             "DataSize" : stats.get("size"),
+             "StorageSize" : stats.get("storageSize"),
+             "TotalIndexSize" : stats.get("totalIndexSize"),
+             "InsertSeconds" : insert_secs,
+             "InsertDocsPerSecond" : ticks / max(insert_secs, 1e-9)}
+    querier = MongoQuerier(self.host, self.port, self.db_name, coll_name)
+    query_times = {}
+    for name in BENCHMARK_QUERIES:
+      query_times[name] = querier.timeQuery(getattr(builder, name))
+    entry["QuerySeconds"] = query_times
+    return entry
+
+  def runSchema(self, schema, batch_factory):
+    '''Function to load and measure a single schema. Returns the result as
+       a "Schema Comparison" log entry.'''
+    schema = DocumentSchema.getSchema(schema)
+    coll_name = self.coll_prefix + '_' + schema.name
+    self.logger.initDataDB(self.db_name, coll_name)
+    self.logger.killDataDB()
+    for field in ["Symbol", "HistoricalTimestamp"]:
+      self.logger.dataColl.ensure_index(schema.fieldName(field))
+    encoded_factory = lambda: ([schema.encode(entry) for entry in batch] for batch in batch_factory())
+    ticks, insert_secs = self._loadCollection(self.logger, encoded_factory)
+    return self._measureCollection(schema.name, coll_name, ticks, insert_secs, QueryBuilder(schema))
+
+  def runBucketed(self, bucket_seconds, batch_factory):
+    '''Function to load and measure the per symbol bucket layout (see
+       TickBuckets.py) with buckets of bucket_seconds. Returns the result as a
+       "Schema Comparison" log entry.'''
+    layout = 'bucket%ds' % bucket_seconds
+    coll_name = self.coll_prefix + '_' + layout
+    self.logger.initDataDB(self.db_name, coll_name)
+    self.logger.killDataDB()
+    logger = TickBuckets.BucketedLogger(self.logger, bucket_seconds)
+    logger.ensureIndexes()
+    ticks, insert_secs = self._loadCollection(logger, batch_factory)
+    return self._measureCollection(layout, coll_name, ticks, insert_secs, BucketQueryBuilder(bucket_seconds))
+
+  def run(self, schemas, batch_factory, buckets=[]):
+    '''Function to measure every schema in a list, and the bucket layout for
+       every bucket size in buckets, print a comparison table, and log the
+       results to db_status. The table starts with the null sink baseline
+       (see DataSinks.py), the insert speed with no database at all.'''
+    baseline = DataSinks.measureNullSinkBaseline(batch_factory)
+    results = [self.runSchema(schema, batch_factory) for schema in schemas]
+    results += [self.runBucketed(bucket_seconds, batch_factory) for bucket_seconds in buckets]
+    print '%-12s %10s %10s %12s %14s %12s %s' % ('Schema', 'Bytes/doc', 'Bytes/tick', 'Index bytes', 'Insert ticks/s', 'Data bytes', 'Query seconds')
+    print '%-12s %10s %10s %12s %14.1f' % ('null sink', '', '', '', baseline["DocsPerSecond"])
+    for entry in results:
+      queries = ' '.join(['%s=%.3f' % (name, entry["QuerySeconds"][name]) for name in BENCHMARK_QUERIES])
+      print '%-12s %10s %10.1f %12s %14.1f %12s %s' % (entry["Schema"], entry["BytesPerDocument"], entry["BytesPerTick"],
+                                                       entry["TotalIndexSize"], entry["InsertDocsPerSecond"],
+                                                       entry["DataSize"], queries)
+    self.logger.addDbStatusEntry(results)
+    return results
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython SchemaBenchmark.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name]'
+  print 'Optional Args:'
+  print '\t--schemas [comma separated, from ' + ','.join(sorted(DocumentSchema.SCHEMAS)) + ']'
+  print '\t--buckets [comma separated bucket sizes in seconds, to also measure the bucketed layout]'
+  print '\t--cache [replay cache folder to use as the workload]'
+  print '\t--symbols, --rate, --days, --seed (synthetic workload, used without --cache)'
+  print '\t--batchdocs [documents per insert batch]'
+  print
+
+def main():
+  '''Function to compare the document schemas from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'schemas=', 'buckets=', 'cache=', 'symbols=', 'rate=', 'days=', 'seed=', 'batchdocs='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  schemas = ["full", "compact", "compactint"]
+  buckets = []
+  cache = ''
+  generator_options = {"seed" : 0}
+  batch_docs = DataImporter.DEFAULT_BATCH_DOCS
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--schemas':
+      schemas = arg.split(',')
+    elif option == '--buckets':
+      buckets = [int(size) for size in arg.split(',')]
+    elif option == '--cache':
+      cache = arg
+    elif option == '--symbols':
+      generator_options["num_symbols"] = int(arg)
+    elif option == '--rate':
+      generator_options["rate"] = float(arg)
+    elif option == '--days':
+      generator_options["days"] = int(arg)
+    elif option == '--seed':
+      generator_options["seed"] = int(arg)
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+  if cache:
+    import ReplayCache
+    replay_cache = ReplayCache.ReplayCache(cache)
+    batch_factory = lambda: replay_cache.iterBatches(batch_docs)
+  else:
+    import TickGenerator
+    batch_factory = lambda: DataImporter.batchEntries(
+        TickGenerator.SyntheticTickGenerator(**generator_options).iterEntries(), batch_docs)
+  SchemaBenchmark(host, port, db).run(schemas, batch_factory, buckets)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
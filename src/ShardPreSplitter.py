@@ -0,0 +1,230 @@
+#!/usr/bin/python
+
+'''
+ShardPreSplitter.py - Python script to prepare a sharded collection for a
+bulk load, and to route insert batches to the shard that owns them.
+
+A fresh sharded collection has a single chunk, so every insert of a bulk
+load goes to one shard while the balancer splits and migrates behind it.
+This module samples the files to be loaded for the distribution of the
+shard key, splits the collection at those quantiles, and spreads the
+resulting chunks over the shards before the load starts. During the load,
+batches can be grouped by destination shard using the chunk ranges in
+config.chunks (the same config db used by DatabaseStatus and
+utils/chunkDistribution.py), so each insert is sent to a single shard.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import os
+import csv
+import gzip
+import bisect
+import pymongo
+import MongoConnections
+from bson.min_key import MinKey
+import DataImporter
+import DocumentSchema
+
+
+DEFAULT_SAMPLE_STRIDE = 100
+DEFAULT_REFRESH_BATCHES = 100
+
+
+class ShardPreSplitter:
+  '''Class to pre-split a sharded collection based on a sample of the data
+     that will be loaded into it, and to route documents to shards using the
+     collection's current chunk ranges.'''
+  def __init__(self, host, port, db_name, coll_name, shard_key='Symbol', refresh_batches=DEFAULT_REFRESH_BATCHES,
+               schema=None):
+    self.connection = MongoConnections.getConnection(host, port)
+    self.admin = self.connection.admin
+    self.configdb = self.connection['config']
+    self.db_name = db_name
+    self.ns = db_name + '.' + coll_name
+    self.shard_key = shard_key
+    self.refresh_batches = refresh_batches
+    self.batches_routed = 0
+    self.ranges = None
+    self.schema = DocumentSchema.getSchema(schema)
+
+  def _sampleLines(self, path, stride):
+    '''Generator over every stride'th trade or quote line of a raw or gzipped
+       tick file'''
+    if path.endswith('.gz'):
+      f = gzip.open(path, 'rb')
+    else:
+      f = open(path, 'r')
+    try:
+      for i, line in enumerate(f):
+        if i % stride == 0 and line[:2] in ('T|', 'Q|'):
+          yield line
+    finally:
+      f.close()
+
+  def sampleShardKeys(self, folderpath, stride=DEFAULT_SAMPLE_STRIDE):
+    '''Function to sample the tick files in a folder for the distribution of
+       the shard key. Every stride'th row is parsed the same way the importer
+       parses it, and encoded in the splitter's schema, so shard_key is the
+       stored field name. Returns a dictionary of shard key value to sample
+       count.'''
+    counts = {}
+    for f in os.listdir(folderpath):
+      lines = self._sampleLines(os.path.join(folderpath, f), stride)
+      for entry in DataImporter.parseTickRows(csv.reader(lines, delimiter='|'), f):
+        value = self.schema.encode(entry)[self.shard_key]
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+  def computeSplitPoints(self, counts, num_chunks):
+    '''Function to pick the shard key values that divide the sampled data
+       into num_chunks chunks of roughly equal size. Returns a sorted list
+       of at most num_chunks - 1 distinct split points.'''
+    total = sum(counts.values())
+    points = []
+    if not total or num_chunks < 2:
+      return points
+    running = 0
+    next_chunk = 1
+    for value in sorted(counts.keys()):
+      if running >= total * next_chunk / float(num_chunks):
+        points.append(value)
+        while next_chunk < num_chunks and running >= total * next_chunk / float(num_chunks):
+          next_chunk += 1
+        if next_chunk >= num_chunks:
+          break
+      running += counts[value]
+    return points
+
+  def ensureSharded(self):
+    '''Function to enable sharding on the collection (and its database) by
+       the shard key, if that has not been done already'''
+    if self.configdb.collections.find_one({"_id" : self.ns, "dropped" : False}):
+      return
+    try:
+      self.admin.command('enablesharding', self.db_name)
+    except pymongo.errors.OperationFailure, msg:
+      print 'enablesharding:', str(msg)
+    self.admin.command('shardcollection', self.ns, key={self.shard_key : 1})
+    print 'Sharded', self.ns, 'on', self.shard_key
+
+  def preSplit(self, split_points):
+    '''Function to split the collection at the given shard key values, and
+       move the resulting chunks round robin across all the shards'''
+    self.ensureSharded()
+    for point in split_points:
+      try:
+        self.admin.command('split', self.ns, middle={self.shard_key : point})
+      except pymongo.errors.OperationFailure, msg:
+        print 'Could not split at', point, str(msg)
+    shards = [shard['_id'] for shard in self.configdb.shards.find()]
+    for i, point in enumerate(split_points):
+      target = shards[(i + 1) % len(shards)]
+      try:
+        self.admin.command('moveChunk', self.ns, find={self.shard_key : point}, to=target)
+      except pymongo.errors.OperationFailure, msg:
+        print 'Did not move chunk at', point, 'to', target, str(msg)
+    print 'Pre-split', self.ns, 'into', len(split_points) + 1, 'chunks over', len(shards), 'shards'
+    self.loadChunkRanges()
+
+  def preSplitFromFolder(self, folderpath, num_chunks, stride=DEFAULT_SAMPLE_STRIDE):
+    '''Function to sample a folder of tick files, and pre-split the
+       collection into num_chunks chunks based on the sample'''
+    counts = self.sampleShardKeys(folderpath, stride)
+    points = self.computeSplitPoints(counts, num_chunks)
+    self.preSplit(points)
+    return points
+
+  def loadChunkRanges(self):
+    '''Function to read the collection's chunk ranges from config.chunks.
+       The ranges are kept as a sorted list of chunk lower bounds, and the
+       shards owning each range.'''
+    chunks = list(self.configdb.chunks.find({"ns" : self.ns}))
+    bounded = []
+    first_shard = None
+    for chunk in chunks:
+      lower = chunk['min'][self.shard_key]
+      if isinstance(lower, MinKey):
+        first_shard = chunk['shard']
+      else:
+        bounded.append((lower, chunk['shard']))
+    bounded.sort()
+    bounds = [lower for lower, shard in bounded]
+    shards = [first_shard] + [shard for lower, shard in bounded]
+    self.ranges = (bounds, shards)
+
+  def shardFor(self, value):
+    '''Returns the shard that owns the chunk containing a shard key value'''
+    bounds, shards = self.ranges
+    return shards[bisect.bisect_right(bounds, value)]
+
+  def routeBatch(self, batch):
+    '''Function to group a batch of documents by destination shard. Returns
+       a list of batches, one per shard. Chunk ranges are reloaded every
+       refresh_batches batches, to follow the balancer's splits and moves.'''
+    if self.ranges is None or self.batches_routed % self.refresh_batches == 0:
+      self.loadChunkRanges()
+    self.batches_routed += 1
+    groups = {}
+    for entry in batch:
+      groups.setdefault(self.shardFor(entry[self.shard_key]), []).append(entry)
+    return groups.values()
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython ShardPreSplitter.py --host [mongos hostname] --port [mongos port #] --db [mongodb name] --coll [collection name] --path [folder path] --chunks [# of chunks]'
+  print 'Optional Args:'
+  print '\t--shardkey [shard key field, defaults to Symbol]'
+  print '\t--stride [sample every n\'th row, defaults to 100]'
+  print
+
+def main():
+  '''Function to pre-split a collection for a folder of tick data from the
+     command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'path=', 'chunks=', 'shardkey=', 'stride='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  path = ''
+  num_chunks = 0
+  shard_key = 'Symbol'
+  stride = DEFAULT_SAMPLE_STRIDE
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--path':
+      path = arg
+    elif option == '--chunks':
+      num_chunks = int(arg)
+    elif option == '--shardkey':
+      shard_key = arg
+    elif option == '--stride':
+      stride = int(arg)
+  while not path:
+    path = raw_input('Please enter the path of the folder to sample: ')
+  while not num_chunks:
+    num_chunks = int(raw_input('Please enter the number of chunks to create: '))
+  splitter = ShardPreSplitter(host, port, db, coll, shard_key)
+  print 'Split points:', splitter.preSplitFromFolder(path, num_chunks, stride)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
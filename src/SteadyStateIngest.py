@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+'''
+SteadyStateIngest.py - Python script to insert tick data at a controlled
+rate, and measure insert latency at that rate.
+
+Flat out imports only show peak throughput. Here every batch is given the
+time it is supposed to start, either from a target docs/sec or from the
+spacing of the ticks' HistoricalTimestamp (sped up by a factor). Batches are
+sent on that open loop schedule whether or not earlier batches have
+finished, and each batch's latency is measured from its scheduled start,
+so time spent waiting behind a slow insert is counted rather than hidden.
+Every batch is logged to insertion_speed with its ScheduledStart and
+SecondsSinceScheduled.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import time
+import threading
+import itertools
+import MongoLogger
+import DataImporter
+
+
+DEFAULT_BATCH_INTERVAL = 0.1
+
+
+def percentile(sorted_values, fraction):
+  '''Returns the value at the given fraction (0 to 1) of a sorted list'''
+  if not sorted_values:
+    return 0.0
+  index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+  return sorted_values[index]
+
+def scheduleByRate(entries, rate, batch_docs, batch_interval=DEFAULT_BATCH_INTERVAL):
+  '''Generator that schedules a stream of documents at a constant rate in
+     docs/sec. Yields (offset, batch) pairs, where offset is the number of
+     seconds after the start of the run that the batch is due. A batch holds
+     at most batch_docs documents, and at most batch_interval seconds' worth.'''
+  per_batch = max(1, min(batch_docs, int(rate * batch_interval)))
+  sent = 0
+  for batch in DataImporter.batchEntries(entries, per_batch):
+    sent += len(batch)
+    yield (sent / float(rate), batch)
+
+def scheduleBySpacing(entries, speedup, batch_docs, batch_interval=DEFAULT_BATCH_INTERVAL):
+  '''Generator that schedules a stream of documents by the spacing of their
+     HistoricalTimestamp, compressed by the speedup factor (1 replays in real
+     time). Yields (offset, batch) pairs like scheduleByRate. Timestamps that
+     go backwards are treated as arriving with the previous document.'''
+  first = None
+  latest = 0.0
+  batch = []
+  batch_start = 0.0
+  for entry in entries:
+    if first is None:
+      first = entry["HistoricalTimestamp"]
+    delta = entry["HistoricalTimestamp"] - first
+    offset = max(latest, (delta.days * 86400 + delta.seconds + delta.microseconds / 1e6) / speedup)
+    if batch and (offset - batch_start >= batch_interval or len(batch) >= batch_docs):
+      yield (latest, batch)
+      batch = []
+    if not batch:
+      batch_start = offset
+    batch.append(entry)
+    latest = offset
+  if batch:
+    yield (latest, batch)
+
+
+class SteadyStateIngest:
+  '''Class to run a scheduled ingest into the data collection. senders is
+     the number of threads sending batches; it only has to be large enough
+     that a batch never waits for a free sender while the server keeps up.'''
+  def __init__(self, host, port, db_name, coll_name, senders=4):
+    self.logger = MongoLogger.mongoCRUD(host, port)
+    self.logger.initDataDB(db_name, coll_name)
+    self.senders = senders
+
+  def _send(self, schedule, lock, start, latencies):
+    '''Sender thread. Takes the next scheduled batch, waits for its start
+       time, inserts it and records its latency from the scheduled start.'''
+    while True:
+      with lock:
+        try:
+          offset, batch = next(schedule)
+        except StopIteration:
+          return
+      scheduled = start + offset
+      delay = scheduled - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      entry = self.logger.insertData(batch, scheduled)
+      latencies.append(entry["SecondsSinceScheduled"])
+
+  def run(self, schedule, series):
+    '''Function to send a schedule of (offset, batch) pairs, as produced by
+       scheduleByRate or scheduleBySpacing, tagging the insertion speed log
+       entries (and the insert latency histogram summary) with the series
+       name. Prints and returns a summary of the latency from the scheduled
+       start.'''
+    lock = threading.Lock()
+    latencies = []
+    self.logger.setInsertMode(tags={"Series" : series})
+    self.logger.resetLatency()
+    start = time.time()
+    schedule = iter(schedule)
+    threads = [threading.Thread(target=self._send, args=(schedule, lock, start, latencies))
+               for i in range(self.senders)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.logger.logLatencySummary()
+    self.logger.setInsertMode()
+    elapsed = time.time() - start
+    latencies.sort()
+    summary = {"Series" : series,
+               "Batches" : len(latencies),
+               "Seconds" : elapsed,
+               "p50" : percentile(latencies, 0.5),
+               "p90" : percentile(latencies, 0.9),
+               "p99" : percentile(latencies, 0.99),
+               "Max" : latencies[-1] if latencies else 0.0}
+    print '%s: %d batches in %.1f s, latency p50 %.4f p90 %.4f p99 %.4f max %.4f s' % (
+        series, summary["Batches"], elapsed, summary["p50"], summary["p90"], summary["p99"], summary["Max"])
+    return summary
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython SteadyStateIngest.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --rate [docs/sec]'
+  print '\tpython SteadyStateIngest.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name] --speedup [x real time]'
+  print 'Optional Args:'
+  print '\t--cache [replay cache folder to use as the data]'
+  print '\t--symbols, --tickrate, --days, --seed (synthetic data, used without --cache)'
+  print '\t--batchdocs [max documents per insert batch]'
+  print '\t--senders [# of sending threads]'
+  print
+
+def main():
+  '''Function to run a rate limited ingest from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'rate=', 'speedup=', 'cache=', 'symbols=', 'tickrate=', 'days=', 'seed=', 'batchdocs=', 'senders='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  rate = 0
+  speedup = 0
+  cache = ''
+  generator_options = {"seed" : 0}
+  batch_docs = DataImporter.DEFAULT_BATCH_DOCS
+  senders = 4
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--rate':
+      rate = float(arg)
+    elif option == '--speedup':
+      speedup = float(arg)
+    elif option == '--cache':
+      cache = arg
+    elif option == '--symbols':
+      generator_options["num_symbols"] = int(arg)
+    elif option == '--tickrate':
+      generator_options["rate"] = float(arg)
+    elif option == '--days':
+      generator_options["days"] = int(arg)
+    elif option == '--seed':
+      generator_options["seed"] = int(arg)
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+    elif option == '--senders':
+      senders = int(arg)
+  if not (rate or speedup):
+    usage()
+    sys.exit(2)
+  if cache:
+    import ReplayCache
+    entries = itertools.chain.from_iterable(ReplayCache.ReplayCache(cache).iterBatches(batch_docs))
+  else:
+    import TickGenerator
+    entries = TickGenerator.SyntheticTickGenerator(**generator_options).iterEntries()
+  ingest = SteadyStateIngest(host, port, db, coll, senders)
+  if rate:
+    ingest.run(scheduleByRate(entries, rate, batch_docs), 'steady/%gdps' % rate)
+  else:
+    ingest.run(scheduleBySpacing(entries, speedup, batch_docs), 'steady/%gx' % speedup)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+'''
+TickBuckets.py - Python script to store tick data bucketed by symbol and
+time interval, instead of one document per tick.
+
+Every bucket document holds all the ticks of one Symbol in one interval
+(a minute by default), as arrays of trades and quotes, along with counts
+and the total traded volume:
+
+  {"Symbol" : "MSFT", "Region" : "NYS",
+   "BucketStart" : datetime(2011, 1, 3, 9, 52), "BucketSeconds" : 60,
+   "Trades" : [{"HistoricalTimestamp" : ..., "Price" : ..., ...}, ...],
+   "Quotes" : [{"HistoricalTimestamp" : ..., "AskPrice" : ..., ...}, ...],
+   "TradeCount" : 12, "QuoteCount" : 40, "Volume" : 5300}
+
+Ticks are upserted into their bucket as they arrive, so a bucket can be
+filled by several batches, files or importers. See BucketQueryBuilder in
+QueryStats.py for the queries and map-reduces matching this layout.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import datetime
+
+
+DEFAULT_BUCKET_SECONDS = 60
+TRADE_KEYS = ["HistoricalTimestamp", "Price", "Volume", "ExchangeID"]
+QUOTE_KEYS = ["HistoricalTimestamp", "AskPrice", "AskSize", "AskExchangeID",
+              "BidPrice", "BidSize", "BidExchangeID"]
+
+
+def bucketStart(timestamp, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+  '''Returns the start of the bucket a timestamp falls in. Buckets are
+     aligned to midnight, so bucket_seconds should divide a day evenly.'''
+  seconds = timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+  midnight = datetime.datetime.combine(timestamp.date(), datetime.time())
+  return midnight + datetime.timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+class TickBucketer:
+  '''Class to turn batches of tick documents (in the full layout produced by
+     the importers) into bucket upserts.'''
+  def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    self.bucket_seconds = bucket_seconds
+
+  def bucketUpdates(self, batch):
+    '''Function to group a batch of tick documents by bucket. Returns a list
+       of (selector, update) pairs, one per bucket touched by the batch, to
+       be applied as upserts. Ticks keep their order within a bucket.'''
+    buckets = {}
+    order = []
+    for entry in batch:
+      start = bucketStart(entry["HistoricalTimestamp"], self.bucket_seconds)
+      key = (entry["Symbol"], start)
+      bucket = buckets.get(key)
+      if bucket is None:
+        bucket = {"Region" : entry["Region"], "Trades" : [], "Quotes" : [], "Volume" : 0}
+        buckets[key] = bucket
+        order.append(key)
+      if entry["TickType"] == "Trade":
+        bucket["Trades"].append(dict((k, entry[k]) for k in TRADE_KEYS))
+        bucket["Volume"] += entry["Volume"]
+      else:
+        bucket["Quotes"].append(dict((k, entry[k]) for k in QUOTE_KEYS))
+    updates = []
+    for symbol, start in order:
+      bucket = buckets[(symbol, start)]
+      selector = {"Symbol" : symbol, "BucketStart" : start}
+      update = {"$set" : {"Region" : bucket["Region"], "BucketSeconds" : self.bucket_seconds},
+                "$inc" : {"TradeCount" : len(bucket["Trades"]),
+                          "QuoteCount" : len(bucket["Quotes"]),
+                          "Volume" : bucket["Volume"]},
+                "$push" : {}}
+      if bucket["Trades"]:
+        update["$push"]["Trades"] = {"$each" : bucket["Trades"]}
+      if bucket["Quotes"]:
+        update["$push"]["Quotes"] = {"$each" : bucket["Quotes"]}
+      updates.append((selector, update))
+    return updates
+
+
+class BucketedLogger:
+  '''Wrapper around a mongoCRUD logger whose insertData stores tick batches
+     as bucket upserts instead of inserting one document per tick. Anything
+     else (log entries, deferred logging, etc) is passed to the wrapped
+     logger, so it can stand in for it in the importers.'''
+  def __init__(self, logger, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    self.logger = logger
+    self.bucketer = TickBucketer(bucket_seconds)
+
+  def __getattr__(self, name):
+    return getattr(self.logger, name)
+
+  def ensureIndexes(self):
+    '''Creates the unique Symbol/BucketStart index the upserts look buckets
+       up by (which also serves symbol queries), and a BucketStart index for
+       time range queries. The index is unique so that concurrent importers
+       upserting the same new bucket cannot each create a copy of it; see
+       mongoCRUD.upsertData.'''
+    self.logger.dataColl.ensure_index([("Symbol", 1), ("BucketStart", 1)], unique=True)
+    self.logger.dataColl.ensure_index("BucketStart")
+
+  def insertData(self, entry, scheduledStart=None):
+    '''Upserts a batch of tick documents into their buckets. Logs and
+       returns an insertion speed entry like mongoCRUD.insertData.'''
+    if isinstance(entry, dict):
+      entry = [entry]
+    return self.logger.upsertData(self.bucketer.bucketUpdates(entry), len(entry), scheduledStart)
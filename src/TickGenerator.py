@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+'''
+TickGenerator.py - Python script to generate synthetic tick data with the
+same Trade/Quote layout as the licensed raw tick files.
+
+The generated data can be written out as pipe delimited files that the
+DataImporter parsers read like the real ones (named REG_YYYYMMDD.txt), or
+streamed straight into the database as documents. Scale is set by the
+number of symbols, the tick rate and the number of days, and the activity
+of the symbols follows a Zipf distribution with a configurable skew.
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import sys
+import getopt
+import os
+import datetime
+import random
+import bisect
+import time
+import DataImporter
+
+
+class SyntheticTickGenerator:
+  '''Class to generate a reproducible stream of synthetic ticks.
+     rate is the average number of ticks per second of market time, spread
+     over the symbols with Zipf weights 1/rank**skew (skew 0 is uniform).
+     trade_ratio is the share of ticks that are trades rather than quotes.'''
+  def __init__(self, num_symbols=500, skew=1.0, rate=1000.0, days=1,
+               start_date=datetime.date(2011, 1, 3), region='NYS',
+               trade_ratio=0.2, day_start=datetime.time(9, 30),
+               day_seconds=6.5 * 3600, seed=None):
+    self.random = random.Random(seed)
+    self.num_symbols = num_symbols
+    self.rate = float(rate)
+    self.days = days
+    self.start_date = start_date
+    self.region = region
+    self.trade_ratio = trade_ratio
+    self.day_start = day_start
+    self.day_seconds = day_seconds
+    self.symbols = [self._symbolName(i) for i in range(num_symbols)]
+    total = 0.0
+    self.cumulative_weights = []
+    for rank in range(1, num_symbols + 1):
+      total += 1.0 / rank ** skew
+      self.cumulative_weights.append(total)
+    self.prices = [round(self.random.uniform(10, 200), 2) for i in range(num_symbols)]
+
+  def _symbolName(self, index):
+    '''Returns a ticker-like name (A, B, ..., Z, BA, BB, ...) for a symbol index'''
+    name = ''
+    while True:
+      name = chr(ord('A') + index % 26) + name
+      index //= 26
+      if not index:
+        return name
+
+  def _pickSymbol(self):
+    '''Returns the index of a symbol, chosen with the Zipf weights'''
+    point = self.random.random() * self.cumulative_weights[-1]
+    return bisect.bisect_left(self.cumulative_weights, point)
+
+  def _nextPrice(self, index):
+    '''Moves a symbol's price by a small random step and returns it'''
+    price = max(0.01, round(self.prices[index] * (1 + self.random.gauss(0, 0.0005)), 2))
+    self.prices[index] = price
+    return price
+
+  def tradingDays(self):
+    '''Returns the list of dates that are generated'''
+    return [self.start_date + datetime.timedelta(days=i) for i in range(self.days)]
+
+  def iterDayTicks(self, day):
+    '''Generator over the ticks of one day, in time order, as tuples of
+       (datetime, symbol index, is_trade, price)'''
+    current = datetime.datetime.combine(day, self.day_start)
+    elapsed = self.random.expovariate(self.rate)
+    while elapsed < self.day_seconds:
+      index = self._pickSymbol()
+      yield (current + datetime.timedelta(seconds=elapsed), index,
+             self.random.random() < self.trade_ratio, self._nextPrice(index))
+      elapsed += self.random.expovariate(self.rate)
+
+  def iterDayRows(self, day):
+    '''Generator over the rows of one day's tick file, as lists of fields in
+       the raw tick file format, including the start and end records'''
+    yield ['s', '', 'Synthetic ' + day.strftime('%Y%m%d')]
+    for timestamp, index, is_trade, price in self.iterDayTicks(day):
+      time_str = timestamp.strftime('%H:%M:%S.') + '%03d' % (timestamp.microsecond // 1000)
+      if is_trade:
+        yield ['T', time_str, self.symbols[index], '%.2f' % price,
+               str(self.random.randint(1, 50) * 100), str(self.random.randint(1, 20))]
+      else:
+        spread = round(self.random.choice([0.01, 0.01, 0.02, 0.05]), 2)
+        yield ['Q', time_str, self.symbols[index], '%.2f' % (price + spread),
+               str(self.random.randint(1, 50) * 100), str(self.random.randint(1, 20)),
+               '%.2f' % price, str(self.random.randint(1, 50) * 100), str(self.random.randint(1, 20))]
+    yield ['e', '', 'Synthetic ' + day.strftime('%Y%m%d')]
+
+  def iterEntries(self):
+    '''Generator over documents for all the days, with the same layout as
+       DataImporter.parseTickRows produces from the tick files'''
+    for day in self.tradingDays():
+      filepath = self.region + '_' + day.strftime('%Y%m%d') + '.txt'
+      for entry in DataImporter.parseTickRows(self.iterDayRows(day), filepath):
+        yield entry
+
+  def writeFiles(self, folderpath):
+    '''Function to write one pipe delimited tick file per day into a folder,
+       readable by DataImporter's tick folder importers'''
+    if not os.path.isdir(folderpath):
+      os.makedirs(folderpath)
+    for day in self.tradingDays():
+      filepath = self.region + '_' + day.strftime('%Y%m%d') + '.txt'
+      print 'Writing file:', filepath
+      with open(os.path.join(folderpath, filepath), 'w') as f:
+        for row in self.iterDayRows(day):
+          f.write('|'.join(row) + '\n')
+      assert f.closed
+
+  def insertToDB(self, logger, batch_docs=DataImporter.DEFAULT_BATCH_DOCS, batch_bytes=None):
+    '''Function to stream the generated documents into the database through
+       a logger with an insertData method, such as mongoCRUD. Returns the
+       number of documents inserted.'''
+    count = 0
+    start = time.time()
+    for batch in DataImporter.batchEntries(self.iterEntries(), batch_docs, batch_bytes):
+      logger.insertData(batch)
+      count += len(batch)
+    elapsed = time.time() - start
+    print 'Generated and inserted %d docs in %.1f seconds, %.1f docs/sec' % (count, elapsed, count / max(elapsed, 1e-9))
+    return count
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython TickGenerator.py --out [folder to write tick files to]'
+  print '\tpython TickGenerator.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name]'
+  print 'Optional Args:'
+  print '\t--symbols [# of symbols]'
+  print '\t--skew [Zipf skew across symbols, 0 for uniform]'
+  print '\t--rate [average ticks per second]'
+  print '\t--days [# of days to generate]'
+  print '\t--start [first day, YYYYMMDD]'
+  print '\t--seed [random seed, for reproducible data]'
+  print '\t--batchdocs [documents per insert batch]'
+  print
+
+def main():
+  '''Function to generate synthetic tick data from the command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['out=', 'host=', 'port=', 'db=', 'coll=', 'symbols=', 'skew=', 'rate=', 'days=', 'start=', 'seed=', 'batchdocs='])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  out = ''
+  host = ''
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  options = {}
+  batch_docs = DataImporter.DEFAULT_BATCH_DOCS
+  for option, arg in opts:
+    if option == '--out':
+      out = arg
+    elif option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--symbols':
+      options["num_symbols"] = int(arg)
+    elif option == '--skew':
+      options["skew"] = float(arg)
+    elif option == '--rate':
+      options["rate"] = float(arg)
+    elif option == '--days':
+      options["days"] = int(arg)
+    elif option == '--start':
+      options["start_date"] = datetime.datetime.strptime(arg, '%Y%m%d').date()
+    elif option == '--seed':
+      options["seed"] = int(arg)
+    elif option == '--batchdocs':
+      batch_docs = int(arg)
+  if not (out or host):
+    usage()
+    sys.exit(2)
+  generator = SyntheticTickGenerator(**options)
+  if out:
+    generator.writeFiles(out)
+  else:
+    import MongoLogger
+    logger = MongoLogger.mongoCRUD(host, port)
+    logger.initDataDB(db, coll)
+    generator.insertToDB(logger, batch_docs)
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
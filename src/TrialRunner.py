@@ -0,0 +1,379 @@
+#!/usr/bin/python
+
+'''
+TrialRunner.py - Python script to run a benchmark many times and report
+its timing with confidence intervals, rather than trusting one sample.
+
+TrialRunner wraps any benchmark callable (a query, a map-reduce, an
+insert): it runs it a number of untimed warmup times, then times it for a
+number of repetitions or until a time budget runs out, and reports the
+mean, median, standard deviation and the 95% confidence interval of the
+mean (from Student's t distribution). compareTrials tells whether the
+difference between two such runs is larger than their noise, so a 5%
+change can be trusted, or shown to be noise, before acting on it.
+
+In cold mode an evictor runs before every timed trial, so each one starts
+with cold caches:
+
+  ScratchCollectionEvictor - reads through a large scratch collection, to
+                             push the benchmarked data out of memory
+  MongodRestartEvictor     - restarts local mongods, such as the shards
+                             started by utils/MongoShardingSetup.py, and
+                             optionally drops the OS page cache (MongoDB's
+                             memory mapped files live there, so a restart
+                             alone does not clear them)
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import os
+import sys
+import getopt
+import math
+import time
+import socket
+import datetime
+import subprocess
+import MongoLogger
+import MongoConnections
+import LatencyHistogram
+from QueryStats import MongoQuerier, QueryBuilder
+
+
+DEFAULT_WARMUP = 2
+DEFAULT_REPETITIONS = 10
+MIN_REPETITIONS = 3
+# Two sided 95% critical values of Student's t distribution, by degrees of
+# freedom. Degrees of freedom between entries use the next lower entry,
+# which errs on the side of a wider interval.
+T_CRITICAL_95 = [(1, 12.706), (2, 4.303), (3, 3.182), (4, 2.776), (5, 2.571), (6, 2.447), (7, 2.365),
+                 (8, 2.306), (9, 2.262), (10, 2.228), (11, 2.201), (12, 2.179), (13, 2.160), (14, 2.145),
+                 (15, 2.131), (16, 2.120), (17, 2.110), (18, 2.101), (19, 2.093), (20, 2.086), (21, 2.080),
+                 (22, 2.074), (23, 2.069), (24, 2.064), (25, 2.060), (26, 2.056), (27, 2.052), (28, 2.048),
+                 (29, 2.045), (30, 2.042), (40, 2.021), (60, 2.000), (120, 1.980)]
+T_CRITICAL_95_LIMIT = 1.960
+# MongoShardingSetup's defaults: shard i listens on 30000 + i, with its data
+# in BASE_DATA_PATH/shard_i
+SHARDING_SETUP_DATA_PATH = '/data/db/sharding/'
+SHARDING_SETUP_SHARD_PORT = 30000
+
+
+def tCritical95(df):
+  '''Returns the two sided 95% critical value of Student's t distribution
+     with df degrees of freedom'''
+  critical = T_CRITICAL_95[0][1]
+  for entry_df, value in T_CRITICAL_95:
+    if entry_df > df:
+      return critical
+    critical = value
+  return T_CRITICAL_95_LIMIT
+
+def sampleStats(samples):
+  '''Returns the count, mean, median, sample standard deviation, min, max
+     and 95% confidence interval of the mean of a list of samples'''
+  n = len(samples)
+  ordered = sorted(samples)
+  mean = sum(samples) / float(n)
+  if n % 2:
+    median = ordered[n // 2]
+  else:
+    median = (ordered[n // 2 - 1] + ordered[n // 2]) / 2.0
+  stddev = 0.0
+  half_width = 0.0
+  if n > 1:
+    stddev = math.sqrt(sum([(sample - mean) ** 2 for sample in samples]) / (n - 1))
+    half_width = tCritical95(n - 1) * stddev / math.sqrt(n)
+  return {"Count" : n,
+          "Mean" : mean,
+          "Median" : median,
+          "StdDev" : stddev,
+          "Min" : ordered[0],
+          "Max" : ordered[-1],
+          "CI95Low" : mean - half_width,
+          "CI95High" : mean + half_width,
+          "RelativeCI95" : half_width / mean if mean else 0.0}
+
+def compareTrials(baseline, candidate):
+  '''Compares two trial summaries (as returned by TrialRunner.run) with
+     Welch's t-test. Returns the relative change of the mean, the 95%
+     confidence interval of that change, and whether it is significant
+     (the interval does not include zero).'''
+  a = baseline["Samples"]
+  b = candidate["Samples"]
+  mean_a = sum(a) / float(len(a))
+  mean_b = sum(b) / float(len(b))
+  var_a = baseline["StdDev"] ** 2 / len(a)
+  var_b = candidate["StdDev"] ** 2 / len(b)
+  se = math.sqrt(var_a + var_b)
+  if len(a) > 1 and len(b) > 1 and se > 0:
+    df = (var_a + var_b) ** 2 / (var_a ** 2 / (len(a) - 1) + var_b ** 2 / (len(b) - 1))
+    half_width = tCritical95(int(df)) * se
+  else:
+    half_width = 0.0
+  difference = mean_b - mean_a
+  scale = mean_a or 1.0
+  return {"Baseline" : baseline["Name"],
+          "Candidate" : candidate["Name"],
+          "Change" : difference / scale,
+          "ChangeCI95Low" : (difference - half_width) / scale,
+          "ChangeCI95High" : (difference + half_width) / scale,
+          "Significant" : abs(difference) > half_width}
+
+
+class ScratchCollectionEvictor:
+  '''Class to evict the benchmarked data from mongod's memory by reading
+     through a scratch collection of the given size, which is created on
+     the first eviction. Make it larger than the server's RAM. Through a
+     mongos, the unsharded scratch collection only lives on its database's
+     primary shard.'''
+  def __init__(self, host, port, megabytes, db_name='scratch', coll_name='evict', doc_kb=64):
+    self.querier = MongoQuerier(host, port, db_name, coll_name)
+    self.megabytes = megabytes
+    self.doc_kb = doc_kb
+    self.name = 'scratch/%dMB' % megabytes
+
+  def _fill(self):
+    '''Helper function to create the scratch collection, if it is smaller
+       than it should be'''
+    docs = self.megabytes * 1024 // self.doc_kb
+    collection = self.querier.collection
+    if collection.count() >= docs:
+      return
+    collection.drop()
+    payload = 'x' * (self.doc_kb * 1024)
+    for start in range(0, docs, 100):
+      collection.insert([{"_id" : i, "Payload" : payload} for i in range(start, min(docs, start + 100))])
+
+  def evict(self):
+    '''Reads every document of the scratch collection'''
+    self._fill()
+    self.querier.streamQuery(count_bytes=False)
+
+
+class MongodRestartEvictor:
+  '''Class to evict caches by restarting local mongods. shards is a list of
+     (port, dbpath) pairs, restarted as shard servers with the given mongod
+     binary, like utils/MongoShardingSetup.py starts them. If drop_os_cache
+     is set, the OS page cache is dropped between the shutdown and the
+     restart, which needs root.'''
+  def __init__(self, mongod_path, shards, drop_os_cache=False, extra_args=None):
+    self.mongod_path = mongod_path
+    self.shards = shards
+    self.drop_os_cache = drop_os_cache
+    self.extra_args = extra_args or []
+    self.name = 'restart'
+    self.devnull = open(os.devnull, 'w+')
+
+  def shardingSetupShards(cls, n_shards=3, data_path=SHARDING_SETUP_DATA_PATH):
+    '''Returns the (port, dbpath) pairs of the shards started by
+       utils/MongoShardingSetup.py with its default settings'''
+    return [(SHARDING_SETUP_SHARD_PORT + i, os.path.join(data_path, 'shard_' + str(i)))
+            for i in range(1, n_shards + 1)]
+  shardingSetupShards = classmethod(shardingSetupShards)
+
+  def _portOpen(self, port):
+    '''Helper function to check whether something listens on a local port'''
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+      s.connect(('localhost', port))
+      return True
+    except socket.error:
+      return False
+    finally:
+      s.close()
+
+  def _waitForPort(self, port, is_open, timeout=60.0):
+    '''Helper function to wait until a local port opens (or closes)'''
+    deadline = time.time() + timeout
+    while self._portOpen(port) != is_open:
+      if time.time() > deadline:
+        raise RuntimeError('mongod on port %d did not %s in time' % (port, is_open and 'start' or 'stop'))
+      time.sleep(0.25)
+
+  def _dropOSCache(self):
+    '''Helper function to flush dirty pages and drop the OS page cache'''
+    subprocess.call(['sync'])
+    try:
+      with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+    except IOError, e:
+      print 'Could not drop the OS page cache (needs root):', e
+
+  def evict(self):
+    '''Shuts every mongod down, drops the OS page cache if asked to, and
+       starts them again'''
+    for port, dbpath in self.shards:
+      try:
+        MongoConnections.getConnection('localhost', port).admin.command('shutdown', force=True)
+      except Exception:
+        pass # the connection drops as the server shuts down
+      self._waitForPort(port, False)
+    if self.drop_os_cache:
+      self._dropOSCache()
+    for port, dbpath in self.shards:
+      subprocess.Popen([self.mongod_path, '--port', str(port), '--shardsvr', '--dbpath', dbpath] + self.extra_args,
+                       stdin=self.devnull, stdout=self.devnull, stderr=subprocess.STDOUT)
+    for port, dbpath in self.shards:
+      self._waitForPort(port, True)
+
+
+class TrialRunner:
+  '''Class to run benchmark callables as repeated trials. Every run does
+     warmup untimed calls, then timed calls until it has repetitions
+     samples or, if time_budget (seconds) is given, until the budget is
+     spent (with at least MIN_REPETITIONS samples either way). If an
+     evictor is given, runs are cold: the evictor runs before every timed
+     call, outside the timing. If log is given (e.g. a mongoCRUD's
+     addQuerySpeedEntry), every run's summary is logged with it.'''
+  def __init__(self, warmup=DEFAULT_WARMUP, repetitions=DEFAULT_REPETITIONS, time_budget=None, evictor=None,
+               log=None):
+    self.warmup = warmup
+    self.repetitions = repetitions
+    self.time_budget = time_budget
+    self.evictor = evictor
+    self.log = log
+
+  def _done(self, samples, started):
+    '''Helper function to decide whether a run has enough samples'''
+    if len(samples) < MIN_REPETITIONS:
+      return False
+    if self.time_budget is not None:
+      return LatencyHistogram.monotonicTime() - started >= self.time_budget
+    return len(samples) >= self.repetitions
+
+  def run(self, name, fun, args=(), kwargs=None, sample=None, tags=None):
+    '''Function to run fun(*args, **kwargs) as trials. Each sample is the
+       call's elapsed time in seconds, or sample(result, elapsed) if given
+       (e.g. to use a time the callable measured itself). Prints and returns
+       the "Trial Summary" log entry, which holds every sample and their
+       stats, and any extra tags.'''
+    kwargs = kwargs or {}
+    for i in range(self.warmup):
+      fun(*args, **kwargs)
+    samples = []
+    started = LatencyHistogram.monotonicTime()
+    while not self._done(samples, started):
+      if self.evictor:
+        self.evictor.evict()
+      start = LatencyHistogram.monotonicTime()
+      result = fun(*args, **kwargs)
+      elapsed = LatencyHistogram.monotonicTime() - start
+      if sample:
+        samples.append(float(sample(result, elapsed)))
+      else:
+        samples.append(elapsed)
+    entry = sampleStats(samples)
+    entry.update({"EntryType" : "Trial Summary",
+                  "Timestamp" : datetime.datetime.now(),
+                  "Name" : name,
+                  "Mode" : self.evictor and "cold" or "warm",
+                  "Evictor" : self.evictor and self.evictor.name or None,
+                  "Warmup" : self.warmup,
+                  "TimeBudget" : self.time_budget,
+                  "Samples" : samples})
+    entry.update(tags or {})
+    print '%-16s %-4s n=%3d  mean %9.4f  median %9.4f  sd %8.4f  95%% CI [%.4f, %.4f] (+-%.1f%%)' % (
+        name, entry["Mode"], entry["Count"], entry["Mean"], entry["Median"], entry["StdDev"],
+        entry["CI95Low"], entry["CI95High"], 100 * entry["RelativeCI95"])
+    if self.log:
+      self.log(entry)
+    return entry
+
+
+def runQueryTrials(runner, querier, builder=None):
+  '''Function to run the QueryBuilder queries (timed by streaming their
+     cursors, see MongoQuerier.streamQuery) and map-reduces as trials.
+     Returns the list of trial summaries.'''
+  builder = builder or QueryBuilder()
+  entries = []
+  for name, query in [("smallSet", builder.smallSetQuery), ("mediumSet", builder.mediumSetQuery),
+                      ("largeSet", builder.largeSetQuery), ("regex", builder.regexQuery),
+                      ("javascript", {"$where" : builder.javascriptQuery})]:
+    entries.append(runner.run(name, querier.streamQuery, (query,), {"count_bytes" : False},
+                              lambda result, elapsed: result["TotalSeconds"], {"Query" : str(query)}))
+  for name, map_fun, reduce_fun in [("totalVolume", builder.map_totalvolume, builder.reduce_totalvolume),
+                                    ("averageAsk", builder.map_averageAsk, builder.reduce_averageAsk)]:
+    entries.append(runner.run(name, querier.collectionMapReduce, (map_fun, reduce_fun, 'mr_' + name.lower()),
+                              tags={"Mapper" : str(map_fun)}))
+  return entries
+
+
+def usage():
+  '''Prints command line usage help of the script'''
+  print 'Sample Usage:'
+  print '\tpython TrialRunner.py --host [mongodb hostname] --port [mongodb port #] --db [mongodb name] --coll [collection name]'
+  print 'Optional Args:'
+  print '\t--warmup [untimed runs per benchmark]'
+  print '\t--reps [timed runs per benchmark]'
+  print '\t--budget [seconds of timed runs per benchmark, instead of --reps]'
+  print '\t--scratch [MB] (cold mode: read through a scratch collection before every trial)'
+  print '\t--restart [mongod binary] (cold mode: restart the MongoShardingSetup shards before every trial)'
+  print '\t--shards [# of MongoShardingSetup shards to restart, default 3]'
+  print '\t--dropcache (with --restart, also drop the OS page cache; needs root)'
+  print '\t--nolog (print the results only)'
+  print
+
+def main():
+  '''Function to run the query benchmarks as repeated trials from the
+     command line'''
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'coll=', 'warmup=', 'reps=', 'budget=', 'scratch=', 'restart=', 'shards=', 'dropcache', 'nolog'])
+  except getopt.error, msg:
+    usage()
+    print 'Error:', str(msg)
+    sys.exit(2)
+  host = '10.0.100.40'
+  port = 27017
+  db = 'data'
+  coll = 'historical'
+  warmup = DEFAULT_WARMUP
+  repetitions = DEFAULT_REPETITIONS
+  budget = None
+  scratch_mb = 0
+  mongod_path = ''
+  n_shards = 3
+  drop_cache = False
+  log = True
+  for option, arg in opts:
+    if option == '--host':
+      host = arg
+    elif option == '--port':
+      port = int(arg)
+    elif option == '--db':
+      db = arg
+    elif option == '--coll':
+      coll = arg
+    elif option == '--warmup':
+      warmup = int(arg)
+    elif option == '--reps':
+      repetitions = int(arg)
+    elif option == '--budget':
+      budget = float(arg)
+    elif option == '--scratch':
+      scratch_mb = int(arg)
+    elif option == '--restart':
+      mongod_path = arg
+    elif option == '--shards':
+      n_shards = int(arg)
+    elif option == '--dropcache':
+      drop_cache = True
+    elif option == '--nolog':
+      log = False
+  evictor = None
+  if mongod_path:
+    evictor = MongodRestartEvictor(mongod_path, MongodRestartEvictor.shardingSetupShards(n_shards), drop_cache)
+  elif scratch_mb:
+    evictor = ScratchCollectionEvictor(host, port, scratch_mb)
+  log_fun = None
+  if log:
+    logger = MongoLogger.mongoCRUD(host, port)
+    logger.initBenchmarkDB('benchmarks')
+    log_fun = logger.addQuerySpeedEntry
+  runner = TrialRunner(warmup, repetitions, budget, evictor, log_fun)
+  runQueryTrials(runner, MongoQuerier(host, port, db, coll))
+
+# Boilerplate code to get the program to run from the command line
+if __name__ == '__main__':
+  main()
@@ -17,9 +17,12 @@ import sys
 import getopt
 import pprint
 import MongoLogger
+import MongoConnections
 import DriveStats
 import DatabaseStatus
 import QueryStats
+import QueryLoad
+import TrialRunner
 
 
 def usage():
@@ -30,6 +33,21 @@ def usage():
   print '\t--hd (turn hd logging on)'
   print '\t--dbstats (turn database stats logging on)'
   print '\t--query (turn query time logging on)'
+  print '\t--streambatch [cursor batch size of the streamed query timings, with --query]'
+  print '\t--streamfields [comma separated projection of the streamed query timings, with --query]'
+  print '\t--queryload [comma separated client counts] (turn concurrent query load logging on)'
+  print '\t--loadseconds [duration of every query load step]'
+  print '\t--trials [timed runs per query] (turn repeated query trials, with 95% confidence intervals, on)'
+  print '\t--warmup [untimed runs per query before its trials]'
+  print '\t--trialbudget [seconds of timed runs per query, instead of a fixed --trials count]'
+  print '\t--cold [scratch collection MB read before every trial, to run them with cold caches]'
+  print '\t--retention [days raw insertion/query entries are kept; older history is kept as hourly and daily rollups]'
+  print 'Connection Args (shared by every component of the run):'
+  print '\t--poolsize [max sockets per connection pool]'
+  print '\t--connecttimeout [ms]'
+  print '\t--sockettimeout [ms]'
+  print '\t--waittimeout [ms a thread may wait for a pooled socket]'
+  print '\t--keepalive, --nokeepalive (turn socket keepalive on or off; needs pymongo 2.8 or later, left to the driver otherwise)'
   print
 
 def printLogEntry(entry):
@@ -41,7 +59,10 @@ def main():
      CONFIGURE THE COMMANDS BELOW, ONCE I KNOW WHAT THEY SHOULD BE!!!'''
   # Parse command line options (if present)
   try:
-    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'hd', 'dbstats', 'query', 'help'])
+    opts, args = getopt.getopt(sys.argv[1:], '', ['host=', 'port=', 'db=', 'hd', 'dbstats', 'query', 'help', 'retention=', 'queryload=', 'loadseconds=',
+                                                  'streambatch=', 'streamfields=', 'trials=', 'warmup=', 'trialbudget=', 'cold=',
+                                                  'poolsize=', 'connecttimeout=', 'sockettimeout=', 'waittimeout=',
+                                                  'keepalive', 'nokeepalive'])
   except getopt.error, msg:
     usage()
     print 'Error:', str(msg)
@@ -52,6 +73,16 @@ def main():
   hd_logging = False
   dbstats_logging = False
   query_logging = False
+  stream_batch = 0
+  stream_fields = None
+  load_clients = []
+  load_seconds = QueryLoad.DEFAULT_DURATION
+  trials = 0
+  warmup = TrialRunner.DEFAULT_WARMUP
+  trial_budget = None
+  cold_mb = 0
+  retention_days = None
+  connection_options = {}
   # Process options
   for option, arg in opts:
     if option == '--host':
@@ -66,15 +97,47 @@ def main():
       dbstats_logging = True
     elif option == '--query':
       query_logging = True
+    elif option == '--streambatch':
+      stream_batch = int(arg)
+    elif option == '--streamfields':
+      stream_fields = arg.split(',')
+    elif option == '--queryload':
+      load_clients = [int(count) for count in arg.split(',')]
+    elif option == '--loadseconds':
+      load_seconds = float(arg)
+    elif option == '--trials':
+      trials = int(arg)
+    elif option == '--warmup':
+      warmup = int(arg)
+    elif option == '--trialbudget':
+      trial_budget = float(arg)
+    elif option == '--cold':
+      cold_mb = int(arg)
     elif option == '--help':
       usage()
+    elif option == '--retention':
+      retention_days = float(arg)
+    elif option == '--poolsize':
+      connection_options["max_pool_size"] = int(arg)
+    elif option == '--connecttimeout':
+      connection_options["connectTimeoutMS"] = int(arg)
+    elif option == '--sockettimeout':
+      connection_options["socketTimeoutMS"] = int(arg)
+    elif option == '--waittimeout':
+      connection_options["waitQueueTimeoutMS"] = int(arg)
+    elif option == '--keepalive':
+      connection_options["socketKeepAlive"] = True
+    elif option == '--nokeepalive':
+      connection_options["socketKeepAlive"] = False
     else:
       assert False, "unhandled option"
   
   '''Carry out the benchmarks, given the command line options'''
+  # Every component below shares one connection (and socket pool)
+  MongoConnections.setConnectionOptions(**connection_options)
   # Get a logger instance to write benchmark data
   benchmarkDB = MongoLogger.mongoCRUD(host, port)
-  benchmarkDB.initBenchmarkDB(db)
+  benchmarkDB.initBenchmarkDB(db, retention_days)
   
   if hd_logging: # Do harddrive stats benchmarking
     driveStatsEntry = DriveStats.getDriveStatsLogEntry()
@@ -100,13 +163,34 @@ def main():
     query_entries_list.append(db_querier.getQueryExplainLogEntry(query_builder.smallSetQuery))
     query_entries_list.append(db_querier.getQueryExplainLogEntry(query_builder.mediumSetQuery))
     query_entries_list.append(db_querier.getQueryExplainLogEntry(query_builder.largeSetQuery))
+    # Streamed timings, which split server/transfer time from client time
+    for query in [query_builder.smallSetQuery, query_builder.mediumSetQuery, query_builder.largeSetQuery]:
+      query_entries_list.append(db_querier.getQueryStreamLogEntry(query, stream_fields, stream_batch))
     query_entries_list.append(db_querier.getCollectionMapReduceLogEntry(query_builder.map_totalvolume, query_builder.reduce_totalvolume, "mr_totalvolume"))
     query_entries_list.append(db_querier.getCollectionMapReduceLogEntry(query_builder.map_averageAsk, query_builder.reduce_averageAsk, "mr_averageask"))
     # Log all the query log entries
     benchmarkDB.addQuerySpeedEntry(query_entries_list)
   
+  if trials or trial_budget: # Do repeated query trials, for timings with confidence intervals
+    evictor = None
+    if cold_mb:
+      evictor = TrialRunner.ScratchCollectionEvictor(host, port, cold_mb)
+    runner = TrialRunner.TrialRunner(warmup, trials or TrialRunner.DEFAULT_REPETITIONS, trial_budget, evictor,
+                                     benchmarkDB.addQuerySpeedEntry)
+    TrialRunner.runQueryTrials(runner, QueryStats.MongoQuerier(host, port, "data", "historical"))
+  
+  if load_clients: # Do concurrent query load benchmarking
+    load_generator = QueryLoad.QueryLoadGenerator(host, port, "data", "historical", logger=benchmarkDB)
+    load_generator.run(load_clients, load_seconds)
+  
   '''INSERTION LOGGING OCCURS AUTOMATICALLY'''
   
+  # Log how the shared connections were used, and the pool wait times
+  benchmarkDB.addDbStatusEntry(MongoConnections.getPoolStatsLogEntry())
+  
+  # Roll up the days completed since the last run, before their raw entries expire
+  benchmarkDB.rollupBenchmarkHistory()
+  
   # Add more benchmarks here...
   
 
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+'''
+test_DataImporter.py - Unit tests of the tick data importers that need no
+database server. Run from the repository root with:
+
+  python -m unittest discover test
+
+'''
+
+
+__author__ = ('jasonrdsouza (Jason Dsouza)')
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import DataImporter
+import DataSinks
+
+
+class FailingSink(DataSinks.NullSink):
+  '''Null sink whose every write fails'''
+  def _write(self, entries):
+    raise IOError('write failed')
+
+
+class PipelinedImportTest(unittest.TestCase):
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    for i in range(3):
+      open(os.path.join(self.folder, 'ticks_%d.csv' % i), 'w').close()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def _importer(self, sink):
+    '''Helper function to make an importer that writes one document per
+       batch to sink, with every file parsed into 10 documents'''
+    importer = DataImporter.SinkDataImporter('null', batch_docs=1)
+    importer.logger = sink
+    importer._parseSingleRawTickFile = lambda folderpath, filepath, progress: iter(
+        [{"Symbol" : filepath, "Sequence" : i} for i in range(10)])
+    return importer
+
+  def _runPipelined(self, importer, **options):
+    '''Helper function to run a pipelined import in a thread, failing the
+       test if it does not finish in time. Returns the import's result.'''
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        importer.parseTickDataFolderPipelined(self.folder, **options)))
+    thread.daemon = True
+    thread.start()
+    thread.join(30)
+    self.assertFalse(thread.is_alive(), 'pipelined import hung')
+    return result[0]
+
+  def testImportsEveryDocument(self):
+    sink = DataSinks.NullSink()
+    stats = self._runPipelined(self._importer(sink), parsers=2, inserters=2, queue_depth=2)
+    self.assertEqual(sink.documents, 30)
+    self.assertEqual(sum([s["Documents"] for s in stats["Inserters"]]), 30)
+
+  def testInserterFailureDoesNotHang(self):
+    for attempt in range(10):
+      self.assertEqual(self._runPipelined(self._importer(FailingSink()), inserters=1, queue_depth=2), None)
+
+
+if __name__ == '__main__':
+  unittest.main()